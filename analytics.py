@@ -0,0 +1,179 @@
+"""Аналитика расходов: тренды по дням, неделям и месяцам, скользящие
+средние, сравнение с прошлым месяцем и средние по категориям.
+
+Дневные итоги пользователя (expense_daily) один раз читаются в компактные
+массивы NumPy — ExpenseSeries, а все показатели считаются векторными
+проходами по ним, без отдельного SQL-запроса на каждый период.
+Дни — в UTC, как и created_at в базе.
+"""
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Вид тренда: (сколько последних периодов показывать, окно скользящего среднего)
+TRENDS = {
+    'day': (14, 7),
+    'week': (12, 4),
+    'month': (12, 3),
+}
+
+
+def utc_today():
+    return datetime.now(timezone.utc).date()
+
+
+def day_number(day):
+    """Номер дня от 1970-01-01"""
+    return int(np.datetime64(day, 'D').astype(np.int64))
+
+
+class ExpenseSeries:
+    """Дневные итоги пользователя в массивах одинаковой длины, по возрастанию дня.
+
+    days — номер дня от 1970-01-01, category — индекс в category_ids,
+    totals и counts — сумма и число расходов категории за день.
+    """
+
+    def __init__(self, days, category, category_ids, totals, counts):
+        self.days = days
+        self.category = category
+        self.category_ids = category_ids
+        self.totals = totals
+        self.counts = counts
+
+    @classmethod
+    def from_rows(cls, rows, live_categories=None):
+        """Строит ряды из строк (день 'YYYY-MM-DD', category_id, сумма, число расходов).
+
+        live_categories — id неудалённых категорий; итоги остальных отбрасываются.
+        """
+        if rows:
+            days, category_ids, totals, counts = zip(*rows)
+        else:
+            days = category_ids = totals = counts = ()
+        days = np.array(days, dtype='datetime64[D]').astype(np.int32)
+        category_ids = np.array(category_ids, dtype=np.int64)
+        totals = np.array(totals, dtype=np.float64)
+        counts = np.array(counts, dtype=np.int32)
+        if live_categories is not None:
+            keep = np.isin(category_ids, np.fromiter(live_categories, dtype=np.int64))
+            days, category_ids, totals, counts = days[keep], category_ids[keep], totals[keep], counts[keep]
+        unique_ids, category = np.unique(category_ids, return_inverse=True)
+        return cls(days, category.astype(np.int32), unique_ids, totals, counts)
+
+    def __len__(self):
+        return len(self.days)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.days, self.category, self.category_ids, self.totals, self.counts))
+
+    def by_category(self, mask, values=None):
+        """Сумма values (по умолчанию — totals) по категориям среди строк mask"""
+        values = self.totals if values is None else values
+        # На пустой выборке bincount возвращает целые — приводим к float явно
+        return np.bincount(
+            self.category[mask], weights=values[mask], minlength=len(self.category_ids)
+        ).astype(np.float64, copy=False)
+
+
+# ========== ПЕРИОДЫ ==========
+def period_numbers(days, period):
+    """Номер периода для каждого дня: сам день, неделя с понедельника или месяц"""
+    days = np.asarray(days, dtype=np.int64)
+    if period == 'day':
+        return days
+    if period == 'week':
+        # 1970-01-01 — четверг: сдвиг на 3 дня начинает недели с понедельника
+        return (days + 3) // 7
+    if period == 'month':
+        return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    raise ValueError(f"Неизвестный период: {period}")
+
+
+def period_starts(numbers, period):
+    """Первый день каждого периода по его номеру (datetime64[D])"""
+    numbers = np.asarray(numbers, dtype=np.int64)
+    if period == 'day':
+        return numbers.astype('datetime64[D]')
+    if period == 'week':
+        return (numbers * 7 - 3).astype('datetime64[D]')
+    if period == 'month':
+        return numbers.astype('datetime64[M]').astype('datetime64[D]')
+    raise ValueError(f"Неизвестный период: {period}")
+
+
+def rolling_mean(values, window):
+    """Скользящее среднее за window последних значений (в начале — по тем, что есть)"""
+    sums = np.cumsum(values, dtype=np.float64)
+    sums[window:] = sums[window:] - sums[:-window]
+    return sums / np.minimum(np.arange(1, len(values) + 1), window)
+
+
+def period_changes(values):
+    """Изменение к предыдущему периоду в долях; nan, где сравнивать не с чем"""
+    values = np.asarray(values, dtype=np.float64)
+    changes = np.full(len(values), np.nan)
+    previous = values[:-1]
+    np.divide(values[1:] - previous, previous, out=changes[1:], where=previous > 0)
+    return changes
+
+
+def horizon(today=None):
+    """Первый день, нужный хоть одному показателю ('YYYY-MM-DD'): старше итоги не читаем"""
+    day = day_number(today or utc_today())
+    first = day - 30  # средние за 30 дней и прошлый месяц в сравнении — ближе
+    for period, (count, window) in TRENDS.items():
+        last = int(period_numbers(day, period))
+        first = min(first, day_number(period_starts(last - count - window + 2, period)))
+    return str(np.datetime64(first, 'D'))
+
+
+# ========== ПОКАЗАТЕЛИ ==========
+def trend(series, period, count, window=1, today=None):
+    """Суммы за последние count периодов до текущего включительно.
+
+    Возвращает (первые дни периодов, суммы, скользящее среднее за window
+    периодов). Пустые периоды — нули; среднее в начале окна учитывает и
+    периоды до него, поэтому ряд читается сразу с первой строки.
+    """
+    last = int(period_numbers(day_number(today or utc_today()), period))
+    span = count + window - 1
+    offsets = period_numbers(series.days, period) - (last - span + 1)
+    mask = (offsets >= 0) & (offsets < span)
+    totals = np.bincount(offsets[mask], weights=series.totals[mask], minlength=span).astype(np.float64)
+    averages = rolling_mean(totals, window)
+    starts = period_starts(np.arange(last - count + 1, last + 1), period)
+    return starts, totals[-count:], averages[-count:]
+
+
+def month_over_month(series, today=None):
+    """Текущий месяц до сегодняшнего дня против тех же чисел прошлого месяца.
+
+    Возвращает (сумм в этом месяце, сумм в прошлом) по category_ids и число
+    дней в сравнении. Если прошлый месяц короче, он берётся до конца.
+    """
+    today = today or utc_today()
+    day = day_number(today)
+    month = np.datetime64(today, 'M')
+    this_start = day_number(month)
+    previous_start = day_number(month - 1)
+    previous_end = min(previous_start + (day - this_start), this_start - 1)
+
+    days = series.days
+    current = series.by_category((days >= this_start) & (days <= day))
+    previous = series.by_category((days >= previous_start) & (days <= previous_end))
+    return current, previous, day - this_start + 1
+
+
+def category_averages(series, days=30, today=None):
+    """Средние по категориям за последние days дней, включая сегодняшний.
+
+    Возвращает массивы по category_ids: сумма, число расходов, средний чек
+    (сумма на один расход) и средний расход в день.
+    """
+    mask = series.days > day_number(today or utc_today()) - days
+    totals = series.by_category(mask)
+    counts = series.by_category(mask, series.counts)
+    per_expense = np.divide(totals, counts, out=np.zeros_like(totals), where=counts > 0)
+    return totals, counts.astype(np.int64), per_expense, totals / days
@@ -0,0 +1,154 @@
+"""Аналитика на NumPy против отдельных SQL-запросов на каждый период.
+
+Для выборки пользователей сгенерированной базы (benchmarks.datagen)
+считается один и тот же набор показателей — тренды по дням, неделям
+и месяцам со скользящим средним, сравнение с прошлым месяцем и средние
+по категориям за 30 дней — двумя способами:
+- analytics: один запрос дневных итогов, дальше векторные проходы;
+- sql: запрос SUM по expense_daily на каждый период и GROUP BY
+  по категориям для сравнения месяцев и средних.
+Результаты сверяются, печатается время на пользователя; отдельно —
+время по уже прочитанным рядам (так бот отвечает из кэша, пока данные
+пользователя не менялись).
+
+Запуск: python -m benchmarks.analytics_bench --users 2000 --expenses 500000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+import analytics
+from benchmarks.datagen import generate
+from database import Database
+
+
+def load_series(db, user_id, today):
+    categories = [row[0] for row in db.get_user_categories(user_id)]
+    rows = db.get_daily_totals(user_id, analytics.horizon(today))
+    return analytics.ExpenseSeries.from_rows(rows, categories)
+
+
+def with_numpy(db, user_id, today):
+    return compute(load_series(db, user_id, today), today)
+
+
+def compute(series, today):
+    """Все показатели по готовым рядам — так бот отвечает, пока данные не менялись"""
+    result = {}
+    for period, (count, window) in analytics.TRENDS.items():
+        _, totals, averages = analytics.trend(series, period, count, window, today=today)
+        result[period] = (totals, averages)
+    current, previous, _ = analytics.month_over_month(series, today=today)
+    totals, counts, _, _ = analytics.category_averages(series, days=30, today=today)
+    by_id = lambda values: dict(zip(series.category_ids.tolist(), values.tolist()))
+    result['month_over_month'] = (by_id(current), by_id(previous))
+    result['averages'] = (by_id(totals), by_id(counts))
+    return result
+
+
+def _sum_by_category(db, user_id, start, end):
+    db.cursor.execute('''
+        SELECT d.category_id, SUM(d.total), SUM(d.count)
+        FROM expense_daily d
+        JOIN user_categories uc ON uc.id = d.category_id
+        WHERE d.user_id = ? AND d.day >= ? AND d.day <= ? AND uc.is_deleted = 0
+        GROUP BY d.category_id
+    ''', (user_id, start, end))
+    return {category_id: (total, count) for category_id, total, count in db.cursor.fetchall()}
+
+
+def with_sql(db, user_id, today):
+    result = {}
+    last_day = analytics.day_number(today)
+    for period, (count, window) in analytics.TRENDS.items():
+        last = int(analytics.period_numbers(last_day, period))
+        bounds = analytics.period_starts(np.arange(last - count - window + 2, last + 2), period)
+        totals = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            db.cursor.execute('''
+                SELECT COALESCE(SUM(d.total), 0)
+                FROM expense_daily d
+                JOIN user_categories uc ON uc.id = d.category_id
+                WHERE d.user_id = ? AND d.day >= ? AND d.day < ? AND uc.is_deleted = 0
+            ''', (user_id, str(start), str(end)))
+            totals.append(db.cursor.fetchone()[0])
+        averages = [
+            sum(totals[max(0, i - window + 1):i + 1]) / min(i + 1, window) for i in range(len(totals))
+        ]
+        result[period] = (np.array(totals[-count:]), np.array(averages[-count:]))
+
+    month = np.datetime64(today, 'M')
+    this_start = analytics.day_number(month)
+    previous_start = analytics.day_number(month - 1)
+    previous_end = min(previous_start + (last_day - this_start), this_start - 1)
+    day = lambda number: str(np.datetime64(number, 'D'))
+    current = _sum_by_category(db, user_id, day(this_start), day(last_day))
+    previous = _sum_by_category(db, user_id, day(previous_start), day(previous_end))
+    window = _sum_by_category(db, user_id, day(last_day - 29), day(last_day))
+    result['month_over_month'] = (
+        {k: v[0] for k, v in current.items()}, {k: v[0] for k, v in previous.items()}
+    )
+    result['averages'] = ({k: v[0] for k, v in window.items()}, {k: v[1] for k, v in window.items()})
+    return result
+
+
+def same(a, b):
+    """Сверка результатов: в словарях у NumPy есть и нулевые категории, у SQL — нет"""
+    for key in a:
+        if isinstance(a[key][0], dict):
+            for left, right in zip(a[key], b[key]):
+                if any(abs(left.get(k, 0) - right.get(k, 0)) > 1e-6 for k in left.keys() | right.keys()):
+                    return False
+        elif not all(np.allclose(x, y) for x, y in zip(a[key], b[key])):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--expenses', type=int, default=500_000)
+    parser.add_argument('--samples', type=int, default=200, help="пользователей в замере")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'analytics.db')
+        generate(path, args.users, args.expenses, seed=args.seed)
+        db = Database(path)
+        today = analytics.utc_today()
+        user_ids = random.Random(args.seed).sample(range(1, args.users + 1), min(args.samples, args.users))
+        timings = {'analytics': [], 'sql': [], 'кэш рядов': []}
+        mismatches = 0
+        try:
+            for user_id in user_ids:
+                results = {}
+                for name, func in (('analytics', with_numpy), ('sql', with_sql)):
+                    started = time.perf_counter()
+                    results[name] = func(db, user_id, today)
+                    timings[name].append(time.perf_counter() - started)
+                mismatches += not same(results['analytics'], results['sql'])
+
+                series = load_series(db, user_id, today)
+                started = time.perf_counter()
+                compute(series, today)
+                timings['кэш рядов'].append(time.perf_counter() - started)
+        finally:
+            db.close()
+
+    print(f"Пользователей: {len(user_ids)}, база: {args.users} пользователей, {args.expenses:,} расходов")
+    for name, values in timings.items():
+        print(f"  {name:<10} медиана {statistics.median(values) * 1000:7.2f} мс, "
+              f"p95 {sorted(values)[int(len(values) * 0.95)] * 1000:7.2f} мс, сумма {sum(values):6.2f} с")
+    print(f"  ускорение: {sum(timings['sql']) / sum(timings['analytics']):.1f}x с чтением, "
+          f"{sum(timings['sql']) / sum(timings['кэш рядов']):.1f}x по кэшу рядов; расхождений: {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,120 @@
+"""Микробенчмарк Database: время публичных методов на базах разного размера.
+
+Для каждого размера генерируется (или берётся из --data-dir) база
+benchmarks.datagen, копируется во временный каталог, и каждый метод
+вызывается для случайной выборки пользователей. Печатаются медиана и p95
+на вызов и рост относительно самой маленькой базы — по ним видно,
+что метод не деградирует с ростом таблицы расходов.
+
+Запуск: python -m benchmarks.db_bench --sizes 10000,100000,1000000 --data-dir /tmp/finance-bench
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from benchmarks.datagen import generate
+from benchmarks.stats import percentile
+from database import Database
+
+
+def _categories(db, user_id):
+    return [row[0] for row in db.get_user_categories(user_id)]
+
+
+# (метод, аргументы по user_id); порядок важен: очистка статистики — последней
+METHODS = [
+    ('get_category_stats', lambda db, user_id: (user_id, 30)),
+    ('get_today_expenses', lambda db, user_id: (user_id,)),
+    ('get_recent_expenses', lambda db, user_id: (user_id, 10)),
+    ('add_expense', lambda db, user_id: (user_id, _categories(db, user_id)[0], 100.0)),
+    ('clear_user_statistics', lambda db, user_id: (user_id,)),
+]
+
+
+def dataset(data_dir, users, expenses, seed):
+    """Путь к базе нужного размера; генерируется, если её ещё нет"""
+    path = os.path.join(data_dir, f'finance-u{users}-e{expenses}-s{seed}.db')
+    if not os.path.exists(path):
+        print(f"Генерация {os.path.basename(path)}...")
+        generate(path + '.tmp', users, expenses, seed=seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def measure(path, users, calls, seed):
+    rng = random.Random(seed)
+    # Каждый метод — на своих пользователях, чтобы очистка не влияла на остальные замеры
+    samples = rng.sample(range(1, users + 1), min(users, calls * len(METHODS)))
+    db = Database(path)
+    results = {}
+    try:
+        for number, (method, make_args) in enumerate(METHODS):
+            user_ids = samples[number::len(METHODS)]
+            func = getattr(db, method)
+            for user_id in user_ids[:5]:  # прогрев кэша страниц
+                if method not in ('add_expense', 'clear_user_statistics'):
+                    func(*make_args(db, user_id))
+            timings = []
+            for user_id in user_ids:
+                args = make_args(db, user_id)
+                started = time.perf_counter()
+                func(*args)
+                timings.append(time.perf_counter() - started)
+            results[method] = {
+                'median_us': round(statistics.median(timings) * 1e6, 1),
+                'p95_us': round(percentile(timings, 95) * 1e6, 1),
+            }
+    finally:
+        db.close()
+    return results
+
+
+def print_curves(sizes, results):
+    print(f"\n{'метод':<24}" + ''.join(f"{size:>16,}" for size in sizes) + "   рост")
+    for method, _ in METHODS:
+        medians = [results[size][method]['median_us'] for size in sizes]
+        growth = medians[-1] / medians[0] if medians[0] else 0.0
+        print(f"{method:<24}" + ''.join(f"{value:>13.1f} мкс" for value in medians) + f"  {growth:5.1f}x")
+    print("(медиана на вызов; p95 — в JSON)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="числа расходов через запятую")
+    parser.add_argument('--calls', type=int, default=200, help="вызовов каждого метода")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--data-dir', help="каталог для сгенерированных баз (переиспользуются между запусками)")
+    parser.add_argument('--output', help="сохранить результат в JSON")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        os.makedirs(data_dir, exist_ok=True)
+        for size in sizes:
+            source = dataset(data_dir, args.users, size, args.seed)
+            # Замеры меняют базу (добавление, очистка) — работаем с копией
+            copy = os.path.join(tmp, 'bench.db')
+            shutil.copyfile(source, copy)
+            results[size] = measure(copy, args.users, args.calls, args.seed)
+            os.remove(copy)
+            print(f"{size:,} расходов: " + ', '.join(
+                f"{method} {stats['median_us']:.0f} мкс" for method, stats in results[size].items()
+            ))
+
+    print_curves(sizes, results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'users': args.users, 'calls': args.calls, 'seed': args.seed, 'results': results},
+                      file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""Проверка рассылки дайджестов: падение посреди рассылки, продолжение и лимиты.
+
+На сгенерированной базе (benchmarks.datagen) дневной дайджест за вчера
+рассылается в отдельном процессе через заглушку Bot API, которая
+отвечает с задержкой, изредка возвращает 429 и сетевые ошибки, а часть
+пользователей «заблокировала бота» (403). Процесс убивается SIGKILL
+посреди рассылки, затем рассылка запускается заново и должна продолжиться
+с сохранённого места, а третий запуск — не отправить ничего.
+
+Проверяется: каждый пользователь с тратами за вчера получил сводку, суммы
+в ней совпадают с расходами из expenses, никто лишний её не получил,
+повторов не больше, чем успевает уйти между сохранениями прогресса,
+а заглушка ни разу не ответила 429 из-за превышения лимита. Эти условия
+проверяет tests/test_digest.py, скрипт печатает отчёт о прогоне.
+
+Запуск: python -m benchmarks.digest_check --users 3000 --rate 400
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, deque
+
+from database import Database
+
+# Заглушка считает 429 «за дело», если за последнюю секунду попыток больше rate + burst + запас
+FLOOD_MARGIN = 1.1
+BLOCKED_SHARE = 0.02
+# Дочерний процесс запускается как модуль пакета benchmarks из корня репозитория
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def child(args):
+    """Одна рассылка в этом процессе; все попытки отправки пишутся в args.log"""
+    from aiogram import Bot
+    from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+    from aiogram.methods import SendMessage
+
+    import digest
+    from benchmarks.fake_telegram import FakeTelegramSession
+    from database import AsyncDatabase
+
+    rng = random.Random(args.seed + os.getpid())
+    log = open(args.log, 'a', encoding='utf-8')
+    attempts = deque()
+    limit = args.rate * FLOOD_MARGIN + args.burst
+
+    class FlakySession(FakeTelegramSession):
+        async def make_request(self, bot, method, timeout=None):
+            if isinstance(method, SendMessage):
+                await asyncio.sleep(rng.uniform(0.005, 0.04))
+                now = time.monotonic()
+                attempts.append(now)
+                while attempts[0] < now - 1:
+                    attempts.popleft()
+                record = {'t': time.time(), 'chat_id': method.chat_id}
+                try:
+                    if len(attempts) > limit:
+                        record['result'] = 'flood'
+                        raise TelegramRetryAfter(method=method, message='Too Many Requests', retry_after=1)
+                    if rng.random() < 0.002:
+                        record['result'] = '429'
+                        raise TelegramRetryAfter(method=method, message='Too Many Requests', retry_after=1)
+                    if method.chat_id % int(1 / BLOCKED_SHARE) == 0:
+                        record['result'] = '403'
+                        raise TelegramForbiddenError(method=method, message='Forbidden: bot was blocked by the user')
+                    if rng.random() < 0.01:
+                        record['result'] = 'network'
+                        raise TelegramNetworkError(method=method, message='Connection reset by peer')
+                    record['result'] = 'ok'
+                    record['text'] = method.text
+                finally:
+                    log.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    log.flush()
+            return await super().make_request(bot, method, timeout)
+
+    db = AsyncDatabase(args.child, readers=2)
+    bot = Bot('123456:DIGEST', session=FlakySession())
+    sender = digest.DigestSender(bot, digest.SendLimiter(args.rate, args.burst), backoff=0.05)
+    start = digest.latest_period('day', digest.utc_now(), 0)
+    print('started', flush=True)
+    try:
+        progress = await digest.run_digest(db, sender, 'day', start, page_size=args.page_size,
+                                           concurrency=args.concurrency, checkpoint_interval=args.checkpoint)
+    finally:
+        await db.close()
+        log.close()
+    print(json.dumps(progress.snapshot() if progress else None), flush=True)
+
+
+def run_child(args, path, log, kill_after=None):
+    command = [
+        sys.executable, '-m', 'benchmarks.digest_check', '--child', path, '--log', log,
+        '--rate', str(args.rate), '--burst', str(args.burst), '--seed', str(args.seed),
+        '--concurrency', str(args.concurrency), '--page-size', str(args.page_size),
+        '--checkpoint', str(args.checkpoint),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, cwd=ROOT)
+    assert process.stdout.readline().strip() == 'started'
+    if kill_after is None:
+        output = process.stdout.read()
+        process.wait()
+        return json.loads(output.strip().splitlines()[-1])
+    time.sleep(kill_after)
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+    return None
+
+
+def expected_totals(path, start, end):
+    """Эталон: траты за вчера по неудалённым категориям прямо из expenses, {user_id: (сумма, число)}"""
+    db = Database(path)
+    db.cursor.execute('''
+        SELECT e.user_id, SUM(e.amount), COUNT(*)
+        FROM expenses e
+        JOIN user_categories uc ON uc.id = e.category_id
+        WHERE uc.is_deleted = 0 AND e.created_at >= ? AND e.created_at < ?
+        GROUP BY e.user_id
+    ''', (start, end))
+    result = {user_id: (total, count) for user_id, total, count in db.cursor.fetchall()}
+    db.close()
+    return result
+
+
+def max_per_second(times):
+    times.sort()
+    best, left = 0, 0
+    for right, moment in enumerate(times):
+        while times[left] < moment - 1:
+            left += 1
+        best = max(best, right - left + 1)
+    return best
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=3000)
+    parser.add_argument('--expenses', type=int, default=200_000)
+    parser.add_argument('--rate', type=float, default=400)
+    parser.add_argument('--burst', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--checkpoint', type=float, default=0.2)
+    parser.add_argument('--kill-after', type=float, default=1.5, help="через сколько секунд убить первую рассылку")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--log', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def run_scenario(args, tmp):
+    """Рассылка с падением, продолжение и повторный запуск на базе в каталоге tmp"""
+    import digest
+    from benchmarks.datagen import generate
+
+    path = os.path.join(tmp, 'digest.db')
+    log = os.path.join(tmp, 'sent.jsonl')
+    generate(path, args.users, args.expenses, seed=args.seed)
+    start = digest.latest_period('day', digest.utc_now(), 0)
+    _, period_start, end = digest.period_bounds('day', start)
+    expected = expected_totals(path, period_start, end)
+
+    run_child(args, path, log, kill_after=args.kill_after)
+    db = Database(path)
+    crashed_at = db.get_digest_run('day', period_start)
+    db.close()
+    resumed = run_child(args, path, log)
+    again = run_child(args, path, log)
+
+    with open(log, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    return summarize(args, expected, records, crashed_at, resumed, again)
+
+
+def summarize(args, expected, records, crashed_at, resumed, again):
+    results = Counter(record['result'] for record in records)
+    delivered = Counter(record['chat_id'] for record in records if record['result'] == 'ok')
+    wrong = 0
+    for record in records:
+        if record['result'] == 'ok':
+            total, count = expected.get(record['chat_id'], (None, None))
+            match = re.search(r'Потрачено: ([\d.]+) руб\., расходов: (\d+)', record['text'])
+            if total is None or abs(float(match[1]) - total) > 0.006 or int(match[2]) != count:
+                wrong += 1
+    blocked = {user_id for user_id in expected if user_id % int(1 / BLOCKED_SHARE) == 0}
+    return {
+        'expected': expected,
+        'blocked': blocked,
+        'crashed_at': crashed_at,
+        'resumed': resumed,
+        'again': again,
+        'results': results,
+        'peak_per_second': max_per_second([record['t'] for record in records]),
+        'missing': set(expected) - blocked - set(delivered),
+        'unexpected': set(delivered) - set(expected),
+        'wrong': wrong,
+        'duplicates': sum(n - 1 for n in delivered.values()),
+        # Повтор возможен только для сообщений, ушедших после последнего сохранения прогресса
+        'allowed_duplicates': int(args.rate * args.checkpoint) + args.burst + args.concurrency,
+    }
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        asyncio.run(child(args))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = run_scenario(args, tmp)
+    crashed_at = report['crashed_at']
+    print(f"Активных вчера: {len(report['expected'])} из {args.users}, заблокировали бота: {len(report['blocked'])}")
+    print(f"Падение: сохранено до пользователя {crashed_at and crashed_at[0]}, отправлено {crashed_at and crashed_at[1]}")
+    print(f"Продолжение: {report['resumed']}; повторный запуск: {report['again']}")
+    print(f"Попытки: {dict(report['results'])}; пик {report['peak_per_second']} в секунду при лимите {args.rate:.0f}")
+    print(f"Не получили: {len(report['missing'])}, лишние: {len(report['unexpected'])}, "
+          f"неверные суммы: {report['wrong']}, "
+          f"повторы: {report['duplicates']} (допустимо {report['allowed_duplicates']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Заглушка Telegram Bot API для бенчмарков: без сети, с учётом ответов бота.
+
+FakeTelegramSession подставляется в Bot(session=...). Она отвечает на
+методы бота правдоподобными объектами, отдаёт обновления в getUpdates
+из очереди и вызывает on_send для каждого сообщения, отправленного ботом.
+
+create_fake_api — то же самое по HTTP, для ботов в других процессах
+(TELEGRAM_API_URL=http://127.0.0.1:<порт>).
+"""
+import asyncio
+import itertools
+import time
+from datetime import datetime
+
+from aiohttp import web
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import (
+    GetUpdates, GetMe, SendMessage, SendPhoto, SendDocument, SetWebhook, DeleteWebhook
+)
+from aiogram.types import Chat, Document, Message, PhotoSize, Update, User
+
+BOT_USER = User(id=1, is_bot=True, first_name='FinanceHellBot', username='finance_hell_bot')
+
+
+def make_update(update_id, user_id, text):
+    """Обновление в том виде, в каком его присылает Telegram (JSON)"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': text,
+        },
+    }
+
+
+class FakeTelegramSession(BaseSession):
+    def __init__(self, on_send=None):
+        super().__init__()
+        self.on_send = on_send
+        self.updates = asyncio.Queue()
+        self.calls = 0
+        self._ids = itertools.count(1)
+
+    def feed(self, raw_update):
+        """Кладёт обновление в очередь для getUpdates (режим polling)"""
+        self.updates.put_nowait(Update.model_validate(raw_update))
+
+    async def _get_updates(self, method):
+        # Долгий опрос: ждём первое обновление, остальные забираем пачкой
+        try:
+            first = await asyncio.wait_for(self.updates.get(), timeout=min(method.timeout or 0, 1) or 0.05)
+        except asyncio.TimeoutError:
+            return []
+        result = [first]
+        while len(result) < (method.limit or 100) and not self.updates.empty():
+            result.append(self.updates.get_nowait())
+        return result
+
+    def _message(self, method, **fields):
+        return Message(
+            message_id=next(self._ids),
+            date=datetime.now(),
+            chat=Chat(id=method.chat_id, type='private'),
+            from_user=BOT_USER,
+            **fields
+        )
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if isinstance(method, GetUpdates):
+            return await self._get_updates(method)
+        if isinstance(method, GetMe):
+            return BOT_USER
+        if isinstance(method, (SetWebhook, DeleteWebhook)):
+            return True
+
+        if isinstance(method, SendMessage):
+            result = self._message(method, text=method.text)
+        elif isinstance(method, SendPhoto):
+            file_id = method.photo if isinstance(method.photo, str) else f'photo{next(self._ids)}'
+            result = self._message(method, caption=method.caption, photo=[
+                PhotoSize(file_id=file_id, file_unique_id=file_id, width=1000, height=1000)
+            ])
+        elif isinstance(method, SendDocument):
+            result = self._message(method, caption=method.caption, document=Document(
+                file_id=f'doc{next(self._ids)}', file_unique_id='doc'
+            ))
+        else:
+            return True
+
+        if self.on_send is not None:
+            self.on_send(method.chat_id, method)
+        return result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+def create_fake_api(on_send=None):
+    """aiohttp-приложение, отвечающее на /bot<токен>/<метод> как Bot API"""
+    ids = itertools.count(1)
+
+    async def handle_method(request):
+        method = request.match_info['method'].lower()
+        if method == 'getme':
+            result = BOT_USER.model_dump(exclude_none=True)
+        elif method in ('sendmessage', 'sendphoto', 'senddocument'):
+            fields = await request.post() if request.content_type != 'application/json' else await request.json()
+            chat_id = int(fields['chat_id'])
+            message_id = next(ids)
+            result = {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER.model_dump(exclude_none=True),
+            }
+            if method == 'sendmessage':
+                result['text'] = fields.get('text', '')
+            elif method == 'sendphoto':
+                result['photo'] = [{'file_id': f'photo{message_id}', 'file_unique_id': f'photo{message_id}',
+                                    'width': 1000, 'height': 1000}]
+            else:
+                result['document'] = {'file_id': f'doc{message_id}', 'file_unique_id': 'doc'}
+            if on_send is not None:
+                on_send(chat_id, method)
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', handle_method)
+    return app
@@ -0,0 +1,212 @@
+"""Нагрузочный тест бота: тысячи пользователей проходят типичные сценарии.
+
+Настоящий диспетчер из bot.create_app() получает обновления через feed_update,
+ответы уходят в заглушку Telegram (benchmarks.fake_telegram), сети нет.
+Сценарий пользователя: /start, несколько расходов (категория → сумма),
+статистика и редактирование категорий (добавить новую, удалить её).
+Шаги одного пользователя идут по очереди, как у живого человека,
+пользователи — параллельно.
+
+Результат — пропускная способность, p50/p95/p99 по каждому шагу и
+пиковый RSS; --output сохраняет его в JSON, --compare сравнивает
+с сохранённым прогоном.
+
+Запуск: python -m benchmarks.load --users 2000 --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from benchmarks.stats import percentile
+
+
+def summarize(values):
+    values_ms = [value * 1000 for value in values]
+    return {
+        'count': len(values_ms),
+        'p50_ms': round(percentile(values_ms, 50), 3),
+        'p95_ms': round(percentile(values_ms, 95), 3),
+        'p99_ms': round(percentile(values_ms, 99), 3),
+        'max_ms': round(max(values_ms), 3),
+    }
+
+
+def peak_rss_mb(worker_pids):
+    # ru_maxrss в Linux — в килобайтах. Отрисовщики запускает forkserver, они не наши
+    # дочерние процессы и в RUSAGE_CHILDREN не попадают: пик берём из /proc (VmHWM)
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    workers = [0]
+    for pid in worker_pids:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                workers += [int(line.split()[1]) for line in f if line.startswith('VmHWM:')]
+        except OSError:
+            pass
+    return round(own, 1), round(max(workers) / 1024, 1)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def user_script(rng, expenses):
+    """Шаги одного пользователя: (название шага, функция, возвращающая текст)"""
+    steps = [('start', lambda buttons: '/start')]
+    for _ in range(expenses):
+        steps.append(('select_category', lambda buttons: rng.choice(buttons)))
+        steps.append(('amount', lambda buttons: f"{rng.randint(50, 5000)}.{rng.randint(0, 99):02d}"))
+    steps += [
+        ('stats', lambda buttons: "📊 Статистика"),
+        ('settings', lambda buttons: "⚙️ Настройки"),
+        ('edit_mode', lambda buttons: "📝 Редактировать категории"),
+        ('new_category', lambda buttons: "➕ Новая категория"),
+        ('category_name', lambda buttons: "Такси"),
+        ('category_emoji', lambda buttons: "🚕"),
+        ('delete_category', lambda buttons: "🚕 Такси"),
+        ('finish_editing', lambda buttons: "✅ Завершить редактирование"),
+    ]
+    return steps
+
+
+async def run(args):
+    from aiogram.types import Update
+    from benchmarks.fake_telegram import FakeTelegramSession, make_update
+    import bot as bot_module
+
+    session = FakeTelegramSession()
+    app = bot_module.create_app('123456:BENCHMARK', session=session)
+    app.charts.start()
+
+    rng = random.Random(args.seed)
+    update_ids = iter(range(1, 10 ** 9))
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def simulate(user_id):
+        # Свой генератор у каждого пользователя: сценарий не зависит от того,
+        # в каком порядке цикл событий переключается между пользователями
+        user_rng = random.Random(f"{args.seed}:{user_id}")
+        buttons = None
+        async with semaphore:
+            for step, make_text in user_script(user_rng, args.expenses):
+                if buttons is None and step != 'start':
+                    categories = await app.db.get_user_categories(user_id)
+                    buttons = [f"{emoji} {name}" for _, name, emoji in categories]
+                update = Update.model_validate(make_update(next(update_ids), user_id, make_text(buttons)))
+                started = time.perf_counter()
+                try:
+                    await app.dp.feed_update(app.bot, update)
+                except Exception:
+                    errors[step] += 1
+                latencies[step].append(time.perf_counter() - started)
+
+    users = list(range(1, args.users + 1))
+    rng.shuffle(users)
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate(user_id) for user_id in users))
+    elapsed = time.perf_counter() - started
+
+    worker_pids = list(app.charts._pool._processes) if app.charts._pool is not None else []
+    rss_main, rss_children = peak_rss_mb(worker_pids)
+    await app.dp.emit_shutdown(bot=app.bot)
+    await app.close()
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        'benchmark': 'load',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git': git_revision(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'params': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'updates': total,
+        'seconds': round(elapsed, 3),
+        'updates_per_sec': round(total / elapsed, 1),
+        'overall': summarize([value for values in latencies.values() for value in values]),
+        'steps': {step: summarize(values) for step, values in latencies.items()},
+        'errors': dict(errors),
+        'telegram_calls': session.calls,
+        'peak_rss_mb': rss_main,
+        'peak_rss_children_mb': rss_children,
+    }
+
+
+def print_result(result):
+    overall = result['overall']
+    print(
+        f"Пользователей: {result['params']['users']}, обновлений: {result['updates']}, "
+        f"{result['seconds']:.1f} с, {result['updates_per_sec']:.0f} обновлений/с"
+    )
+    print(f"{'шаг':<18}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for step, stats in [*result['steps'].items(), ('ВСЕГО', overall)]:
+        print(f"{step:<18}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    print(f"Пиковый RSS: бот {result['peak_rss_mb']} МБ, отрисовщики {result['peak_rss_children_mb']} МБ")
+    if result['errors']:
+        print(f"Ошибки: {result['errors']}")
+
+
+def print_comparison(before, after):
+    """Изменение ключевых показателей относительно прошлого прогона"""
+    def change(old, new):
+        return f"{old:>10.2f} → {new:>10.2f} ({(new - old) / old:+.1%})" if old else f"{old} → {new}"
+
+    print(f"\nСравнение с {before.get('git') or 'прошлым прогоном'} ({before['timestamp']}):")
+    print(f"  обновлений/с   {change(before['updates_per_sec'], after['updates_per_sec'])}")
+    for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+        print(f"  {key:<14} {change(before['overall'][key], after['overall'][key])}")
+    print(f"  RSS, МБ        {change(before['peak_rss_mb'], after['peak_rss_mb'])}")
+    for step, stats in after['steps'].items():
+        old = before['steps'].get(step)
+        if old:
+            print(f"  {step + ' p95':<14} {change(old['p95_ms'], stats['p95_ms'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--expenses', type=int, default=3, help="расходов на пользователя")
+    parser.add_argument('--concurrency', type=int, default=200, help="пользователей одновременно")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="сохранить результат в JSON")
+    parser.add_argument('--compare', help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DB_PATH'] = os.path.join(tmp, 'finance.db')
+        os.environ['STATE_DB'] = os.path.join(tmp, 'state.db')
+        # Сценарий шлёт сообщения быстрее живого человека: лимит частоты
+        # и сервер метрик в замере не участвуют
+        os.environ['USER_RATE_LIMIT'] = '0'
+        os.environ['METRICS_PORT'] = '0'
+        logging.disable(logging.WARNING)
+        result = asyncio.run(run(args))
+
+    print_result(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            print_comparison(json.load(file), result)
+    return 1 if result['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""Обслуживание базы под нагрузкой: что вычищено, сколько места вернулось
+и насколько дольше ждут горячие запросы.
+
+На сгенерированной базе (benchmarks.datagen) часть пользователей удаляет
+категории (давно — их данные пора вычищать), у части расходы остались
+без категории (так делал прежний INSERT OR REPLACE в add_category),
+часть очищает статистику, в том числе сразу после большого импорта.
+Затем одни и те же пользователи добавляют расходы и смотрят статистику
+дважды: без обслуживания и во время run_maintenance. Печатаются задержки горячих запросов в обоих случаях,
+длительность шагов обслуживания в потоке записи (столько ждёт расход,
+вставший в очередь за шагом) и отчёт обслуживания.
+
+После прохода проверяется, что дневные итоги сходятся с расходами,
+мёртвых данных не осталось, расходы без категории привязаны, но целы, видимая статистика остальных пользователей
+не изменилась, а горячие запросы после ANALYZE идут по индексам.
+
+Запуск: python -m benchmarks.maintenance_bench --users 5000 --expenses 1000000
+"""
+import argparse
+import asyncio
+import functools
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.datagen import generate
+from benchmarks.query_plans import HOT_METHODS, capture_queries, full_scans
+from database import AsyncDatabase, Database
+from maintenance import run_maintenance
+
+
+def make_garbage(db, users, rng):
+    """Удалённые категории, расходы без категории и очищенная статистика у случайных пользователей"""
+    counts = {'удалено категорий': 0, 'без категории': 0, 'очищено пользователей': 0, 'очищено после импорта': 0}
+    for user_id in rng.sample(range(1, users + 1), users // 5):
+        categories = db.get_user_categories(user_id)
+        category_id, name, emoji = rng.choice(categories)
+        db.delete_category(user_id, category_id)
+        if rng.random() < 0.5:
+            # Как прежний add_category: INSERT OR REPLACE удаляет старую строку вместе с id
+            db.conn.execute('''
+                INSERT OR REPLACE INTO user_categories (user_id, name, emoji, is_deleted)
+                VALUES (?, ?, ?, 0)
+            ''', (user_id, name, emoji))
+            db.conn.commit()
+            counts['без категории'] += 1
+        else:
+            counts['удалено категорий'] += 1
+    # Удалены давно — срок хранения прошёл
+    db.conn.execute("UPDATE user_categories SET deleted_at = datetime('now', '-60 days') WHERE is_deleted = 1")
+    db.conn.commit()
+    for user_id in rng.sample(range(1, users + 1), users // 20):
+        db.clear_user_statistics(user_id)
+        counts['очищено пользователей'] += 1
+    # Импорт пишет расходы подряд, и очистка после него освобождает целые страницы
+    # (очищаем после всех импортов, иначе следующий импорт займёт освобождённое)
+    now = datetime.now()
+    imported = rng.sample(range(1, users + 1), max(1, users // 500))
+    for user_id in imported:
+        category_id = db.get_user_categories(user_id)[0][0]
+        db.import_expenses(user_id, [
+            (category_id, 100.0, (now - timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S')) for i in range(20000)
+        ])
+    for user_id in imported:
+        db.clear_user_statistics(user_id)
+        counts['очищено после импорта'] += 1
+    counts['расходов без категории'] = db.conn.execute('''
+        SELECT COUNT(*) FROM expenses e
+        WHERE NOT EXISTS (SELECT 1 FROM user_categories uc WHERE uc.id = e.category_id)
+    ''').fetchone()[0]
+    return counts
+
+
+def time_steps(db, names, durations):
+    """Меряет шаги обслуживания прямо в потоке записи, без ожидания в очереди"""
+    for name in names:
+        method = getattr(db._db, name)
+
+        @functools.wraps(method)
+        def timed(*args, _method=method):
+            started = time.perf_counter()
+            try:
+                return _method(*args)
+            finally:
+                durations.append(time.perf_counter() - started)
+
+        setattr(db._db, name, timed)
+
+
+def visible_stats(db, user_ids):
+    return {user_id: db.get_category_stats(user_id, 3650) for user_id in user_ids}
+
+
+async def hot_path(db, user_ids, stop, latencies):
+    """Пользователь добавляет расход и смотрит статистику, пока не поднят stop"""
+    rng = random.Random(user_ids[0])
+    while not stop.is_set():
+        user_id = rng.choice(user_ids)
+        categories = await db.get_user_categories(user_id)
+        started = time.perf_counter()
+        await db.add_expense(user_id, categories[0][0], 10.0)
+        latencies['add_expense'].append(time.perf_counter() - started)
+        started = time.perf_counter()
+        await db.get_category_stats(user_id)
+        latencies['get_category_stats'].append(time.perf_counter() - started)
+        await asyncio.sleep(rng.uniform(0, 0.01))
+
+
+async def measure(db, user_ids, concurrency, seconds=None, work=None):
+    """Задержки горячих запросов за seconds секунд или пока выполняется work"""
+    latencies = {'add_expense': [], 'get_category_stats': []}
+    stop = asyncio.Event()
+    loops = [
+        asyncio.create_task(hot_path(db, user_ids[i::concurrency], stop, latencies))
+        for i in range(concurrency)
+    ]
+    started = time.perf_counter()
+    result = await work if work is not None else await asyncio.sleep(seconds)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*loops)
+    return result, elapsed, latencies
+
+
+def describe(latencies):
+    parts = []
+    for name, values in latencies.items():
+        values = sorted(values)
+        parts.append(
+            f"{name}: p50 {statistics.median(values) * 1000:.2f} мс, "
+            f"p99 {values[int(len(values) * 0.99)] * 1000:.2f} мс, максимум {values[-1] * 1000:.2f} мс"
+        )
+    return '; '.join(parts)
+
+
+async def run(path, users, concurrency):
+    db = AsyncDatabase(path, readers=2)
+    # Нагрузка — на верхней половине пользователей, нижняя нужна для сверки статистики
+    load_users = list(range(users // 2 + 1, users + 1))
+    steps = []
+    time_steps(db, ('purge_category', 'incremental_vacuum', 'analyze'), steps)
+    try:
+        _, _, before = await measure(db, load_users, concurrency, seconds=3)
+        report, elapsed, during = await measure(
+            db, load_users, concurrency, work=run_maintenance(db, retention_days=30)
+        )
+    finally:
+        await db.close()
+    return report, elapsed, before, during, sorted(steps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--expenses', type=int, default=1_000_000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'maintenance.db')
+        generate(path, args.users, args.expenses, seed=args.seed)
+        db = Database(path)
+        counts = make_garbage(db, args.users, random.Random(args.seed))
+        db.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        size_before = os.path.getsize(path)
+        check_users = random.Random(args.seed).sample(range(1, args.users // 2 + 1), 200)
+        stats_before = visible_stats(db, check_users)
+        db.close()
+        print(f"База: {args.users} пользователей, {args.expenses:,} расходов; {counts}")
+
+        report, elapsed, before, during, steps = asyncio.run(run(path, args.users, args.concurrency))
+        print(f"Без обслуживания:  {describe(before)}")
+        print(f"Во время ({elapsed:.1f} с): {describe(during)}")
+        print(f"Шаги в потоке записи: {len(steps)}, медиана {statistics.median(steps) * 1000:.2f} мс, "
+              f"p99 {steps[int(len(steps) * 0.99)] * 1000:.2f} мс, максимум {steps[-1] * 1000:.2f} мс")
+        print(f"Отчёт: {report.summary()}")
+
+        db = Database(path)
+        db.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        print(f"Файл: {size_before / 1024 / 1024:.1f} МБ → {os.path.getsize(path) / 1024 / 1024:.1f} МБ")
+
+        problems = []
+        if db.check_rollups():
+            problems.append(f"расхождений в дневных итогах: {len(db.check_rollups())}")
+        if db.find_dead_categories(30):
+            problems.append("остались удалённые категории")
+        if db.find_orphan_categories(0, 10 ** 12)[1]:
+            problems.append("остались расходы без категории")
+        # Привязанные расходы не удаляются в тот же проход: у них свой срок хранения
+        kept = db.conn.execute('''
+            SELECT COUNT(*) FROM expenses e JOIN user_categories uc ON uc.id = e.category_id
+            WHERE uc.is_deleted = 1 AND uc.deleted_at > datetime('now', '-1 day')
+        ''').fetchone()[0]
+        if kept != counts['расходов без категории']:
+            problems.append(f"из {counts['расходов без категории']} расходов без категории сохранено {kept}")
+        changed = sum(1 for user_id, rows in visible_stats(db, check_users).items() if rows != stats_before[user_id])
+        if changed:
+            problems.append(f"изменилась статистика у {changed} пользователей")
+        for method, method_args in HOT_METHODS:
+            for query in capture_queries(db, method, method_args):
+                scans, details = full_scans(db, query)
+                if scans:
+                    problems.append(f"после ANALYZE {method}: {'; '.join(details)}")
+        db.close()
+
+    for problem in problems:
+        print(f"ОШИБКА: {problem}")
+        failed = True
+    if not failed:
+        print("Итоги сходятся, мёртвых данных нет, статистика прежняя, планы по индексам")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,101 @@
+"""Планы горячих запросов Database: идут ли они по индексам.
+
+Каждый метод вызывается на небольшой базе со статистикой большой,
+выполненный SQL перехватывается через trace callback и прогоняется через
+EXPLAIN QUERY PLAN. Полный обход таблицы или индекса (SCAN) — ошибка;
+это проверяет tests/test_query_plans.py, а скрипт печатает сами планы.
+
+Запуск: python -m benchmarks.query_plans
+"""
+import os
+import tempfile
+
+from database import Database
+
+# Методы, которые вызываются на каждое сообщение пользователя
+HOT_METHODS = [
+    ('get_user_categories', (1,)),
+    ('get_category_stats', (1, 30)),
+    ('get_today_expenses', (1,)),
+    ('get_recent_expenses', (1, 10)),
+    ('get_daily_totals', (1,)),
+    ('get_budgets', (1,)),
+    ('get_month_totals', (1, '2000-01-01')),
+    ('add_expense', (1, 1, 50.0)),
+    ('clear_category_statistics', (1, 1)),
+    ('clear_user_statistics', (1,)),
+    # Дайджест: страница пользователей, но по индексам, а не обходом таблиц
+    ('get_digest_page', (0, 1000, '2000-01-01', '2000-01-02', '2000-01-03')),
+    ('get_digest_run', ('day', '2000-01-02')),
+    # Обслуживание: короткие шаги по индексам, иначе каждый шаг держит запись надолго
+    ('find_dead_categories', (30,)),
+    ('find_orphan_categories', (0, 1000)),
+    ('purge_category', (2, 99, 30, 500)),
+]
+
+# sqlite_stat1 базы на 10 тыс. пользователей и 10 млн расходов (benchmarks.datagen)
+LARGE_DB_STATS = {
+    'idx_expenses_user_category': '10000000 1000 180',
+    'idx_expenses_user_created': '10000000 1000 1',
+    'expense_daily': '7600000 760 2 1',
+    'sqlite_autoindex_user_categories_1': '60000 6 1',
+}
+
+
+def capture_queries(db, method, args):
+    queries = []
+    db.conn.set_trace_callback(queries.append)
+    try:
+        getattr(db, method)(*args)
+    finally:
+        db.conn.set_trace_callback(None)
+    return [q for q in queries if q.lstrip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE'))]
+
+
+def full_scans(db, query):
+    plan = db.conn.execute(f'EXPLAIN QUERY PLAN {query}').fetchall()
+    details = [row[-1] for row in plan]
+    # Обход материализованного подзапроса — это не обход таблицы
+    subqueries = {d.split()[1] for d in details if d.startswith(('MATERIALIZE', 'CO-ROUTINE'))}
+    # SCAN ... USING INDEX — тоже обход целиком, только по индексу
+    scans = [d for d in details if d.startswith('SCAN') and d.split()[1] not in subqueries]
+    return scans, details
+
+
+def build_plans_db(path):
+    """Небольшая база, на которой каждый метод из HOT_METHODS выполняет свои запросы"""
+    db = Database(path)
+    for user_id in (1, 2):
+        db.init_user_categories(user_id)
+        db.add_expense(user_id, 1, 100)
+    # Категория 99 удалена давно: purge_category доходит до удаления расходов
+    db.conn.execute('''
+        INSERT INTO user_categories (id, user_id, name, is_deleted, deleted_at)
+        VALUES (99, 2, 'Старая', 1, datetime('now', '-60 days'))
+    ''')
+    db.conn.commit()
+    db.add_expense(2, 99, 100)
+    # Без статистики планировщик может выбрать обход даже при наличии индекса.
+    # Настоящую статистику заменяем на статистику большой базы: на паре
+    # строк планировщик выбирает совсем другие планы, чем на миллионах
+    db.conn.execute('ANALYZE')
+    db.conn.executemany('UPDATE sqlite_stat1 SET stat = ? WHERE idx = ?',
+                        [(stat, idx) for idx, stat in LARGE_DB_STATS.items()])
+    db.conn.commit()
+    db.conn.execute('ANALYZE sqlite_schema')
+    return db
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = build_plans_db(os.path.join(tmp, 'plans.db'))
+        for method, args in HOT_METHODS:
+            for query in capture_queries(db, method, args):
+                scans, details = full_scans(db, query)
+                status = 'ОШИБКА' if scans else 'ok'
+                print(f"[{status}] {method}: {'; '.join(details)}")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
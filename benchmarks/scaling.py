@@ -0,0 +1,93 @@
+"""Масштабирование по процессам: пропускная способность при 1..N воркерах.
+
+Для каждого числа воркеров runner.py поднимает настоящие процессы бота
+с отдельными базами, заглушка Bot API (benchmarks.fake_telegram) слушает
+по HTTP и считает ответы. Обновления раскладываются тем же UpdateRouter,
+что и в продакшене, замер — от первого обновления до последнего ответа.
+
+Запуск: python -m benchmarks.scaling --max-workers 4 --users 1000 --messages 4
+"""
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import tempfile
+import time
+
+# Обновление, которое не трогает БД: меряем обработку, а не диск
+TEXT = "⚙️ Настройки"
+
+
+async def measure(workers, users, messages, base_port):
+    from aiohttp import ClientSession, web
+    from benchmarks.fake_telegram import create_fake_api, make_update
+    from runner import UpdateRouter, start_workers, stop_workers, wait_healthy
+
+    total = users * messages
+    replies = 0
+    done = asyncio.Event()
+
+    def on_send(chat_id, method):
+        nonlocal replies
+        replies += 1
+        if replies >= total:
+            done.set()
+
+    api = web.AppRunner(create_fake_api(on_send))
+    await api.setup()
+    site = web.TCPSite(api, '127.0.0.1', 0)
+    await site.start()
+    api_host, api_port = api.addresses[0][:2]
+
+    updates = [
+        make_update(i * users + user_id, user_id, TEXT)
+        for i in range(messages) for user_id in range(1, users + 1)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        processes = start_workers(workers, base_port, extra_env={
+            'BOT_TOKEN': '123456:BENCHMARK',
+            'TELEGRAM_API_URL': f'http://{api_host}:{api_port}',
+            'DB_PATH': os.path.join(tmp, 'finance.db'),
+            'STATE_DB': os.path.join(tmp, 'state.db'),
+        }, output=subprocess.DEVNULL)
+        try:
+            async with ClientSession() as client:
+                await wait_healthy(client, [f"http://127.0.0.1:{base_port + i}/health" for i in range(workers)])
+                router = UpdateRouter(client, [f"http://127.0.0.1:{base_port + i}/webhook" for i in range(workers)])
+                started = time.perf_counter()
+                for update in updates:
+                    router.route(update)
+                await router.close()
+                await done.wait()
+                elapsed = time.perf_counter() - started
+        finally:
+            stop_workers(processes)
+            await api.cleanup()
+    return total / elapsed
+
+
+async def run(max_workers, users, messages, base_port):
+    print(f"Пользователей: {users}, сообщений на пользователя: {messages}, ядер: {os.cpu_count()}")
+    baseline = None
+    for workers in range(1, max_workers + 1):
+        rate = await measure(workers, users, messages, base_port)
+        baseline = baseline or rate
+        print(f"воркеров: {workers}  обновлений/с: {rate:8.0f}  ускорение: {rate / baseline:4.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=4)
+    parser.add_argument('--base-port', type=int, default=8100)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    asyncio.run(run(args.max_workers, args.users, args.messages, args.base_port))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Сравнение профилей соединения SQLite: старый (rollback-журнал,
+synchronous=FULL, одно соединение) и новый (WAL, synchronous=NORMAL,
+mmap, кэши, отдельные соединения для чтения).
+
+Два замера на одной и той же сгенерированной базе:
+- Database в одном потоке: отдельные коммиты add_expense и чтения;
+- AsyncDatabase под смешанной нагрузкой: пользователи пишут расходы
+  и тут же смотрят статистику, считаем чтения и записи в секунду.
+
+Запуск: python -m benchmarks.sqlite_profile --expenses 200000 --seconds 5
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks.datagen import generate
+from database import AsyncDatabase, Database, DEFAULT_PROFILE, LEGACY_PROFILE
+
+PROFILES = [
+    ('старый', LEGACY_PROFILE, 0),
+    ('WAL', DEFAULT_PROFILE, 0),
+    ('WAL + 4 читателя', DEFAULT_PROFILE, 4),
+]
+
+
+def single_thread(path, profile, users, ops):
+    db = Database(path, profile)
+    rng = random.Random(1)
+    user_ids = [rng.randint(1, users) for _ in range(ops)]
+    categories = {user_id: db.get_user_categories(user_id)[0][0] for user_id in set(user_ids)}
+    results = {}
+    try:
+        started = time.perf_counter()
+        for user_id in user_ids:
+            db.add_expense(user_id, categories[user_id], 100.0)
+        results['commits/s'] = ops / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for user_id in user_ids:
+            db.get_category_stats(user_id)
+            db.get_recent_expenses(user_id)
+        results['reads/s'] = 2 * ops / (time.perf_counter() - started)
+    finally:
+        db.close()
+    return results
+
+
+async def mixed(path, profile, readers, users, concurrency, seconds):
+    db = AsyncDatabase(path, readers=readers, profile=profile)
+    counts = {'reads': 0, 'writes': 0}
+    read_latencies = []
+    deadline = time.perf_counter() + seconds
+
+    async def user_loop(rng):
+        while time.perf_counter() < deadline:
+            user_id = rng.randint(1, users)
+            categories = await db.get_user_categories(user_id)
+            await db.add_expense(user_id, categories[0][0], 100.0)
+            counts['writes'] += 1
+            # Статистика и история всегда идут мимо кэшей — это и меряем
+            started = time.perf_counter()
+            await db.get_category_stats(user_id)
+            read_latencies.append(time.perf_counter() - started)
+            await db.get_recent_expenses(user_id)
+            await db.get_today_expenses(user_id)
+            counts['reads'] += 3
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_loop(random.Random(i)) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await db.close()
+    read_latencies.sort()
+    return {
+        'writes/s': counts['writes'] / elapsed,
+        'reads/s': counts['reads'] / elapsed,
+        'read_p95_ms': read_latencies[int(len(read_latencies) * 0.95)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--expenses', type=int, default=200000)
+    parser.add_argument('--ops', type=int, default=500, help="операций в однопоточном замере")
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source.db')
+        generate(source, args.users, args.expenses)
+        for name, profile, readers in PROFILES:
+            path = os.path.join(tmp, 'bench.db')
+            shutil.copyfile(source, path)
+            line = [f"{name:<18}"]
+            if not readers:
+                for metric, value in single_thread(path, profile, args.users, args.ops).items():
+                    line.append(f"1 поток: {value:8.0f} {metric}")
+            else:
+                line.append(' ' * 48)
+            result = asyncio.run(mixed(path, profile, readers, args.users, args.concurrency, args.seconds))
+            line.append(
+                f"смешанная: {result['writes/s']:6.0f} writes/s {result['reads/s']:7.0f} reads/s, "
+                f"p95 статистики {result['read_p95_ms']:.1f} мс"
+            )
+            print('  '.join(line))
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Профиль запуска бота: во что обходится старт до начала опроса.
+
+Новый интерпретатор с -X importtime импортирует bot, собирает приложение
+create_app() с фиктивным токеном (в сеть ничего не уходит) и прогревает
+пул графиков. Печатаются этапы старта, самые дорогие импорты (со всеми
+зависимостями) и собственное время импорта по пакетам верхнего уровня.
+
+Запуск: python -m benchmarks.startup --top 15
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+# Выполняется в отдельном интерпретаторе: импорт bot должен быть первым,
+# иначе часть зависимостей окажется загружена заранее
+CHILD = '''
+import time
+started = time.perf_counter()
+import bot
+imported = time.perf_counter()
+app = bot.create_app('123456:STARTUP')
+built = time.perf_counter()
+
+import asyncio, json, os, sys
+# Процессы-отрисовщики наследуют -X importtime: их импорты в отчёт не берём
+sys.stderr.flush()
+os.dup2(os.open(os.devnull, os.O_WRONLY), 2)
+
+async def finish():
+    warm_up = await app.charts.warm_up()
+    await app.bot.session.close()
+    await app.close()
+    return warm_up
+
+warm_up = asyncio.run(finish())
+print(json.dumps({'import': imported - started, 'create_app': built - imported, 'charts_warm_up': warm_up}))
+'''
+
+IMPORTTIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def parse_importtime(stderr):
+    """Строки -X importtime: [(модуль, своё время, с зависимостями, глубина)], время в секундах"""
+    modules = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            modules.append((name, int(own) / 1e6, int(cumulative) / 1e6, len(indent) // 2))
+    return modules
+
+
+def profile(python=sys.executable):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            DB_PATH=os.path.join(tmp, 'finance.db'),
+            STATE_DB=os.path.join(tmp, 'state.db'),
+            METRICS_PORT='0',
+        )
+        result = subprocess.run(
+            [python, '-X', 'importtime', '-c', CHILD],
+            env=env, capture_output=True, text=True, check=True
+        )
+    phases = json.loads(result.stdout.strip().splitlines()[-1])
+    return phases, parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--top', type=int, default=15, help="сколько самых дорогих импортов показать")
+    args = parser.parse_args()
+
+    phases, modules = profile()
+    print("Этапы старта:")
+    for phase, seconds in phases.items():
+        print(f"  {phase:<16}" + (f"{seconds * 1000:8.0f} мс" if seconds is not None else "   нет matplotlib"))
+
+    # Модули первого уровня вложенности — то, что импортирует сам bot
+    direct = sorted((m for m in modules if m[3] == 1), key=lambda m: m[2], reverse=True)
+    print(f"\nИмпорты bot (с зависимостями), топ {args.top}:")
+    for name, _, cumulative, _ in direct[:args.top]:
+        print(f"  {name:<40}{cumulative * 1000:8.0f} мс")
+
+    packages = defaultdict(float)
+    for name, own, _, _ in modules:
+        packages[name.split('.')[0]] += own
+    print(f"\nСобственное время по пакетам, топ {args.top}:")
+    for name, own in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {name:<40}{own * 1000:8.0f} мс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+"""Общие расчёты для бенчмарков"""
+
+
+def percentile(values, p):
+    """p-й процентиль (0–100) методом ближайшего ранга, без интерполяции"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
@@ -0,0 +1,98 @@
+"""Нагрузочный тест слоя хранения.
+
+Сотни пользователей одновременно записывают расходы, а параллельно
+«лёгкий» обработчик каждые несколько миллисекунд проверяет, насколько
+быстро цикл событий успевает ему ответить. Сравниваются синхронный
+Database (запросы прямо в цикле событий) и AsyncDatabase.
+
+Запуск: python -m benchmarks.storage_load --users 300 --ops 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.stats import percentile
+from database import AsyncDatabase, Database
+
+
+class BlockingBackend:
+    """Синхронный Database с async-интерфейсом — как было в bot.py"""
+
+    def __init__(self, db_name):
+        self._db = Database(db_name)
+
+    async def get_user_categories(self, user_id):
+        return self._db.get_user_categories(user_id)
+
+    async def init_user_categories(self, user_id):
+        return self._db.init_user_categories(user_id)
+
+    async def add_expense(self, user_id, category_id, amount):
+        return self._db.add_expense(user_id, category_id, amount)
+
+    async def close(self):
+        self._db.close()
+
+
+async def user_session(db, user_id, ops):
+    await db.init_user_categories(user_id)
+    categories = await db.get_user_categories(user_id)
+    for i in range(ops):
+        cat_id = categories[i % len(categories)][0]
+        await db.add_expense(user_id, cat_id, 100 + i)
+        await db.get_user_categories(user_id)
+
+
+async def probe(stop, samples, interval=0.005):
+    """Обработчик, которому не нужна БД: меряем задержку его запуска"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append((loop.time() - expected) * 1000)
+
+
+async def run(backend_cls, users, ops):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = backend_cls(os.path.join(tmp, 'bench.db'))
+        stop = asyncio.Event()
+        samples = []
+        probe_task = asyncio.create_task(probe(stop, samples))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user_session(db, uid, ops) for uid in range(1, users + 1)))
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        await probe_task
+        await db.close()
+
+    return {
+        'writes_per_sec': users * ops / elapsed,
+        'p50_ms': statistics.median(samples) if samples else 0.0,
+        'p99_ms': percentile(samples, 99) if samples else 0.0,
+        'max_ms': max(samples) if samples else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--ops', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"Пользователей: {args.users}, операций на пользователя: {args.ops}")
+    for name, backend in (('Database (блокирующий)', BlockingBackend), ('AsyncDatabase', AsyncDatabase)):
+        result = asyncio.run(run(backend, args.users, args.ops))
+        print(
+            f"{name:<24} записей/с: {result['writes_per_sec']:8.0f}  "
+            f"задержка обработчика p50: {result['p50_ms']:6.2f} мс  "
+            f"p99: {result['p99_ms']:7.2f} мс  max: {result['max_ms']:7.2f} мс"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Сравнение polling и webhook: задержка и пропускная способность.
+
+Настоящий диспетчер бота получает обновления от заглушки Telegram
+(benchmarks.fake_telegram): в режиме polling — через getUpdates,
+в режиме webhook — POST-запросами на локальный aiohttp-сервер.
+Задержка — от отправки обновления до ответа бота этому пользователю.
+Что оба режима отвечают на каждое обновление одинаково, проверяет
+tests/test_transport.py.
+
+Запуск: python -m benchmarks.transport --users 500 --messages 4
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+
+from benchmarks.stats import percentile
+
+# Обновление, которое не трогает БД: меряем именно доставку
+TEXT = "⚙️ Настройки"
+
+
+class Tracker:
+    """Сопоставляет отправленные обновления с ответами бота"""
+
+    def __init__(self, total):
+        self.total = total
+        self.sent = defaultdict(deque)
+        self.latencies = []
+        self.replies = defaultdict(list)  # {chat_id: [текст ответа]}
+        self.done = asyncio.Event()
+
+    def mark_sent(self, user_id):
+        self.sent[user_id].append(time.perf_counter())
+
+    def on_send(self, chat_id, method):
+        self.replies[chat_id].append(getattr(method, 'text', None))
+        if self.sent[chat_id]:
+            self.latencies.append(time.perf_counter() - self.sent[chat_id].popleft())
+        if len(self.latencies) >= self.total:
+            self.done.set()
+
+
+async def run_polling(app, session, tracker, updates):
+    polling = asyncio.create_task(app.dp.start_polling(
+        app.bot, handle_signals=False, close_bot_session=False
+    ))
+    started = time.perf_counter()
+    for update in updates:
+        tracker.mark_sent(update['message']['chat']['id'])
+        session.feed(update)
+    await tracker.done.wait()
+    elapsed = time.perf_counter() - started
+    await app.dp.stop_polling()
+    await polling
+    return elapsed
+
+
+async def run_webhook(app, session, tracker, updates, concurrency=100):
+    from aiohttp import ClientSession, web
+    from webhook import create_webhook_app
+
+    web_app = create_webhook_app(app.dp, app.bot, path='/webhook')
+    runner = web.AppRunner(web_app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    url = f'http://{host}:{port}/webhook'
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(client, update):
+        async with semaphore:
+            tracker.mark_sent(update['message']['chat']['id'])
+            async with client.post(url, json=update) as response:
+                response.raise_for_status()
+
+    started = time.perf_counter()
+    async with ClientSession() as client:
+        await asyncio.gather(*(post(client, update) for update in updates))
+        await tracker.done.wait()
+    elapsed = time.perf_counter() - started
+    await runner.cleanup()
+    return elapsed
+
+
+async def deliver(mode, users, messages, **paths):
+    """Прогоняет users * messages обновлений через mode; возвращает (Tracker, секунды).
+
+    paths — db_path и state_path для create_app(), по умолчанию из config.
+    """
+    from benchmarks.fake_telegram import FakeTelegramSession, make_update
+    import bot as bot_module
+
+    tracker = Tracker(users * messages)
+    session = FakeTelegramSession(on_send=tracker.on_send)
+    app = bot_module.create_app('123456:BENCHMARK', session=session, **paths)
+
+    # Сообщения разных пользователей вперемешку, как в жизни
+    updates = [
+        make_update(i * users + user_id, user_id, TEXT)
+        for i in range(messages) for user_id in range(1, users + 1)
+    ]
+    runner = run_polling if mode == 'polling' else run_webhook
+    try:
+        elapsed = await runner(app, session, tracker, updates)
+    finally:
+        await app.close()
+    return tracker, elapsed
+
+
+async def run(mode, users, messages):
+    tracker, elapsed = await deliver(mode, users, messages)
+    total = users * messages
+    latencies_ms = [value * 1000 for value in tracker.latencies]
+    print(
+        f"{mode:<8} обновлений/с: {total / elapsed:8.0f}  "
+        f"p50: {statistics.median(latencies_ms):7.1f} мс  "
+        f"p95: {percentile(latencies_ms, 95):7.1f} мс  "
+        f"p99: {percentile(latencies_ms, 99):7.1f} мс"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('polling', 'webhook', 'both'), default='both')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=4)
+    args = parser.parse_args()
+
+    if args.mode == 'both':
+        # Каждый режим — в своём процессе и со своей базой: прогоны не влияют друг на друга
+        print(f"Пользователей: {args.users}, сообщений на пользователя: {args.messages}")
+        for mode in ('polling', 'webhook'):
+            subprocess.run([
+                sys.executable, '-m', 'benchmarks.transport', '--mode', mode,
+                '--users', str(args.users), '--messages', str(args.messages)
+            ], check=True)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DB_PATH'] = os.path.join(tmp, 'finance.db')
+        os.environ['STATE_DB'] = os.path.join(tmp, 'state.db')
+        logging.disable(logging.INFO)
+        asyncio.run(run(args.mode, args.users, args.messages))
+
+
+if __name__ == '__main__':
+    main()
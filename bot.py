@@ -1,36 +1,220 @@
+import time
+
+# Отсчёт времени запуска: импорт зависимостей (в основном aiogram с моделями
+# pydantic) — самая дорогая часть старта, её видно в логе «Старт: ...»
+IMPORT_STARTED = time.perf_counter()
+
 import asyncio
 import os
+import sys
+import tempfile
 import logging
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+import math
+from concurrent.futures.process import BrokenProcessPool
+from aiogram import Bot, Dispatcher, Router, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, BufferedInputFile
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
-from database import Database
-
-# ========== НАСТРОЙКА ЛОГГИНГА ==========
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from database import AsyncDatabase, ConnectionProfile, current_day
+from cache import LRUCache, SizedLRUCache
+from charts import ChartRenderer
+from state import StateStore
+from export import export_expenses, SpooledInputFile, SPOOL_MAX_SIZE
+from importer import import_expenses, ImportFormatError
+from throttling import UserSerializer
+from budgets import check_expense, TOTAL
+from digest import DigestScheduler, DigestSender, SendLimiter
+from maintenance import MaintenanceScheduler
+from metrics import Counter, Gauge, start_metrics_server
+from instrumentation import HandlerTimer, TelegramTimer
+from config import (
+    DB_PATH, DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_CACHE_SIZE_MB, DB_MMAP_SIZE_MB,
+    DB_BUSY_TIMEOUT_MS, DB_STATEMENT_CACHE, DB_READERS,
+    EXPENSE_BATCH_INTERVAL_MS, EXPENSE_BATCH_SIZE,
+    CATEGORY_CACHE_SIZE, CATEGORY_CACHE_TTL,
+    CHART_WORKERS, STATS_CACHE_BYTES, ANALYTICS_CACHE_BYTES,
+    DIGEST_KINDS, DIGEST_HOUR, DIGEST_RATE, DIGEST_BURST, DIGEST_CONCURRENCY, DIGEST_PAGE_SIZE,
+    MAINTENANCE_HOUR, MAINTENANCE_RETENTION_DAYS, MAINTENANCE_BATCH_SIZE, MAINTENANCE_VACUUM_PAGES,
+    STATE_DB, STATE_TTL, STATE_HOT_SIZE,
+    MAX_CONCURRENT_UPDATES, USER_RATE_LIMIT, USER_RATE_BURST,
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    TELEGRAM_API_URL, LOG_LEVEL, LOG_SAMPLE_RATE, METRICS_HOST, METRICS_PORT
 )
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
 logger = logging.getLogger(__name__)
 
+
+# ========== НАСТРОЙКА ЛОГГИНГА ==========
+def setup_logging():
+    logging.basicConfig(
+        level=LOG_LEVEL,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    # aiogram пишет строку на каждое обновление; время хендлеров есть в /metrics,
+    # а выборочный лог сообщений — в HandlerTimer на уровне DEBUG
+    if LOG_LEVEL != 'DEBUG':
+        logging.getLogger('aiogram.event').setLevel(logging.WARNING)
+
+
 # ========== ЗАГРУЗКА ТОКЕНА ==========
-load_dotenv()
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-if not BOT_TOKEN:
-    logger.error("Токен не найден! Проверь файл .env")
-    exit(1)
-logger.info(f"Токен загружен: {BOT_TOKEN[:10]}...")
+def load_token():
+    load_dotenv()
+    token = os.getenv('BOT_TOKEN')
+    if not token:
+        logger.error("Токен не найден! Проверь файл .env")
+        sys.exit(1)
+    logger.info(f"Токен загружен: {token[:10]}...")
+    return token
+
+
+# ========== МЕТРИКИ ==========
+# Значения читаются при запросе /metrics, в горячем пути ничего не считается
+CACHE_HITS = Counter('finance_cache_hits_total', 'Попадания в кэш', ('cache',))
+CACHE_MISSES = Counter('finance_cache_misses_total', 'Промахи кэша', ('cache',))
+CACHE_ENTRIES = Gauge('finance_cache_entries', 'Записей в кэше', ('cache',))
+UPDATES_WAITING = Gauge('finance_updates_waiting', 'Обновлений в очереди за замком пользователя или слотом')
+UPDATES_REJECTED = Counter('finance_updates_rejected_total', 'Обновлений, отброшенных лимитом частоты')
+UPDATES_WAIT_MAX = Gauge('finance_updates_wait_max_seconds', 'Самое долгое ожидание в очереди')
+
+
+def register_cache_metrics(name, cache):
+    CACHE_HITS.set_function(lambda: cache.hits, name)
+    CACHE_MISSES.set_function(lambda: cache.misses, name)
+    CACHE_ENTRIES.set_function(lambda: len(cache), name)
+
 
 # ========== ИНИЦИАЛИЗАЦИЯ ==========
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-db = Database()
+# Хендлеры с фильтрами в порядке объявления. Роутер aiogram подключается
+# только к одному диспетчеру, поэтому create_app() каждый раз собирает новый
+HANDLERS = []
+
+
+def handler(*filters):
+    """Объявляет хендлер сообщений; зарегистрирует его create_app()"""
+    def register(func):
+        HANDLERS.append((func, filters))
+        return func
+    return register
+
+
+class App:
+    """Один собранный бот: Bot, диспетчер, базы, пул графиков, фоновые задачи и кэши.
+
+    Хендлеры получают его аргументом app из workflow_data диспетчера,
+    поэтому в одном процессе можно собрать несколько ботов.
+    """
+
+    def __init__(self, bot, dp, storage, serializer, db, charts, digests, maintenance):
+        self.bot = bot
+        self.dp = dp
+        self.storage = storage
+        self.serializer = serializer
+        self.db = db
+        self.charts = charts
+        self.digests = digests
+        self.maintenance = maintenance
+        # Готовая статистика: {(user_id, дней, день UTC, версия данных): (PNG, текст, file_id)}.
+        # После загрузки в Telegram храним только file_id, PNG — пока не отправлен
+        self.stats_cache = SizedLRUCache(
+            maxbytes=STATS_CACHE_BYTES,
+            sizeof=lambda item: len(item[0] or b'') + len(item[1].encode()) + len(item[2] or '')
+        )
+        # Дневные итоги в массивах для аналитики: {(user_id, версия данных): ExpenseSeries}
+        self.analytics_cache = SizedLRUCache(maxbytes=ANALYTICS_CACHE_BYTES, sizeof=lambda series: series.nbytes)
+        # Всё, что строится из набора категорий (клавиатуры, индекс кнопок):
+        # {(вид, user_id): (категории, значение)}. Кэш категорий отдаёт один
+        # и тот же кортеж, пока набор не изменился, поэтому он и служит
+        # «версией» набора категорий.
+        self.category_views = LRUCache(maxsize=CATEGORY_CACHE_SIZE * 3)
+
+    async def close(self):
+        """Останавливает то, что запустил create_app(): потоки баз и пул графиков"""
+        await self.db.close()
+        await self.storage.close()
+        self.charts.shutdown()
+
+
+def create_app(token, session=None, db_path=DB_PATH, state_path=STATE_DB):
+    """Собирает бота: Bot, диспетчер с middleware, базы, пул графиков и фоновые задачи.
+
+    Открывает файлы db_path и state_path (с их потоками), но в сеть не ходит
+    и процессы не запускает, поэтому тесты и бенчмарки собирают бота
+    с фиктивным токеном, своей сессией Telegram и временными базами.
+    Возвращает App; остановить его — App.close().
+    """
+    if session is None and TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    bot = Bot(token=token, session=session)
+    storage = StateStore(state_path, ttl=STATE_TTL, max_hot=STATE_HOT_SIZE)
+    dp = Dispatcher(storage=storage)
+    # Обновления пользователя — по очереди, общий лимит параллельности и лимит частоты
+    serializer = UserSerializer(
+        max_concurrent=MAX_CONCURRENT_UPDATES,
+        rate=USER_RATE_LIMIT,
+        burst=USER_RATE_BURST
+    )
+    # FSM-middleware читает состояние до вызова хендлера, поэтому замок
+    # пользователя должен браться раньше него: переставляем FSM в конец
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(serializer)
+    dp.update.outer_middleware(dp.fsm)
+    dp.message.middleware(HandlerTimer(sample_rate=LOG_SAMPLE_RATE))
+    bot.session.middleware(TelegramTimer())
+    router = Router()
+    for func, filters in HANDLERS:
+        router.message.register(func, *filters)
+    dp.include_router(router)
+
+    db = AsyncDatabase(
+        db_path,
+        batch_interval=EXPENSE_BATCH_INTERVAL_MS / 1000,
+        batch_size=EXPENSE_BATCH_SIZE,
+        category_cache_size=CATEGORY_CACHE_SIZE,
+        category_cache_ttl=CATEGORY_CACHE_TTL,
+        readers=DB_READERS,
+        profile=ConnectionProfile(
+            journal_mode=DB_JOURNAL_MODE,
+            synchronous=DB_SYNCHRONOUS,
+            cache_size_kb=DB_CACHE_SIZE_MB * 1024,
+            mmap_size=DB_MMAP_SIZE_MB * 1024 * 1024,
+            busy_timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            cached_statements=DB_STATEMENT_CACHE
+        )
+    )
+    # Пул процессов создаётся здесь, а запускается и прогревается в main()
+    charts = ChartRenderer(workers=CHART_WORKERS)
+    # Рассылка дайджестов и обслуживание базы запускаются фоновыми задачами в main()
+    digests = DigestScheduler(
+        db, DigestSender(bot, SendLimiter(rate=DIGEST_RATE, burst=DIGEST_BURST)),
+        kinds=DIGEST_KINDS, hour=DIGEST_HOUR, page_size=DIGEST_PAGE_SIZE, concurrency=DIGEST_CONCURRENCY
+    )
+    maintenance = MaintenanceScheduler(
+        db, hour=MAINTENANCE_HOUR, retention_days=MAINTENANCE_RETENTION_DAYS,
+        batch_size=MAINTENANCE_BATCH_SIZE, vacuum_pages=MAINTENANCE_VACUUM_PAGES
+    )
+
+    app = App(bot, dp, storage, serializer, db, charts, digests, maintenance)
+    # Хендлеры получают app аргументом
+    dp['app'] = app
+
+    # Метрики показывают последний собранный бот (в процессе он обычно один)
+    register_cache_metrics('stats', app.stats_cache)
+    register_cache_metrics('analytics', app.analytics_cache)
+    register_cache_metrics('category_views', app.category_views)
+    register_cache_metrics('categories', db.category_cache)
+    UPDATES_WAITING.set_function(lambda: serializer.waiting)
+    UPDATES_REJECTED.set_function(lambda: serializer.rejected)
+    UPDATES_WAIT_MAX.set_function(lambda: serializer.wait_seconds_max)
+    return app
+
 
 # ========== FSM СОСТОЯНИЯ ==========
 class CategoryStates(StatesGroup):
@@ -43,240 +227,491 @@ class ExpenseStates(StatesGroup):
 class SettingsStates(StatesGroup):
     editing_categories = State()
 
-# ========== СЛОВАРИ ДЛЯ ВРЕМЕННЫХ ДАННЫХ ==========
-user_temp_data = {}  # {user_id: {'editing_mode': True/False, 'selected_category': id}}
+# ========== ВРЕМЕННЫЕ ДАННЫЕ ПОЛЬЗОВАТЕЛЕЙ ==========
+# Хранятся в storage рядом с FSM: {'editing_mode': True/False, 'selected_category': id, ...}
+async def is_editing(app, user_id):
+    return (await app.storage.get_user_data(user_id)).get('editing_mode', False)
 
 # ========== ФУНКЦИИ ДЛЯ КЛАВИАТУР ==========
-async def get_main_keyboard(user_id):
-    """Основная клавиатура (для добавления расходов)"""
-    categories = db.get_user_categories(user_id)
+# Постоянные клавиатуры собираем один раз при загрузке модуля
+SETTINGS_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="📝 Редактировать категории")],
+        [KeyboardButton(text="🧹 Очистить статистику")],
+        [KeyboardButton(text="📤 Экспорт данных")],
+        [KeyboardButton(text="⬅️ Назад в меню")]
+    ],
+    resize_keyboard=True
+)
+
+CLEAR_CONFIRM_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="✅ Да, удалить всю статистику")],
+        [KeyboardButton(text="❌ Нет, отменить")]
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=True
+)
+
+# Служебные кнопки под категориями
+MAIN_SERVICE_ROWS = [
+    [KeyboardButton(text="📊 Статистика"), KeyboardButton(text="⚙️ Настройки")]
+]
+EDIT_SERVICE_ROWS = [
+    [KeyboardButton(text="➕ Новая категория")],
+    [KeyboardButton(text="📊 Статистика"), KeyboardButton(text="✅ Завершить редактирование")]
+]
+
+# Кнопки, которые обрабатываются своими хендлерами, а не как категории
+SERVICE_BUTTONS = frozenset({
+    "📊 Статистика",
+    "⚙️ Настройки",
+    "📝 Редактировать категории",
+    "📤 Экспорт данных",
+    "⬅️ Назад в меню",
+    "➕ Новая категория",
+    "✅ Завершить редактирование"
+})
+
+
+def build_categories_keyboard(categories, service_rows, placeholder):
+    """Собирает клавиатуру: категории по 2 в ряд и служебные кнопки"""
     buttons = []
     row = []
-    
-    # Категории расходов (по 2 в ряд)
     for cat_id, name, emoji in categories:
-        btn_text = f"{emoji} {name}"
-        row.append(KeyboardButton(text=btn_text))
+        row.append(KeyboardButton(text=f"{emoji} {name}"))
         if len(row) == 2:
             buttons.append(row)
             row = []
     if row:
         buttons.append(row)
-    
-    # Служебные кнопки
-    buttons.append([
-        KeyboardButton(text="📊 Статистика"),
-        KeyboardButton(text="⚙️ Настройки")
-    ])
-    
+    buttons.extend(service_rows)
+
     return ReplyKeyboardMarkup(
         keyboard=buttons,
         resize_keyboard=True,
-        input_field_placeholder="Выбери категорию"
+        input_field_placeholder=placeholder
     )
 
-async def get_settings_keyboard():
-    """Клавиатура настроек"""
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="📝 Редактировать категории")],
-            [KeyboardButton(text="🧹 Очистить статистику")],  
-            [KeyboardButton(text="📤 Экспорт данных")],
-            [KeyboardButton(text="⬅️ Назад в меню")]
-        ],
-        resize_keyboard=True
-    )
 
-async def get_edit_keyboard(user_id):
+def build_category_index(categories):
+    """Индекс {текст кнопки: (id, название, эмодзи)}"""
+    return {f"{emoji} {name}": (cat_id, name, emoji) for cat_id, name, emoji in categories}
+
+
+async def get_category_view(app, kind, user_id, build):
+    categories = await app.db.get_user_categories(user_id)
+    cached = app.category_views.get((kind, user_id))
+    if cached is not None and cached[0] is categories:
+        return cached[1]
+
+    value = build(categories)
+    app.category_views.set((kind, user_id), (categories, value))
+    return value
+
+
+async def get_category_index(app, user_id):
+    return await get_category_view(app, 'index', user_id, build_category_index)
+
+
+async def get_main_keyboard(app, user_id):
+    """Основная клавиатура (для добавления расходов)"""
+    return await get_category_view(app, 'main', user_id, lambda categories: build_categories_keyboard(
+        categories, MAIN_SERVICE_ROWS, "Выбери категорию"
+    ))
+
+async def get_edit_keyboard(app, user_id):
     """Клавиатура для редактирования категорий"""
-    categories = db.get_user_categories(user_id)
-    buttons = []
-    row = []
-    
-    # Категории (по 2 в ряд)
-    for cat_id, name, emoji in categories:
-        btn_text = f"{emoji} {name}"
-        row.append(KeyboardButton(text=btn_text))
-        if len(row) == 2:
-            buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
-    
-    # Служебные кнопки
-    buttons.append([KeyboardButton(text="➕ Новая категория")])
-    buttons.append([
-        KeyboardButton(text="📊 Статистика"),
-        KeyboardButton(text="✅ Завершить редактирование")
-    ])
-    
-    return ReplyKeyboardMarkup(
-        keyboard=buttons,
-        resize_keyboard=True,
-        input_field_placeholder="Долгое нажатие удаляет категорию"
-    )
+    return await get_category_view(app, 'edit', user_id, lambda categories: build_categories_keyboard(
+        categories, EDIT_SERVICE_ROWS, "Долгое нажатие удаляет категорию"
+    ))
 
 # ========== ОБРАБОТЧИКИ ==========
 
 # ----- СТАРТ И ГЛАВНОЕ МЕНЮ -----
-@dp.message(Command("start"))
-async def start_command(message: Message):
+@handler(Command("start"))
+async def start_command(message: Message, app: App):
     """Умный старт: показывает основное меню без принудительного редактирования"""
     user_id = message.from_user.id
     
     # Инициализируем стандартные категории, если пользователь новый
-    categories = db.get_user_categories(user_id)
+    categories = await app.db.get_user_categories(user_id)
     if not categories:
-        db.init_user_categories(user_id)
-        categories = db.get_user_categories(user_id)
+        await app.db.init_user_categories(user_id)
+        categories = await app.db.get_user_categories(user_id)
     
     await message.answer(
         f"👋 Добро пожаловать в Финансовый помощник!\n\n"
         f"У тебя настроено {len(categories)} категорий.\n"
         f"Выбери категорию для добавления расхода или зайди в настройки ⚙️",
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=await get_main_keyboard(user_id)
+        reply_markup=await get_main_keyboard(app, user_id)
     )
 
 # ----- СТАТИСТИКА -----
-@dp.message(F.text == "📊 Статистика")
-async def handle_stats(message: Message):
+async def render_stats(app, user_id, days=30):
+    """Готовит статистику: (PNG или None, подпись/текст в Markdown)"""
+    stats = await app.db.get_category_stats(user_id, days=days)
+    
+    if not stats:
+        return None, "📭 За последний месяц трат нет."
+    
+    categories = [cat for cat, _, _ in stats]
+    amounts = [amt for _, amt, _ in stats]
+    total = sum(amounts)
+    count = sum(cnt for _, _, cnt in stats)
+    
+    try:
+        # Создаем график (в отдельном процессе)
+        png = await app.charts.render_pie(
+            categories, amounts, f'📊 Расходы по категориям ({days} дней)'
+        )
+    except (ImportError, BrokenProcessPool) as e:
+        if isinstance(e, BrokenProcessPool):
+            logger.warning("Процесс отрисовки графиков упал, пул будет пересоздан; статистика текстом")
+        # Текстовая версия
+        text = f"📊 *Статистика за {days} дней:*\n\n"
+        for category, amount, _ in stats:
+            percent = (amount / total) * 100
+            text += f"{category}: *{amount:.2f} руб.* ({percent:.1f}%)\n"
+        text += f"\n*Итого: {total:.2f} руб.*"
+        return None, text
+    
+    caption = (
+        f"📈 *Статистика за {days} дней*\n\n"
+        f"Всего потрачено: *{total:.2f} руб.*\n"
+        f"Категорий: {len(categories)}, расходов: {count}\n"
+        f"Средний чек: {total/count:.2f} руб.\n\n"
+        f"_Подробнее: /trend, /compare, /averages_"
+    )
+    return png, caption
+
+
+@handler(F.text == "📊 Статистика")
+async def handle_stats(message: Message, app: App):
     """Показывает статистику"""
     user_id = message.from_user.id
     
     # Определяем, какую клавиатуру показывать после статистики
-    if user_id in user_temp_data and user_temp_data[user_id].get('editing_mode'):
-        reply_markup = await get_edit_keyboard(user_id)
+    if await is_editing(app, user_id):
+        reply_markup = await get_edit_keyboard(app, user_id)
     else:
-        reply_markup = await get_main_keyboard(user_id)
+        reply_markup = await get_main_keyboard(app, user_id)
     
-    try:
-        import matplotlib.pyplot as plt
-        import io
-        
-        stats = db.get_category_stats(user_id, days=30)
-        
-        if not stats:
-            await message.answer(
-                "📭 За последний месяц трат нет.",
+    # Повторный запрос без новых трат отдаём из кэша; устаревшие версии
+    # больше никто не запросит, и они вытесняются по LRU. Окно в 30 дней
+    # сдвигается и без новых трат, поэтому на следующий день ключ другой
+    cache_key = (user_id, 30, current_day(), app.db.data_version(user_id))
+    cached = app.stats_cache.get(cache_key)
+    if cached is not None:
+        png, text, file_id = cached
+    else:
+        png, text = await render_stats(app, user_id, days=30)
+        file_id = None
+    
+    # График уже загружен в Telegram — отправляем по file_id без повторной загрузки
+    if file_id is not None:
+        try:
+            await message.answer_photo(
+                file_id,
+                caption=text,
+                parse_mode=ParseMode.MARKDOWN,
                 reply_markup=reply_markup
             )
             return
-        
-        # Создаем график
-        categories = [cat for cat, _ in stats]
-        amounts = [amt for _, amt in stats]
-        
-        plt.figure(figsize=(10, 10))
-        plt.pie(amounts, labels=categories, autopct='%1.1f%%', startangle=90)
-        plt.title('📊 Расходы по категориям (30 дней)')
-        plt.axis('equal')
-        
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png', dpi=100, bbox_inches='tight')
-        buf.seek(0)
-        plt.close()
-        
-        total = sum(amounts)
-        
-        await message.answer_photo(
-            BufferedInputFile(buf.read(), filename="stats.png"),
-            caption=f"📈 *Статистика за 30 дней*\n\n"
-                   f"Всего потрачено: *{total:.2f} руб.*\n"
-                   f"Категорий: {len(categories)}\n"
-                   f"Средний чек: {total/len(stats):.2f} руб.",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup
-        )
-        
-    except ImportError:
-        # Текстовая версия
-        stats = db.get_category_stats(user_id, days=30)
-        total = sum(amt for _, amt in stats)
-        
-        text = "📊 *Статистика за 30 дней:*\n\n"
-        for category, amount in stats:
-            percent = (amount / total) * 100
-            text += f"{category}: *{amount:.2f} руб.* ({percent:.1f}%)\n"
-        text += f"\n*Итого: {total:.2f} руб.*"
-        
+        except TelegramBadRequest as e:
+            logger.warning(f"Telegram не принял сохранённый file_id ({e}), загружаем график заново")
+            png, text = await render_stats(app, user_id, days=30)
+    
+    if png is None:
+        app.stats_cache.set(cache_key, (None, text, None))
         await message.answer(
             text,
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=reply_markup
         )
+        return
+    
+    sent = await message.answer_photo(
+        BufferedInputFile(png, filename="stats.png"),
+        caption=text,
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=reply_markup
+    )
+    # Сам PNG больше не нужен: хватит file_id, который вернул Telegram
+    app.stats_cache.set(cache_key, (None, text, sent.photo[-1].file_id))
+
+
+# ----- АНАЛИТИКА -----
+# Аргумент /trend → вид тренда из analytics.TRENDS
+TREND_PERIODS = {
+    'day': 'day', 'день': 'day', 'дни': 'day',
+    'week': 'week', 'неделя': 'week', 'недели': 'week',
+    'month': 'month', 'месяц': 'month', 'месяцы': 'month',
+}
+TREND_TITLES = {'day': 'по дням', 'week': 'по неделям', 'month': 'по месяцам'}
+
+
+async def get_expense_series(app, user_id):
+    """Дневные итоги пользователя в массивах NumPy: один запрос на версию данных"""
+    # analytics тянет NumPy — грузим его при первом запросе аналитики, а не на старте
+    from analytics import ExpenseSeries, horizon
+
+    key = (user_id, app.db.data_version(user_id))
+    series = app.analytics_cache.get(key)
+    if series is None:
+        categories = await app.db.get_user_categories(user_id)
+        rows = await app.db.get_daily_totals(user_id, horizon())
+        series = ExpenseSeries.from_rows(rows, [cat_id for cat_id, _, _ in categories])
+        app.analytics_cache.set(key, series)
+    return series
+
+
+async def get_category_names(app, user_id):
+    return await get_category_view(app, 'names', user_id, lambda categories: {
+        cat_id: f"{emoji} {name}" for cat_id, name, emoji in categories
+    })
+
+
+def format_change(change):
+    """Изменение в долях → «+12%»; nan — сравнивать не с чем"""
+    return "—" if math.isnan(change) else f"{change:+.0%}"
+
+
+def format_period(start, period):
+    if period == 'month':
+        return start.strftime('%m.%Y')
+    return start.strftime('%d.%m')
+
+
+@handler(Command("trend"))
+async def handle_trend(message: Message, command: CommandObject, app: App):
+    """Расходы по дням, неделям или месяцам со скользящим средним"""
+    import analytics
+
+    user_id = message.from_user.id
+    period = TREND_PERIODS.get((command.args or 'day').strip().lower())
+    if period is None:
+        await message.answer("Выбери период: /trend day, /trend week или /trend month")
+        return
+
+    series = await get_expense_series(app, user_id)
+    if not len(series):
+        await message.answer("📭 Трат пока нет — смотреть не на что.")
+        return
+
+    count, window = analytics.TRENDS[period]
+    starts, totals, averages = analytics.trend(series, period, count, window)
+    changes = analytics.period_changes(totals)
+    lines = [f"{'период':<8}{'сумма':>9}{'среднее':>9}{'изм.':>7}"]
+    for start, total, average, change in zip(starts.astype(object), totals, averages, changes):
+        lines.append(f"{format_period(start, period):<8}{total:>9.0f}{average:>9.0f}{format_change(change):>7}")
+
+    await message.answer(
+        f"📈 *Расходы {TREND_TITLES[period]}*\n"
+        f"Среднее — скользящее за {window} (последний период ещё идёт)\n\n"
+        "```\n" + "\n".join(lines) + "\n```",
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+
+@handler(Command("compare"))
+async def handle_compare(message: Message, app: App):
+    """Этот месяц против тех же чисел прошлого, по категориям"""
+    import analytics
+
+    user_id = message.from_user.id
+    series = await get_expense_series(app, user_id)
+    current, previous, days = analytics.month_over_month(series)
+    if not current.any() and not previous.any():
+        await message.answer("📭 В этом и прошлом месяце трат нет.")
+        return
+
+    names = await get_category_names(app, user_id)
+    changes = analytics.period_changes([previous.sum(), current.sum()])
+    text = (
+        f"📊 *Этот месяц против прошлого* (первые {days} дн.)\n\n"
+        f"Всего: *{current.sum():.2f} руб.* (было {previous.sum():.2f}, {format_change(changes[1])})\n"
+    )
+    for index in current.argsort()[::-1]:
+        if not current[index] and not previous[index]:
+            continue
+        change = analytics.period_changes([previous[index], current[index]])[1]
+        text += (
+            f"\n{names.get(int(series.category_ids[index]), '?')}: "
+            f"{current[index]:.2f} руб. (было {previous[index]:.2f}, {format_change(change)})"
+        )
+    await message.answer(text, parse_mode=ParseMode.MARKDOWN)
+
+
+@handler(Command("averages"))
+async def handle_averages(message: Message, app: App):
+    """Средний чек и средний расход в день по категориям за 30 дней"""
+    import analytics
+
+    user_id = message.from_user.id
+    series = await get_expense_series(app, user_id)
+    totals, counts, per_expense, per_day = analytics.category_averages(series, days=30)
+    if not counts.any():
+        await message.answer("📭 За последний месяц трат нет.")
+        return
+
+    names = await get_category_names(app, user_id)
+    text = (
+        f"🧮 *Средние за 30 дней*\n\n"
+        f"Средний чек: *{totals.sum() / counts.sum():.2f} руб.*, "
+        f"в день: *{totals.sum() / 30:.2f} руб.*\n"
+    )
+    for index in totals.argsort()[::-1]:
+        if not counts[index]:
+            continue
+        text += (
+            f"\n{names.get(int(series.category_ids[index]), '?')}: чек {per_expense[index]:.2f} руб., "
+            f"в день {per_day[index]:.2f} руб. ({counts[index]} шт.)"
+        )
+    await message.answer(text, parse_mode=ParseMode.MARKDOWN)
+
+
+# ----- БЮДЖЕТЫ -----
+BUDGET_USAGE = (
+    "/budget 30000 — бюджет на все расходы за месяц\n"
+    "/budget Еда 10000 — бюджет на категорию\n"
+    "/budget Еда 0 — снять бюджет"
+)
+
+
+async def get_budget_alerts(app, user_id, category_id, amount):
+    """Предупреждения о бюджетах после расхода; пустая строка, если порогов не перешли"""
+    # Без бюджетов — ни одного запроса, с ними — итоги месяца из памяти
+    budgets = await app.db.get_budgets(user_id)
+    if not budgets:
+        return ''
+    alerts = check_expense(budgets, await app.db.get_month_totals(user_id), category_id, amount)
+    if not alerts:
+        return ''
+
+    names = await get_category_names(app, user_id)
+    lines = []
+    for key, threshold, spent, limit in alerts:
+        title = "Общий бюджет" if key == TOTAL else f"Бюджет «{names.get(key, '?')}»"
+        if threshold >= 1:
+            lines.append(f"🚨 {title} превышен: {spent:.2f} из {limit:.2f} руб.")
+        else:
+            lines.append(f"⚠️ {title} израсходован на {spent / limit:.0%}: {spent:.2f} из {limit:.2f} руб.")
+    return "\n\n" + "\n".join(lines)
+
+
+async def format_budgets(app, user_id):
+    budgets = await app.db.get_budgets(user_id)
+    if not budgets:
+        return "💰 Бюджетов пока нет.\n\n" + BUDGET_USAGE
+
+    totals = await app.db.get_month_totals(user_id)
+    names = await get_category_names(app, user_id)
+    lines = ["💰 *Бюджеты на этот месяц*\n"]
+    # Общий бюджет (category_id = 0) — первым; бюджеты удалённых категорий не показываем
+    for key, limit in sorted(budgets.items()):
+        if key != TOTAL and key not in names:
+            continue
+        spent = totals.total if key == TOTAL else totals.by_category.get(key, 0.0)
+        title = "Всего" if key == TOTAL else names[key]
+        lines.append(f"{title}: {spent:.2f} из {limit:.2f} руб. ({spent / limit:.0%})")
+    return "\n".join(lines)
+
+
+@handler(Command("budget"))
+async def handle_budget(message: Message, command: CommandObject, app: App):
+    """Месячные бюджеты: список, установка и снятие"""
+    user_id = message.from_user.id
+    args = (command.args or '').split()
+    if not args:
+        await message.answer(await format_budgets(app, user_id), parse_mode=ParseMode.MARKDOWN)
+        return
+
+    try:
+        amount = float(args[-1].replace(',', '.'))
+    except ValueError:
+        amount = -1.0
+    # nan и inf float() тоже принимает
+    if not math.isfinite(amount) or amount < 0:
+        await message.answer(f"❌ Не понял сумму.\n\n{BUDGET_USAGE}")
+        return
+
+    name = ' '.join(args[:-1]).lower()
+    category_id = TOTAL
+    if name:
+        # Категорию можно назвать как с эмодзи, так и без
+        index = {}
+        for cat_id, cat_name, emoji in await app.db.get_user_categories(user_id):
+            index[cat_name.lower()] = cat_id
+            index[f"{emoji} {cat_name}".lower()] = cat_id
+        category_id = index.get(name)
+        if category_id is None:
+            await message.answer(f"❌ Категория «{' '.join(args[:-1])}» не найдена")
+            return
+
+    await app.db.set_budget(user_id, category_id, amount or None)
+    await message.answer(await format_budgets(app, user_id), parse_mode=ParseMode.MARKDOWN)
 
 
 # ----- НАСТРОЙКИ -----
-@dp.message(F.text == "⚙️ Настройки")
+@handler(F.text == "⚙️ Настройки")
 async def handle_settings(message: Message):
     """Вход в меню настроек"""
     user_id = message.from_user.id
     
     await message.answer(
         "⚙️ *Настройки*\n\n"
-        "Что хочешь настроить?",
+        "Что хочешь настроить?\n\n"
+        "_Чтобы загрузить старые расходы, пришли CSV-файл или выписку из банка_",
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=await get_settings_keyboard()
+        reply_markup=SETTINGS_KEYBOARD
     )
 
 
-@dp.message(F.text == "🧹 Очистить статистику")
+@handler(F.text == "🧹 Очистить статистику")
 async def handle_clear_stats(message: Message):
     """Очистка статистики с подтверждением"""
-    
-    # Клавиатура для подтверждения
-    confirm_keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="✅ Да, удалить всю статистику")],
-            [KeyboardButton(text="❌ Нет, отменить")]
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=True
-    )
-    
     await message.answer(
         "⚠️ *Внимание!* Это удалит ВСЮ историю расходов.\n\n"
         "Категории останутся, но все записи о расходах будут удалены.\n"
         "Это действие нельзя отменить!\n\n"
         "Продолжить?",
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=confirm_keyboard
+        reply_markup=CLEAR_CONFIRM_KEYBOARD
     )
 
-@dp.message(F.text == "✅ Да, удалить всю статистику")
-async def handle_clear_confirm(message: Message):
+@handler(F.text == "✅ Да, удалить всю статистику")
+async def handle_clear_confirm(message: Message, app: App):
     """Подтверждение очистки статистики"""
     user_id = message.from_user.id
     
-    deleted_count = db.clear_user_statistics(user_id)
+    deleted_count = await app.db.clear_user_statistics(user_id)
     
     await message.answer(
         f"✅ Статистика очищена!\n"
         f"Удалено записей: *{deleted_count}*\n\n"
         f"Категории сохранены. Можно начать вести учёт заново!",
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=await get_settings_keyboard()
+        reply_markup=SETTINGS_KEYBOARD
     )
 
-@dp.message(F.text == "❌ Нет, отменить")
+@handler(F.text == "❌ Нет, отменить")
 async def handle_clear_cancel(message: Message):
     """Отмена очистки"""
     await message.answer(
         "Очистка отменена ✅",
-        reply_markup=await get_settings_keyboard()
+        reply_markup=SETTINGS_KEYBOARD
     )
 
 
-@dp.message(F.text == "📝 Редактировать категории")
-async def handle_edit_categories(message: Message):
+@handler(F.text == "📝 Редактировать категории")
+async def handle_edit_categories(message: Message, app: App):
     """Вход в режим редактирования категорий"""
     user_id = message.from_user.id
     
     # Входим в режим редактирования
-    if user_id not in user_temp_data:
-        user_temp_data[user_id] = {}
-    user_temp_data[user_id]['editing_mode'] = True
+    await app.storage.update_user_data(user_id, editing_mode=True)
     
     await message.answer(
         "📝 *Режим редактирования категорий*\n\n"
@@ -284,49 +719,99 @@ async def handle_edit_categories(message: Message):
         "• Кнопка «➕ Новая категория» — добавляет новую\n"
         "• «✅ Завершить редактирование» — выходит из режима",
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=await get_edit_keyboard(user_id)
+        reply_markup=await get_edit_keyboard(app, user_id)
     )
 
 
-@dp.message(F.text == "⬅️ Назад в меню")
-async def handle_back_to_menu(message: Message):
+@handler(F.text == "⬅️ Назад в меню")
+async def handle_back_to_menu(message: Message, app: App):
     """Возврат в главное меню"""
     user_id = message.from_user.id
     
     # Выходим из режима редактирования если были в нём
-    if user_id in user_temp_data and user_temp_data[user_id].get('editing_mode'):
-        user_temp_data[user_id]['editing_mode'] = False
+    if await is_editing(app, user_id):
+        await app.storage.update_user_data(user_id, editing_mode=False)
     
     await message.answer(
         "Возвращаемся в главное меню...",
-        reply_markup=await get_main_keyboard(user_id)
+        reply_markup=await get_main_keyboard(app, user_id)
     )
 
 
     # ----- ЭКСПОРТ ДАННЫХ -----
-@dp.message(F.text == "📤 Экспорт данных")
-async def handle_export(message: Message):
-    """Экспорт данных (заглушка)"""
+@handler(F.text == "📤 Экспорт данных")
+async def handle_export(message: Message, app: App):
+    """Выгрузка всех расходов в CSV и Excel"""
     user_id = message.from_user.id
-    total_expenses = db.get_today_expenses(user_id)
     
-    await message.answer(
-        f"📤 *Экспорт данных*\n\n"
-        f"Эта функция в разработке.\n"
-        f"Скоро можно будет экспортировать данные в Excel.\n\n"
-        f"Сегодня потрачено: *{total_expenses} руб.*",
-        parse_mode=ParseMode.MARKDOWN,
-        reply_markup=await get_settings_keyboard()
+    await message.answer("📤 Готовлю выгрузку...")
+    csv_file, xlsx_file, count = await export_expenses(app.db, user_id)
+    try:
+        if not count:
+            await message.answer(
+                "📭 Пока нечего выгружать — расходов нет.",
+                reply_markup=SETTINGS_KEYBOARD
+            )
+            return
+        
+        await message.answer_document(
+            SpooledInputFile(csv_file, filename="expenses.csv"),
+            caption=f"📤 *Экспорт данных*\n\nЗаписей: *{count}*",
+            parse_mode=ParseMode.MARKDOWN
+        )
+        await message.answer_document(
+            SpooledInputFile(xlsx_file, filename="expenses.xlsx"),
+            reply_markup=SETTINGS_KEYBOARD
+        )
+    finally:
+        csv_file.close()
+        xlsx_file.close()
+
+# ----- ИМПОРТ ДАННЫХ -----
+@handler(F.document)
+async def handle_import(message: Message, app: App):
+    """Импорт расходов из CSV-файла или банковской выписки"""
+    user_id = message.from_user.id
+    document = message.document
+    
+    if not (document.file_name or '').lower().endswith('.csv'):
+        await message.answer("📥 Для импорта пришли CSV-файл (подойдёт и выписка из банка).")
+        return
+    
+    await message.answer("📥 Загружаю расходы из файла...")
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as file:
+        await app.bot.download(document, destination=file)
+        try:
+            result = await import_expenses(app.db, user_id, file)
+        except ImportFormatError as e:
+            await message.answer(f"❌ Не получилось разобрать файл: {e}")
+            return
+    
+    text = (
+        f"✅ Импорт завершён!\n"
+        f"Добавлено расходов: {result.imported}\n"
+        f"Скорость: {result.rows_per_sec:.0f} строк/с"
     )
+    if result.skipped:
+        text += f"\nПропущено поступлений: {result.skipped}"
+    if result.new_categories:
+        text += f"\nНовые категории: {', '.join(result.new_categories)}"
+    if result.rejected:
+        text += f"\n\n⚠️ Отброшено строк с ошибками: {result.rejected}"
+        for line, reason in result.errors:
+            text += f"\n• строка {line}: {reason}"
+    
+    await message.answer(text, reply_markup=await get_main_keyboard(app, user_id))
+
 
 # ----- РЕЖИМ РЕДАКТИРОВАНИЯ КАТЕГОРИЙ -----
-@dp.message(F.text == "➕ Новая категория")
-async def add_category_start(message: Message, state: FSMContext):
+@handler(F.text == "➕ Новая категория")
+async def add_category_start(message: Message, state: FSMContext, app: App):
     """Начало добавления новой категории"""
     user_id = message.from_user.id
     
     # Проверяем, что пользователь в режиме редактирования
-    if user_id not in user_temp_data or not user_temp_data[user_id].get('editing_mode'):
+    if not await is_editing(app, user_id):
         await message.answer("❌ Сначала зайди в режим редактирования категорий!")
         return
     
@@ -340,117 +825,99 @@ async def add_category_start(message: Message, state: FSMContext):
     await state.set_state(CategoryStates.waiting_for_category_name)
 
 
-@dp.message(F.text == "✅ Завершить редактирование")
-async def finish_editing(message: Message):
+@handler(F.text == "✅ Завершить редактирование")
+async def finish_editing(message: Message, app: App):
     """Выход из режима редактирования"""
     user_id = message.from_user.id
     
-    if user_id in user_temp_data:
-        user_temp_data[user_id]['editing_mode'] = False
+    await app.storage.update_user_data(user_id, editing_mode=False)
     
     await message.answer(
         "✅ Изменения сохранены! Возвращаемся в настройки...",
-        reply_markup=await get_settings_keyboard()
+        reply_markup=SETTINGS_KEYBOARD
     )
 
 
 # ----- РЕЖИМ ДОБАВЛЕНИЯ РАСХОДОВ -----
-@dp.message(F.text.regexp(r'^[^\s]+\s.+$'))  # Сообщение вида "🍕 Еда"
-async def handle_category_select(message: Message, state: FSMContext):
-    logger.info(f"[DEBUG] Получено: '{message.text}', User: {message.from_user.id}")
+@handler(F.text.regexp(r'^[^\s]+\s.+$'))  # Сообщение вида "🍕 Еда"
+async def handle_category_select(message: Message, state: FSMContext, app: App):
     """Обработка выбора категории для добавления расхода"""
     user_id = message.from_user.id
     pressed_text = message.text
     
-    # КРИТИЧЕСКИ ВАЖНО: игнорируем служебные кнопки
-    service_buttons = [
-        "📊 Статистика", 
-        "⚙️ Настройки", 
-        "📝 Редактировать категории",
-        "📤 Экспорт данных", 
-        "⬅️ Назад в меню",
-        "➕ Новая категория",
-        "✅ Завершить редактирование"
-    ]
-    
-    if pressed_text in service_buttons:
+    # КРИТИЧЕСКИ ВАЖНО: игнорируем служебные кнопки (до любых запросов к БД)
+    if pressed_text in SERVICE_BUTTONS:
         return  # Пусть эти кнопки обрабатываются своими хендлерами
     
+    category = (await get_category_index(app, user_id)).get(pressed_text)
+    if category is None:
+        await message.answer("Категория не найдена")
+        return
+    cat_id, name, emoji = category
+    
     # Если пользователь в режиме редактирования - это ДОЛЖНО быть удаление
-    if user_id in user_temp_data and user_temp_data[user_id].get('editing_mode'):
+    if await is_editing(app, user_id):
         # Долгое нажатие в режиме редактирования = УДАЛЕНИЕ
-        categories = db.get_user_categories(user_id)
-        for cat_id, name, emoji in categories:
-            if pressed_text == f"{emoji} {name}":
-                db.delete_category(user_id, cat_id)
-                await message.answer(
-                    f"🗑️ Категория «{name}» удалена!",
-                    reply_markup=await get_edit_keyboard(user_id)
-                )
-                return
-        await message.answer("Категория не найдена")
+        await app.db.delete_category(user_id, cat_id)
+        await message.answer(
+            f"🗑️ Категория «{name}» удалена!",
+            reply_markup=await get_edit_keyboard(app, user_id)
+        )
         return
     
     # Если НЕ в режиме редактирования - это ВЫБОР категории для расхода
-    categories = db.get_user_categories(user_id)
-    for cat_id, name, emoji in categories:
-        if pressed_text == f"{emoji} {name}":
-            # Сохраняем выбранную категорию
-            if user_id not in user_temp_data:
-                user_temp_data[user_id] = {}
-            user_temp_data[user_id]['selected_category'] = cat_id
-            user_temp_data[user_id]['selected_name'] = name
-            user_temp_data[user_id]['selected_emoji'] = emoji
-            
-            await message.answer(
-                f"Выбрано: {emoji} *{name}*\n\n"
-                "📥 Введи сумму расхода:",
-                parse_mode=ParseMode.MARKDOWN
-            )
-            await state.set_state(ExpenseStates.waiting_for_amount)
-            return
+    # Сохраняем выбранную категорию
+    await app.storage.update_user_data(
+        user_id, selected_category=cat_id, selected_name=name, selected_emoji=emoji
+    )
     
-    await message.answer("Категория не найдена")
+    await message.answer(
+        f"Выбрано: {emoji} *{name}*\n\n"
+        "📥 Введи сумму расхода:",
+        parse_mode=ParseMode.MARKDOWN
+    )
+    await state.set_state(ExpenseStates.waiting_for_amount)
 
-@dp.message(ExpenseStates.waiting_for_amount)
-async def handle_expense_amount(message: Message, state: FSMContext):
+@handler(ExpenseStates.waiting_for_amount)
+async def handle_expense_amount(message: Message, state: FSMContext, app: App):
     """Обработка ввода суммы расхода"""
     user_id = message.from_user.id
     
     try:
         amount = float(message.text.replace(',', '.'))
+        # nan и inf float() тоже принимает
+        if not math.isfinite(amount):
+            raise ValueError(message.text)
         
         if amount <= 0:
             await message.answer("❌ Сумма должна быть больше нуля!")
             return
         
         # Проверяем выбранную категорию
-        if user_id not in user_temp_data or 'selected_category' not in user_temp_data[user_id]:
+        user_data = await app.storage.get_user_data(user_id)
+        if 'selected_category' not in user_data:
             await message.answer("❌ Сначала выбери категорию!")
             await state.clear()
             return
         
-        cat_id = user_temp_data[user_id]['selected_category']
-        cat_name = user_temp_data[user_id]['selected_name']
-        cat_emoji = user_temp_data[user_id]['selected_emoji']
+        cat_id = user_data['selected_category']
+        cat_name = user_data['selected_name']
+        cat_emoji = user_data['selected_emoji']
         
         # Добавляем расход
-        db.add_expense(user_id, cat_id, amount)
+        await app.db.add_expense(user_id, cat_id, amount)
+        alerts = await get_budget_alerts(app, user_id, cat_id, amount)
         
         # Очищаем временные данные
-        if user_id in user_temp_data:
-            if 'selected_category' in user_temp_data[user_id]:
-                del user_temp_data[user_id]['selected_category']
-            if 'selected_name' in user_temp_data[user_id]:
-                del user_temp_data[user_id]['selected_name']
-            if 'selected_emoji' in user_temp_data[user_id]:
-                del user_temp_data[user_id]['selected_emoji']
+        await app.storage.update_user_data(
+            user_id, selected_category=None, selected_name=None, selected_emoji=None
+        )
         
         await message.answer(
             f"✅ Расход добавлен!\n"
-            f"{cat_emoji} *{cat_name}*: {amount:.2f} руб.",
+            f"{cat_emoji} *{cat_name}*: {amount:.2f} руб.{alerts}",
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=await get_main_keyboard(user_id)
+            reply_markup=await get_main_keyboard(app, user_id)
         )
         await state.clear()
         
@@ -460,7 +927,7 @@ async def handle_expense_amount(message: Message, state: FSMContext):
 
 
 
-@dp.message(CategoryStates.waiting_for_category_name)
+@handler(CategoryStates.waiting_for_category_name)
 async def add_category_name(message: Message, state: FSMContext):
     """Получаем название категории"""
     name = message.text.strip()
@@ -478,8 +945,8 @@ async def add_category_name(message: Message, state: FSMContext):
     )
     await state.set_state(CategoryStates.waiting_for_category_emoji)
 
-@dp.message(CategoryStates.waiting_for_category_emoji)
-async def add_category_emoji(message: Message, state: FSMContext):
+@handler(CategoryStates.waiting_for_category_emoji)
+async def add_category_emoji(message: Message, state: FSMContext, app: App):
     """Завершаем создание категории"""
     user_data = await state.get_data()
     name = user_data['category_name']
@@ -490,27 +957,103 @@ async def add_category_emoji(message: Message, state: FSMContext):
         emoji = message.text[:2]
     
     # Добавляем в БД
-    db.add_category(message.from_user.id, name, emoji)
+    await app.db.add_category(message.from_user.id, name, emoji)
     
     await message.answer(
         f"✅ Категория добавлена!\n{emoji} *{name}*",
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=await get_edit_keyboard(message.from_user.id)
+        reply_markup=await get_edit_keyboard(app, message.from_user.id)
     )
     await state.clear()
  
 
 # ========== ЗАПУСК БОТА ==========
-async def main():
+async def run_webhook(app):
+    """Режим вебхука: aiohttp-сервер принимает обновления от Telegram"""
+    # aiohttp.web нужен только вебхуку и воркеру — при опросе его не грузим
+    from webhook import create_webhook_app, serve
+
+    if not WEBHOOK_URL:
+        raise RuntimeError("Для режима webhook нужен WEBHOOK_URL в .env")
+    
+    web_app = create_webhook_app(
+        app.dp, app.bot, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET, metrics=app.serializer.stats
+    )
+    await app.bot.set_webhook(
+        f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=app.dp.resolve_used_update_types()
+    )
+    logger.info(f"Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    await serve(web_app, WEBHOOK_HOST, WEBHOOK_PORT)
+
+async def run_worker(app):
+    """Режим шарда: обновления пересылает runner.py, вебхук в Telegram не ставим"""
+    from webhook import create_webhook_app, serve
+
+    web_app = create_webhook_app(app.dp, app.bot, path=WEBHOOK_PATH, metrics=app.serializer.stats)
+    logger.info(f"Воркер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    await serve(web_app, WEBHOOK_HOST, WEBHOOK_PORT)
+
+async def warm_up_charts(app):
+    """Фоновый прогрев графиков: matplotlib грузится, пока бот уже отвечает"""
+    try:
+        seconds = await app.charts.warm_up()
+    except BrokenProcessPool:
+        logger.warning("Процесс отрисовки графиков упал при прогреве, пул пересоздастся при первом графике")
+        return
+    if seconds is not None:
+        logger.info(f"Графики прогреты за {seconds:.1f} с")
+
+async def main(token):
     logger.info("Запуск бота...")
-    me = await bot.get_me()
+    started = time.perf_counter()
+    app = create_app(token)
+    built = time.perf_counter()
+    warm_up = asyncio.create_task(warm_up_charts(app))
+    background = [asyncio.create_task(app.digests.run()), asyncio.create_task(app.maintenance.run())]
+    me = await app.bot.get_me()
+    logger.info(
+        f"Старт: импорт {IMPORT_SECONDS * 1000:.0f} мс, сборка {(built - started) * 1000:.0f} мс, "
+        f"get_me {(time.perf_counter() - built) * 1000:.0f} мс"
+    )
     logger.info(f"Бот @{me.username} запущен!")
     print(f"\n=== Бот @{me.username} запущен ===")
     print("Бот готов к работе! Напиши /start или нажми кнопку START")
-    await dp.start_polling(bot)
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    try:
+        if BOT_MODE == 'webhook':
+            await run_webhook(app)
+        elif BOT_MODE == 'worker':
+            await run_worker(app)
+        else:
+            # Telegram не отдаёт обновления опросом, пока установлен вебхук
+            await app.bot.delete_webhook()
+            await app.dp.start_polling(app.bot)
+    finally:
+        warm_up.cancel()
+        # Рассылка и обслуживание пишут в базу, поэтому останавливаются до её закрытия
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        cache = app.db.category_cache
+        logger.info(
+            f"Кэш категорий: попаданий {cache.hits}, промахов {cache.misses} "
+            f"({cache.hit_rate:.0%})"
+        )
+        updates = app.serializer.stats()
+        logger.info(
+            f"Обновления: обработано {updates['processed']}, отброшено по лимиту {updates['rejected']}, "
+            f"ожидание в очереди: среднее {updates['wait_avg_ms']:.1f} мс, максимум {updates['wait_max_ms']:.1f} мс, "
+            f"пик очереди {updates['max_waiting']}"
+        )
+        await app.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 if __name__ == '__main__':
+    setup_logging()
     try:
-        asyncio.run(main())
+        asyncio.run(main(load_token()))
     except KeyboardInterrupt:
-        logger.info("Бот остановлен")
\ No newline at end of file
+        logger.info("Бот остановлен")
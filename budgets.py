@@ -0,0 +1,35 @@
+"""Месячные бюджеты: предупреждения, когда траты переходят 80% и 100%.
+
+Проверка идёт после каждого расхода и ничего не пересчитывает: траты
+месяца берутся из AsyncDatabase.get_month_totals, которые add_expense
+обновляет в памяти, а бюджеты — из кэша.
+"""
+
+# category_id общего бюджета на все расходы
+TOTAL = 0
+
+# От старшего к младшему: если расход перешагнул оба порога, сообщаем о старшем
+THRESHOLDS = (1.0, 0.8)
+
+
+def crossed(limit, before, after):
+    """Порог, который траты перешли от before к after, или None"""
+    for threshold in THRESHOLDS:
+        if before < limit * threshold <= after:
+            return threshold
+    return None
+
+
+def check_expense(budgets, totals, category_id, amount):
+    """Пороги, пройденные расходом amount (он уже учтён в totals).
+
+    Возвращает [(category_id или TOTAL, порог, потрачено, бюджет)].
+    """
+    alerts = []
+    for key, spent in ((category_id, totals.by_category.get(category_id, 0.0)), (TOTAL, totals.total)):
+        limit = budgets.get(key)
+        if limit:
+            threshold = crossed(limit, spent - amount, spent)
+            if threshold is not None:
+                alerts.append((key, threshold, spent, limit))
+    return alerts
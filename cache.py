@@ -0,0 +1,103 @@
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """LRU-кэш с ограничением по числу записей и временем жизни (ttl, секунды).
+
+    Считает попадания и промахи, чтобы было видно, сколько запросов
+    к базе он на самом деле экономит.
+    """
+
+    def __init__(self, maxsize=10000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # {key: (expires_at, value)}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is not None and item[0] is not None and item[0] < time.monotonic():
+            self._remove(key)
+            item = None
+        if item is None:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def peek(self, key, default=None):
+        """Значение без учёта в попаданиях и без обновления порядка вытеснения"""
+        item = self._data.get(key)
+        if item is None or (item[0] is not None and item[0] < time.monotonic()):
+            return default
+        return item[1]
+
+    def set(self, key, value):
+        if key in self._data:
+            self._remove(key)
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._shrink()
+
+    def invalidate(self, key):
+        if key in self._data:
+            self._remove(key)
+
+    def clear(self):
+        self._data.clear()
+
+    def _remove(self, key):
+        del self._data[key]
+
+    def _shrink(self):
+        while len(self._data) > self.maxsize:
+            self._remove(next(iter(self._data)))
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class SizedLRUCache(LRUCache):
+    """LRU-кэш с ограничением по суммарному размеру значений в байтах.
+
+    sizeof(value) возвращает размер значения; самые старые записи
+    вытесняются, пока сумма не уложится в maxbytes.
+    """
+
+    def __init__(self, maxbytes, sizeof=len, ttl=None):
+        super().__init__(maxsize=None, ttl=ttl)
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.currbytes = 0
+        self._sizes = {}
+
+    def set(self, key, value):
+        self.invalidate(key)
+        size = self.sizeof(value)
+        if size > self.maxbytes:
+            # Не влезет в бюджет: не выталкиваем ради него весь кэш
+            return
+        self._sizes[key] = size
+        self.currbytes += size
+        super().set(key, value)
+
+    def clear(self):
+        super().clear()
+        self._sizes.clear()
+        self.currbytes = 0
+
+    def _remove(self, key):
+        super()._remove(key)
+        self.currbytes -= self._sizes.pop(key)
+
+    def _shrink(self):
+        while self.currbytes > self.maxbytes:
+            self._remove(next(iter(self._data)))
@@ -0,0 +1,122 @@
+import asyncio
+import importlib.util
+import io
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import Histogram
+
+RENDER_SECONDS = Histogram('finance_chart_render_seconds', 'Время отрисовки графика, включая очередь пула')
+
+
+# ========== ФУНКЦИИ ДЛЯ ПРОЦЕССОВ-ОТРИСОВЩИКОВ ==========
+def _init_worker():
+    """Прогрев процесса: грузим matplotlib и кэш шрифтов заранее"""
+    import warnings
+    # Эмодзи в подписях нет в шрифте: предупреждение на каждый график — только шум в stderr
+    warnings.filterwarnings('ignore', message='Glyph .* missing from font', category=UserWarning)
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(1, 1))
+    fig.subplots().pie([1])
+    fig.savefig(io.BytesIO(), format='png')
+
+
+def _warm_up():
+    return True
+
+
+def render_pie_chart(labels, amounts, title):
+    """Рисует круговую диаграмму и возвращает PNG в байтах"""
+    from matplotlib.figure import Figure
+
+    # Объектный Figure вместо pyplot: никакого глобального состояния
+    fig = Figure(figsize=(10, 10))
+    ax = fig.subplots()
+    ax.pie(amounts, labels=labels, autopct='%1.1f%%', startangle=90)
+    ax.set_title(title)
+    ax.axis('equal')
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=100, bbox_inches='tight')
+    return buf.getvalue()
+
+
+# ========== ПУЛ ОТРИСОВКИ ==========
+def _pool_context():
+    """Процессы не форкаются от бота: к запуску пула в нём уже работают
+    потоки баз, и fork унёс бы их замки в произвольном состоянии.
+    Новые процессы сами импортируют главный модуль, поэтому импорт бота
+    ничего не запускает (всё собирает create_app())"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+class ChartRenderer:
+    """Пул процессов для отрисовки графиков вне цикла событий бота"""
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.available = importlib.util.find_spec('matplotlib') is not None
+        self._pool = None
+        self._warming = []
+
+    def start(self):
+        """Запускает процессы; matplotlib они грузят сами, не блокируя бота"""
+        if self._pool is not None or not self.available:
+            return
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, mp_context=_pool_context()
+        )
+        self._warming = [self._pool.submit(_warm_up) for _ in range(self.workers)]
+
+    async def warm_up(self):
+        """Запускает пул и ждёт, пока процессы загрузят matplotlib и шрифты.
+
+        Возвращает время прогрева в секундах или None без matplotlib.
+        """
+        if not self.available:
+            return None
+        started = time.perf_counter()
+        self.start()
+        pool = self._pool
+        try:
+            await asyncio.gather(*(asyncio.wrap_future(future) for future in self._warming))
+        except BrokenProcessPool:
+            self._discard(pool)
+            raise
+        return time.perf_counter() - started
+
+    async def render_pie(self, labels, amounts, title):
+        """PNG диаграммы; BrokenProcessPool, если процесс пула умер (пул пересоздастся при следующем вызове)"""
+        if not self.available:
+            raise ImportError("matplotlib не установлен")
+        self.start()
+        pool = self._pool
+        loop = asyncio.get_running_loop()
+        with RENDER_SECONDS.time():
+            try:
+                return await loop.run_in_executor(
+                    pool, render_pie_chart, list(labels), list(amounts), title
+                )
+            except BrokenProcessPool:
+                self._discard(pool)
+                raise
+
+    def _discard(self, pool):
+        """Убирает сломанный пул (процесс убит по OOM или упал); start() создаст новый"""
+        # Параллельные отрисовки падают вместе — новый пул мог уже появиться
+        if self._pool is pool:
+            self._pool = None
+            self._warming = []
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
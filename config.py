@@ -0,0 +1,106 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ========== ЛОГИ И МЕТРИКИ ==========
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# В DEBUG пишется только каждое N-е сообщение пользователя
+LOG_SAMPLE_RATE = int(os.getenv('LOG_SAMPLE_RATE', '100'))
+# Локальный адрес GET /metrics (формат Prometheus); порт 0 — не поднимать
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9090'))
+
+# ========== БАЗА ДАННЫХ ==========
+DB_PATH = os.getenv('DB_PATH', 'finance.db')
+# Профиль соединения: журнал (wal/delete), synchronous (normal/full),
+# кэш страниц и mmap в мегабайтах, ожидание чужой блокировки в мс,
+# размер кэша подготовленных запросов на соединение
+DB_JOURNAL_MODE = os.getenv('DB_JOURNAL_MODE', 'wal')
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'normal')
+DB_CACHE_SIZE_MB = int(os.getenv('DB_CACHE_SIZE_MB', '16'))
+DB_MMAP_SIZE_MB = int(os.getenv('DB_MMAP_SIZE_MB', '256'))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', '256'))
+# Потоков для чтения (в режиме WAL читают параллельно с записью). На одном
+# ядре выигрыша нет, только накладные расходы, поэтому по умолчанию — по ядрам
+DB_READERS = int(os.getenv('DB_READERS', str(min(4, (os.cpu_count() or 1) - 1))))
+
+# ========== ГРУППОВАЯ ЗАПИСЬ РАСХОДОВ ==========
+# Расходы от разных пользователей копятся до EXPENSE_BATCH_SIZE штук
+# или EXPENSE_BATCH_INTERVAL_MS миллисекунд и пишутся одной транзакцией
+EXPENSE_BATCH_INTERVAL_MS = int(os.getenv('EXPENSE_BATCH_INTERVAL_MS', '5'))
+EXPENSE_BATCH_SIZE = int(os.getenv('EXPENSE_BATCH_SIZE', '500'))
+
+# ========== КЭШ КАТЕГОРИЙ ==========
+# Сколько пользователей держать в кэше и сколько секунд верить записи
+CATEGORY_CACHE_SIZE = int(os.getenv('CATEGORY_CACHE_SIZE', '10000'))
+CATEGORY_CACHE_TTL = float(os.getenv('CATEGORY_CACHE_TTL', '600'))
+
+# ========== ГРАФИКИ ==========
+# Сколько процессов рисуют графики статистики
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', '2'))
+
+# Бюджет кэша готовой статистики (графики и подписи), байт
+STATS_CACHE_BYTES = int(os.getenv('STATS_CACHE_BYTES', str(64 * 1024 * 1024)))
+
+# ========== АНАЛИТИКА ==========
+# Бюджет кэша дневных итогов пользователей в массивах NumPy, байт
+ANALYTICS_CACHE_BYTES = int(os.getenv('ANALYTICS_CACHE_BYTES', str(16 * 1024 * 1024)))
+
+# ========== ДАЙДЖЕСТЫ ==========
+# Какие сводки рассылать (day, week через запятую; пусто — не рассылать)
+# и в котором часу по UTC: дневная — за вчера, недельная — по понедельникам
+DIGEST_KINDS = [kind.strip() for kind in os.getenv('DIGEST_KINDS', 'day,week').split(',') if kind.strip()]
+DIGEST_HOUR = int(os.getenv('DIGEST_HOUR', '6'))
+# Сообщений в секунду на всю рассылку (Telegram пускает около 30 на бота,
+# оставляем запас ответам пользователям) и сколько можно подряд
+DIGEST_RATE = float(os.getenv('DIGEST_RATE', '25'))
+DIGEST_BURST = int(os.getenv('DIGEST_BURST', '5'))
+# Сколько сообщений в полёте одновременно и сколько пользователей на страницу расчёта
+DIGEST_CONCURRENCY = int(os.getenv('DIGEST_CONCURRENCY', '8'))
+DIGEST_PAGE_SIZE = int(os.getenv('DIGEST_PAGE_SIZE', '1000'))
+
+# ========== ОБСЛУЖИВАНИЕ БАЗЫ ==========
+# В котором часу (UTC) раз в сутки вычищать удалённое, возвращать место
+# и обновлять статистику планировщика; -1 — не запускать
+MAINTENANCE_HOUR = int(os.getenv('MAINTENANCE_HOUR', '3'))
+# Через сколько дней после удаления категории её расходы удаляются насовсем
+MAINTENANCE_RETENTION_DAYS = int(os.getenv('MAINTENANCE_RETENTION_DAYS', '30'))
+# Размер одного шага: расходов на удаление и страниц на incremental_vacuum
+MAINTENANCE_BATCH_SIZE = int(os.getenv('MAINTENANCE_BATCH_SIZE', '100'))
+MAINTENANCE_VACUUM_PAGES = int(os.getenv('MAINTENANCE_VACUUM_PAGES', '64'))
+
+# ========== СОСТОЯНИЯ ПОЛЬЗОВАТЕЛЕЙ ==========
+# Файл, где переживают перезапуск FSM и временные данные пользователей
+STATE_DB = os.getenv('STATE_DB', 'state.db')
+# Через сколько секунд бездействия состояние пользователя забывается
+STATE_TTL = int(os.getenv('STATE_TTL', str(7 * 24 * 3600)))
+# Сколько пользователей держать в памяти
+STATE_HOT_SIZE = int(os.getenv('STATE_HOT_SIZE', '10000'))
+
+# ========== ОЧЕРЁДНОСТЬ И ЛИМИТЫ ОБНОВЛЕНИЙ ==========
+# Сколько обновлений обрабатывается одновременно (обновления одного
+# пользователя всегда идут по очереди)
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '100'))
+# Сколько сообщений в секунду можно одному пользователю и сколько подряд; 0 — без лимита
+USER_RATE_LIMIT = float(os.getenv('USER_RATE_LIMIT', '3'))
+USER_RATE_BURST = int(os.getenv('USER_RATE_BURST', '10'))
+
+# ========== ПОЛУЧЕНИЕ ОБНОВЛЕНИЙ ==========
+# polling — долгий опрос Telegram, webhook — Telegram сам присылает обновления,
+# worker — процесс-шард, которому обновления пересылает runner.py
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публичный адрес бота (https://example.com), к нему добавляется WEBHOOK_PATH
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+# Свой сервер Bot API (например, локальный telegram-bot-api), по умолчанию — официальный
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL') or None
+
+# ========== ШАРДИРОВАНИЕ (runner.py) ==========
+# Сколько процессов-воркеров и с какого порта они слушают на 127.0.0.1
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', str(os.cpu_count() or 1)))
+SHARD_BASE_PORT = int(os.getenv('SHARD_BASE_PORT', '8100'))
@@ -1,15 +1,27 @@
+import asyncio
+import itertools
+import math
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
 
-class Database:
-    def __init__(self, db_name='finance.db'):
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self.create_tables()
-    
-    def create_tables(self):
-        # Таблица категорий (основная)
-        self.cursor.execute('''
+from cache import LRUCache
+from metrics import Histogram
+
+QUERY_SECONDS = Histogram(
+    'finance_db_query_seconds', 'Время метода Database в потоке базы (без ожидания очереди)', ('method',)
+)
+
+# ========== МИГРАЦИИ СХЕМЫ ==========
+# Номер применённой миграции хранится в PRAGMA user_version.
+# Миграции только дописываются в конец списка, старые не меняются.
+MIGRATIONS = [
+    # 1: таблицы категорий и расходов
+    [
+        '''
             CREATE TABLE IF NOT EXISTS user_categories (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
@@ -19,10 +31,8 @@ class Database:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 UNIQUE(user_id, name)
             )
-        ''')
-        
-        # Таблица расходов
-        self.cursor.execute('''
+        ''',
+        '''
             CREATE TABLE IF NOT EXISTS expenses (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
@@ -31,16 +41,215 @@ class Database:
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (category_id) REFERENCES user_categories (id)
             )
-        ''')
-        
-        # Добавляем стандартные категории при первом запуске для нового пользователя
-        default_categories = [
-            ('Еда', '🍕'),
-            ('Транспорт', '🚗'),
-            ('Одежда', '👕'),
-            ('Развлечения', '🎬')
+        ''',
+    ],
+    # 2: индексы для выборок расходов по пользователю
+    [
+        'CREATE INDEX IF NOT EXISTS idx_expenses_user_created ON expenses (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_expenses_user_category ON expenses (user_id, category_id)',
+    ],
+    # 3: дневные итоги по категориям для статистики
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS expense_daily (
+                user_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                category_id INTEGER NOT NULL,
+                total REAL NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (user_id, day, category_id)
+            ) WITHOUT ROWID
+        ''',
+        '''
+            INSERT INTO expense_daily (user_id, day, category_id, total, count)
+            SELECT user_id, date(created_at), category_id, SUM(amount), COUNT(*)
+            FROM expenses
+            GROUP BY user_id, date(created_at), category_id
+        ''',
+    ],
+    # 4: месячные бюджеты; category_id = 0 — бюджет на все расходы
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS budgets (
+                user_id INTEGER NOT NULL,
+                category_id INTEGER NOT NULL,
+                amount REAL NOT NULL,
+                PRIMARY KEY (user_id, category_id)
+            ) WITHOUT ROWID
+        ''',
+    ],
+    # 5: прогресс рассылки дайджестов — до какого пользователя всё отправлено
+    [
+        '''
+            CREATE TABLE IF NOT EXISTS digest_runs (
+                kind TEXT NOT NULL,
+                period TEXT NOT NULL,
+                last_user_id INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                finished_at TIMESTAMP,
+                PRIMARY KEY (kind, period)
+            ) WITHOUT ROWID
+        ''',
+    ],
+    # 6: когда категория удалена — по этому времени обслуживание вычищает её данные
+    [
+        'ALTER TABLE user_categories ADD COLUMN deleted_at TIMESTAMP',
+        # Уже удалённым категориям отсчёт начинается с этой миграции
+        'UPDATE user_categories SET deleted_at = CURRENT_TIMESTAMP WHERE is_deleted = 1',
+        '''
+            CREATE INDEX IF NOT EXISTS idx_user_categories_deleted
+            ON user_categories (deleted_at) WHERE is_deleted = 1
+        ''',
+    ],
+    # 7: расходы, которые INSERT OR REPLACE в add_category оставил без категории,
+    # снова привязываются к категории — удалённой, со сроком хранения от этой миграции
+    [
+        '''
+            INSERT OR IGNORE INTO user_categories (id, user_id, name, emoji, is_deleted, deleted_at)
+            SELECT e.category_id, MIN(e.user_id), 'Удалённая #' || e.category_id, '🗑', 1, CURRENT_TIMESTAMP
+            FROM expenses e
+            WHERE NOT EXISTS (SELECT 1 FROM user_categories uc WHERE uc.id = e.category_id)
+            GROUP BY e.category_id
+        ''',
+    ],
+]
+
+
+def current_month():
+    """Текущий месяц 'YYYY-MM' в UTC, как и created_at расходов"""
+    return datetime.now(timezone.utc).strftime('%Y-%m')
+
+
+def current_day():
+    """Текущий день 'YYYY-MM-DD' в UTC"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+
+class MonthTotals:
+    """Траты пользователя за месяц: всего и {category_id: сумма}"""
+
+    __slots__ = ('month', 'by_category', 'total')
+
+    def __init__(self, month, rows=()):
+        self.month = month
+        self.by_category = dict(rows)
+        self.total = sum(self.by_category.values())
+
+    def add(self, category_id, amount):
+        self.by_category[category_id] = self.by_category.get(category_id, 0.0) + amount
+        self.total += amount
+
+
+# ========== ПРОФИЛЬ СОЕДИНЕНИЯ ==========
+class ConnectionProfile:
+    """Настройки, с которыми открывается каждое соединение с SQLite.
+
+    journal_mode задаётся для файла и сохраняется в нём; WAL позволяет
+    читать параллельно с записью. None в любом параметре — оставить
+    значение SQLite по умолчанию. auto_vacuum действует только на новый,
+    ещё пустой файл; существующую базу переводит `manage.py vacuum`.
+    """
+
+    def __init__(self, journal_mode='wal', synchronous='normal', cache_size_kb=16 * 1024,
+                 mmap_size=256 * 1024 * 1024, busy_timeout=5.0, cached_statements=256,
+                 temp_store='memory', auto_vacuum='incremental'):
+        self.auto_vacuum = auto_vacuum
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.temp_store = temp_store
+
+    def connect(self, db_name):
+        # Соединение не делится между потоками (см. Database.conn), но закрывает
+        # их все поток, вызвавший Database.close, поэтому проверку потока отключаем
+        conn = sqlite3.connect(
+            db_name,
+            timeout=self.busy_timeout,  # сколько ждать чужую блокировку записи
+            cached_statements=self.cached_statements,
+            check_same_thread=False
+        )
+        pragmas = [
+            # Раньше journal_mode: после перехода в WAL файл уже не пустой
+            ('auto_vacuum', self.auto_vacuum),
+            ('journal_mode', self.journal_mode),
+            ('synchronous', self.synchronous),
+            # Отрицательное значение cache_size — размер в КиБ, а не в страницах
+            ('cache_size', -self.cache_size_kb if self.cache_size_kb else None),
+            ('mmap_size', self.mmap_size),
+            ('temp_store', self.temp_store),
         ]
-        self.conn.commit()
+        for name, value in pragmas:
+            if value is not None:
+                conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+
+DEFAULT_PROFILE = ConnectionProfile()
+# Как Database соединялся до появления профилей — для сравнения в бенчмарках
+LEGACY_PROFILE = ConnectionProfile(
+    journal_mode='delete', synchronous='full', cache_size_kb=None, mmap_size=None,
+    busy_timeout=5.0, cached_statements=128, temp_store=None, auto_vacuum=None
+)
+
+
+class Database:
+    """Синхронный доступ к базе расходов.
+
+    У каждого потока своё соединение и свой курсор (создаются при первом
+    обращении), поэтому один объект Database можно безопасно вызывать из
+    нескольких потоков. Исключение — ':memory:': такая база существует
+    только внутри своего соединения, и оно одно на все потоки.
+    """
+
+    def __init__(self, db_name='finance.db', profile=DEFAULT_PROFILE):
+        self.db_name = db_name
+        self.profile = profile
+        self._local = threading.local()
+        self._connections = []  # все открытые соединения, для close()
+        self._lock = threading.Lock()
+        self._shared = db_name == ':memory:'
+        self.create_tables()
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            with self._lock:
+                if self._shared and self._connections:
+                    conn = self._connections[0]
+                else:
+                    conn = self.profile.connect(self.db_name)
+                    self._connections.append(conn)
+            self._local.conn = conn
+            self._local.cursor = conn.cursor()
+        return conn
+
+    @property
+    def cursor(self):
+        if getattr(self._local, 'cursor', None) is None:
+            self.conn
+        return self._local.cursor
+    
+    def create_tables(self):
+        """Создаёт или обновляет схему, применяя недостающие миграции"""
+        self.cursor.execute('PRAGMA user_version')
+        version = self.cursor.fetchone()[0]
+        
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            # Каждая миграция — отдельная транзакция вместе с номером версии
+            self.cursor.execute('BEGIN')
+            try:
+                for statement in statements:
+                    self.cursor.execute(statement)
+                self.cursor.execute(f'PRAGMA user_version = {number}')
+            except Exception:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
     
     # --- Методы для категорий ---
     def init_user_categories(self, user_id):
@@ -74,20 +283,27 @@ class Database:
         return self.cursor.fetchall()
     
     def add_category(self, user_id, name, emoji='➕'):
-        """Добавляет новую категорию"""
+        """Добавляет категорию; удалённую с тем же названием восстанавливает
+
+        id существующей строки сохраняется, поэтому её расходы остаются при ней.
+        """
         self.cursor.execute('''
-            INSERT OR REPLACE INTO user_categories (user_id, name, emoji, is_deleted)
+            INSERT INTO user_categories (user_id, name, emoji, is_deleted)
             VALUES (?, ?, ?, 0)
+            ON CONFLICT (user_id, name) DO UPDATE
+            SET emoji = excluded.emoji, is_deleted = 0, deleted_at = NULL
+            RETURNING id
         ''', (user_id, name, emoji))
+        category_id = self.cursor.fetchone()[0]
         self.conn.commit()
-        return self.cursor.lastrowid
+        return category_id
     
     def delete_category(self, user_id, category_id):
         """Помечает категорию как удаленную (мягкое удаление)"""
         self.cursor.execute('''
             UPDATE user_categories 
-            SET is_deleted = 1 
-            WHERE id = ? AND user_id = ?
+            SET is_deleted = 1, deleted_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND user_id = ? AND is_deleted = 0
         ''', (category_id, user_id))
         self.conn.commit()
         return self.cursor.rowcount > 0
@@ -95,31 +311,92 @@ class Database:
     # --- Методы для расходов ---
     def add_expense(self, user_id, category_id, amount):
         """Добавляет расход"""
-        self.cursor.execute('''
-            INSERT INTO expenses (user_id, category_id, amount)
-            VALUES (?, ?, ?)
-        ''', (user_id, category_id, amount))
+        self.add_expenses([(user_id, category_id, amount)])
+
+    def add_expenses(self, rows):
+        """Добавляет пачку расходов одной транзакцией"""
+        # IMMEDIATE: MAX(id) читается уже под блокировкой записи, иначе
+        # параллельный писатель попадёт в дневные итоги дважды
+        self.cursor.execute('BEGIN IMMEDIATE')
+        try:
+            self.cursor.execute('SELECT COALESCE(MAX(id), 0) FROM expenses')
+            last_id = self.cursor.fetchone()[0]
+            self.cursor.executemany('''
+                INSERT INTO expenses (user_id, category_id, amount)
+                VALUES (?, ?, ?)
+            ''', rows)
+            self._update_rollups(last_id)
+        except Exception:
+            self.conn.rollback()
+            raise
         self.conn.commit()
+
+    def import_expenses(self, user_id, rows):
+        """Массовая вставка расходов с датами одной транзакцией
+
+        rows — (category_id, amount, created_at), created_at в формате
+        'YYYY-MM-DD HH:MM:SS'.
+        """
+        self.cursor.execute('BEGIN IMMEDIATE')
+        try:
+            self.cursor.execute('SELECT COALESCE(MAX(id), 0) FROM expenses')
+            last_id = self.cursor.fetchone()[0]
+            self.cursor.executemany('''
+                INSERT INTO expenses (user_id, category_id, amount, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', [(user_id, category_id, amount, created_at) for category_id, amount, created_at in rows])
+            self._update_rollups(last_id)
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        return len(rows)
+
+    def _update_rollups(self, after_id):
+        """Добавляет в дневные итоги расходы с id больше after_id"""
+        # NOT INDEXED: после ANALYZE планировщик предпочитает обойти весь
+        # индекс (user_id, category_id) ради GROUP BY без сортировки,
+        # а нужен короткий диапазон по rowid
+        self.cursor.execute('''
+            INSERT INTO expense_daily (user_id, day, category_id, total, count)
+            SELECT user_id, date(created_at), category_id, SUM(amount), COUNT(*)
+            FROM expenses NOT INDEXED
+            WHERE id > ?
+            GROUP BY user_id, date(created_at), category_id
+            ON CONFLICT (user_id, day, category_id) DO UPDATE
+            SET total = total + excluded.total, count = count + excluded.count
+        ''', (after_id,))
     
     def get_category_stats(self, user_id, days=30):
-        """Статистика по категориям за N дней"""
+        """Статистика по категориям за N дней: (категория, сумма, число расходов)
+
+        Полные дни берутся из дневных итогов, и только первый, неполный
+        день окна досчитывается по самим расходам.
+        """
         self.cursor.execute('''
-            SELECT uc.name || ' ' || uc.emoji as category, SUM(e.amount) as total
-            FROM expenses e
-            JOIN user_categories uc ON e.category_id = uc.id
-            WHERE e.user_id = ? 
-            AND e.created_at >= datetime('now', ?)
-            AND uc.is_deleted = 0
+            SELECT uc.name || ' ' || uc.emoji as category, SUM(t.amount) as total, SUM(t.count)
+            FROM (
+                SELECT category_id, total AS amount, count FROM expense_daily
+                WHERE user_id = ? AND day > date('now', ?)
+                UNION ALL
+                SELECT category_id, amount, 1 FROM expenses
+                WHERE user_id = ?
+                AND created_at >= datetime('now', ?)
+                AND created_at < date('now', ?, '+1 day')
+            ) t
+            JOIN user_categories uc ON t.category_id = uc.id
+            WHERE uc.is_deleted = 0
             GROUP BY uc.id
             ORDER BY total DESC
-        ''', (user_id, f'-{days} days'))
+        ''', (user_id, f'-{days} days', user_id, f'-{days} days', f'-{days} days'))
         return self.cursor.fetchall()
     
     def get_today_expenses(self, user_id):
         """Сумма расходов за сегодня"""
         self.cursor.execute('''
             SELECT SUM(amount) FROM expenses 
-            WHERE user_id = ? AND date(created_at) = date('now')
+            WHERE user_id = ?
+            AND created_at >= date('now') AND created_at < date('now', '+1 day')
         ''', (user_id,))
         result = self.cursor.fetchone()
         return result[0] if result[0] else 0
@@ -136,11 +413,56 @@ class Database:
         ''', (user_id, limit))
         return self.cursor.fetchall()
 
+    def get_daily_totals(self, user_id, since=''):
+        """Дневные итоги пользователя с дня since: (день, category_id, сумма, число расходов)
+
+        По возрастанию дня, включая удалённые категории — для аналитики.
+        """
+        self.cursor.execute('''
+            SELECT day, category_id, total, count
+            FROM expense_daily
+            WHERE user_id = ? AND day >= ?
+            ORDER BY day
+        ''', (user_id, since))
+        return self.cursor.fetchall()
+
+    def get_expenses_page(self, user_id, after=None, limit=1000):
+        """Страница всех расходов пользователя в хронологическом порядке
+
+        after — (created_at, id) последней строки предыдущей страницы.
+        Каждая страница — отдельный короткий запрос, без долгих блокировок.
+        """
+        created_at, expense_id = after or ('', 0)
+        self.cursor.execute('''
+            SELECT e.id, e.created_at, uc.name, uc.emoji, e.amount
+            FROM expenses e
+            LEFT JOIN user_categories uc ON e.category_id = uc.id
+            WHERE e.user_id = ? AND (e.created_at, e.id) > (?, ?)
+            ORDER BY e.created_at, e.id
+            LIMIT ?
+        ''', (user_id, created_at, expense_id, limit))
+        return self.cursor.fetchall()
+
+    def iter_expenses(self, user_id, chunk_size=1000):
+        """Генератор всех расходов пользователя пачками по chunk_size"""
+        after = None
+        while True:
+            rows = self.get_expenses_page(user_id, after, chunk_size)
+            if not rows:
+                return
+            yield rows
+            after = (rows[-1][1], rows[-1][0])
+
     def close(self):
-        self.conn.close()
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
 
     def clear_user_statistics(self, user_id):
         """Полностью очищает статистику пользователя"""
+        self.cursor.execute("DELETE FROM expense_daily WHERE user_id = ?", (user_id,))
         self.cursor.execute("DELETE FROM expenses WHERE user_id = ?", (user_id,))
         self.conn.commit()
         return self.cursor.rowcount  
@@ -148,7 +470,567 @@ class Database:
     def clear_category_statistics(self, user_id, category_id):
         """Очищает статистику по конкретной категории"""
         self.cursor.execute(
+        "DELETE FROM expense_daily WHERE user_id = ? AND category_id = ?",
+        (user_id, category_id))
+        self.cursor.execute(
         "DELETE FROM expenses WHERE user_id = ? AND category_id = ?",
         (user_id, category_id))
         self.conn.commit()
-        return self.cursor.rowcount
\ No newline at end of file
+        return self.cursor.rowcount
+
+    # --- Бюджеты ---
+    def set_budget(self, user_id, category_id, amount):
+        """Месячный бюджет категории (0 — на все расходы); amount=None снимает его"""
+        if amount is None:
+            self.cursor.execute(
+                'DELETE FROM budgets WHERE user_id = ? AND category_id = ?', (user_id, category_id)
+            )
+        else:
+            self.cursor.execute('''
+                INSERT INTO budgets (user_id, category_id, amount) VALUES (?, ?, ?)
+                ON CONFLICT (user_id, category_id) DO UPDATE SET amount = excluded.amount
+            ''', (user_id, category_id, amount))
+        self.conn.commit()
+
+    def get_budgets(self, user_id):
+        """Бюджеты пользователя: {category_id: сумма}, 0 — на все расходы"""
+        self.cursor.execute('SELECT category_id, amount FROM budgets WHERE user_id = ?', (user_id,))
+        return dict(self.cursor.fetchall())
+
+    def get_month_totals(self, user_id, month_start):
+        """Траты с дня month_start по неудалённым категориям: [(category_id, сумма)]"""
+        self.cursor.execute('''
+            SELECT d.category_id, SUM(d.total)
+            FROM expense_daily d
+            JOIN user_categories uc ON uc.id = d.category_id
+            WHERE d.user_id = ? AND d.day >= ? AND uc.is_deleted = 0
+            GROUP BY d.category_id
+        ''', (user_id, month_start))
+        return self.cursor.fetchall()
+
+    # --- Дайджесты ---
+    def get_digest_page(self, after, limit, previous_start, start, end):
+        """Траты по категориям для следующих limit пользователей после after.
+
+        Два запроса на страницу, сколько бы в ней ни было пользователей:
+        граница страницы по user_categories и итоги всех её пользователей
+        за [previous_start, end) из дневных итогов. Возвращает (последний
+        user_id страницы или None, если пользователей больше нет,
+        [(user_id, название, эмодзи, сумма с start, число расходов с start,
+        сумма до start)]) по возрастанию user_id.
+        """
+        # GROUP BY (user_id, name), а не uc.id: группы те же (UNIQUE(user_id, name)),
+        # но идут в порядке индекса — без сортировки и без обхода всей таблицы
+        self.cursor.execute('''
+            SELECT MAX(user_id) FROM (
+                SELECT DISTINCT user_id FROM user_categories
+                WHERE user_id > ?
+                ORDER BY user_id
+                LIMIT ?
+            )
+        ''', (after, limit))
+        last = self.cursor.fetchone()[0]
+        if last is None:
+            return None, []
+
+        self.cursor.execute('''
+            SELECT uc.user_id, uc.name, uc.emoji,
+                   SUM(CASE WHEN d.day >= ? THEN d.total ELSE 0 END),
+                   SUM(CASE WHEN d.day >= ? THEN d.count ELSE 0 END),
+                   SUM(CASE WHEN d.day < ? THEN d.total ELSE 0 END)
+            FROM user_categories uc
+            JOIN expense_daily d ON d.user_id = uc.user_id AND d.category_id = uc.id
+            WHERE uc.user_id > ? AND uc.user_id <= ? AND uc.is_deleted = 0
+            AND d.day >= ? AND d.day < ?
+            GROUP BY uc.user_id, uc.name
+        ''', (start, start, start, after, last, previous_start, end))
+        return last, self.cursor.fetchall()
+
+    def get_digest_run(self, kind, period):
+        """Прогресс рассылки: (last_user_id, sent, failed, finished_at) или None"""
+        self.cursor.execute('''
+            SELECT last_user_id, sent, failed, finished_at FROM digest_runs
+            WHERE kind = ? AND period = ?
+        ''', (kind, period))
+        return self.cursor.fetchone()
+
+    def save_digest_run(self, kind, period, last_user_id, sent, failed, finished=False):
+        self.cursor.execute('''
+            INSERT INTO digest_runs (kind, period, last_user_id, sent, failed, finished_at)
+            VALUES (?, ?, ?, ?, ?, CASE WHEN ? THEN CURRENT_TIMESTAMP END)
+            ON CONFLICT (kind, period) DO UPDATE
+            SET last_user_id = excluded.last_user_id, sent = excluded.sent,
+                failed = excluded.failed, finished_at = excluded.finished_at
+        ''', (kind, period, last_user_id, sent, failed, finished))
+        self.conn.commit()
+
+    # --- Обслуживание ---
+    def find_dead_categories(self, retention_days):
+        """Категории, удалённые больше retention_days дней назад: [(user_id, category_id)]"""
+        self.cursor.execute('''
+            SELECT user_id, id FROM user_categories
+            WHERE is_deleted = 1 AND deleted_at < datetime('now', ?)
+        ''', (f'-{retention_days} days',))
+        return self.cursor.fetchall()
+
+    def find_orphan_categories(self, after_id, scan_rows):
+        """Категории расходов с id из (after_id, after_id + scan_rows], которых уже нет.
+
+        Такие расходы остались от прежнего INSERT OR REPLACE в add_category
+        (миграция 7 привязала уже существовавшие) или от правки базы руками.
+        Возвращает (последний просмотренный id или None, если расходов
+        дальше нет, [(user_id, category_id)]).
+        """
+        self.cursor.execute('SELECT MAX(id) FROM expenses')
+        last_id = self.cursor.fetchone()[0]
+        if last_id is None or after_id >= last_id:
+            return None, []
+        end = min(after_id + scan_rows, last_id)
+        # NOT INDEXED: нужен короткий диапазон по rowid, а не обход индекса ради DISTINCT
+        self.cursor.execute('''
+            SELECT DISTINCT e.user_id, e.category_id
+            FROM expenses e NOT INDEXED
+            WHERE e.id > ? AND e.id <= ?
+            AND NOT EXISTS (SELECT 1 FROM user_categories uc WHERE uc.id = e.category_id)
+        ''', (after_id, end))
+        return end, self.cursor.fetchall()
+
+    def adopt_orphan_categories(self, pairs):
+        """Привязывает расходы пропавших категорий к удалённой категории с тем же id
+
+        Срок хранения такой категории отсчитывается с этого момента, как
+        у удалённых пользователем. Возвращает, сколько категорий восстановлено.
+        """
+        self.cursor.executemany('''
+            INSERT OR IGNORE INTO user_categories (id, user_id, name, emoji, is_deleted, deleted_at)
+            VALUES (?, ?, 'Удалённая #' || ?, '🗑', 1, CURRENT_TIMESTAMP)
+        ''', [(category_id, user_id, category_id) for user_id, category_id in pairs])
+        adopted = self.cursor.rowcount
+        self.conn.commit()
+        return adopted
+
+    def purge_category(self, user_id, category_id, retention_days, limit=100):
+        """Удаляет до limit расходов категории, удалённой больше retention_days дней назад.
+
+        Когда расходов не осталось, в той же транзакции удаляются её дневные
+        итоги, бюджет и сама строка категории. Категорию живую, восстановленную
+        или удалённую недавно (после find_dead_categories) не трогает.
+        Возвращает (удалено расходов, категория вычищена полностью).
+        """
+        self.cursor.execute('BEGIN IMMEDIATE')
+        try:
+            self.cursor.execute('''
+                SELECT 1 FROM user_categories
+                WHERE id = ? AND user_id = ? AND is_deleted = 1 AND deleted_at < datetime('now', ?)
+            ''', (category_id, user_id, f'-{retention_days} days'))
+            if self.cursor.fetchone() is None:
+                self.conn.rollback()
+                return 0, True
+            self.cursor.execute('''
+                DELETE FROM expenses WHERE id IN (
+                    SELECT id FROM expenses WHERE user_id = ? AND category_id = ? LIMIT ?
+                )
+            ''', (user_id, category_id, limit))
+            deleted = self.cursor.rowcount
+            done = deleted < limit
+            if done:
+                params = (user_id, category_id)
+                self.cursor.execute('DELETE FROM expense_daily WHERE user_id = ? AND category_id = ?', params)
+                self.cursor.execute('DELETE FROM budgets WHERE user_id = ? AND category_id = ?', params)
+                self.cursor.execute(
+                    'DELETE FROM user_categories WHERE user_id = ? AND id = ? AND is_deleted = 1', params
+                )
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+        return deleted, done
+
+    def page_stats(self):
+        """(страниц в файле, из них свободных, размер страницы, режим auto_vacuum: 0, 1 или 2)"""
+        return tuple(
+            self.conn.execute(f'PRAGMA {name}').fetchone()[0]
+            for name in ('page_count', 'freelist_count', 'page_size', 'auto_vacuum')
+        )
+
+    def incremental_vacuum(self, pages):
+        """Возвращает файлу до pages свободных страниц; сколько вернул"""
+        before = self.conn.execute('PRAGMA freelist_count').fetchone()[0]
+        # execute() делает только один шаг прагмы (одну страницу), executescript — все
+        self.conn.executescript(f'PRAGMA incremental_vacuum({int(pages)})')
+        return before - self.conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+    def checkpoint(self):
+        """Переносит WAL в файл базы, не дожидаясь читателей и не мешая записи"""
+        return self.conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+
+    def analyze(self, analysis_limit=1000):
+        """Обновляет статистику планировщика по выборке из analysis_limit строк на индекс"""
+        self.conn.execute(f'PRAGMA analysis_limit = {int(analysis_limit)}')
+        try:
+            self.conn.execute('ANALYZE')
+            self.conn.commit()
+        finally:
+            self.conn.execute('PRAGMA analysis_limit = 0')
+
+    def vacuum(self):
+        """Полный VACUUM с переводом файла в auto_vacuum = INCREMENTAL.
+
+        Переписывает весь файл и держит блокировку записи всё это время —
+        только для остановленного бота (manage.py vacuum).
+        """
+        self.conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        self.conn.execute('VACUUM')
+
+    # --- Дневные итоги ---
+    def rebuild_rollups(self):
+        """Пересчитывает дневные итоги по всем расходам"""
+        self.cursor.execute("DELETE FROM expense_daily")
+        self._update_rollups(0)
+        self.conn.commit()
+
+    def check_rollups(self):
+        """Сверяет дневные итоги с расходами, возвращает расхождения
+
+        Каждое расхождение — (user_id, день, category_id, сумма в итогах,
+        сумма по расходам); None означает, что строки нет.
+        """
+        self.cursor.execute('''
+            SELECT r.user_id, r.day, r.category_id, d.total, r.total
+            FROM (
+                SELECT user_id, date(created_at) AS day, category_id,
+                       SUM(amount) AS total, COUNT(*) AS count
+                FROM expenses
+                GROUP BY user_id, date(created_at), category_id
+            ) r
+            LEFT JOIN expense_daily d
+            ON d.user_id = r.user_id AND d.day = r.day AND d.category_id = r.category_id
+            WHERE d.count IS NULL OR d.count != r.count OR abs(d.total - r.total) > 1e-6
+            UNION ALL
+            SELECT d.user_id, d.day, d.category_id, d.total, NULL
+            FROM expense_daily d
+            WHERE NOT EXISTS (
+                SELECT 1 FROM expenses e
+                WHERE e.user_id = d.user_id AND e.category_id = d.category_id
+                AND e.created_at >= d.day AND e.created_at < date(d.day, '+1 day')
+            )
+        ''')
+        return self.cursor.fetchall()
+
+
+def _timed(func, *args):
+    # Время меряется в потоке базы, а в гистограмму пишется уже в цикле событий
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+class AsyncDatabase:
+    """Асинхронная обёртка над Database.
+
+    Запись идёт в одном отдельном потоке, по очереди; чтения — в пуле
+    из readers потоков со своими соединениями (в режиме WAL они не ждут
+    записи). Цикл событий бота на диске не блокируется.
+    Расходы пишутся группами: вставки от разных пользователей копятся
+    не дольше batch_interval секунд (или до batch_size штук) и фиксируются
+    одним commit. add_expense возвращает управление только после него.
+    Список категорий пользователя кэшируется и сбрасывается при изменениях.
+    data_version(user_id) меняется при каждом изменении расходов
+    пользователя — по ней кэши статистики понимают, что устарели.
+    Траты текущего месяца для бюджетов держатся в памяти и дополняются
+    каждой записанной пачкой расходов, без пересчёта месяца.
+    """
+
+    def __init__(self, db_name='finance.db', batch_interval=0.005, batch_size=500,
+                 category_cache_size=10000, category_cache_ttl=600,
+                 readers=0, profile=DEFAULT_PROFILE):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+        # Соединение создаём в том же потоке, где оно будет использоваться
+        self._db = self._executor.submit(Database, db_name, profile).result()
+        # Чтения идут в свой пул (у каждого потока своё соединение) и не ждут
+        # записи; без WAL читатели блокируются на время commit, так что смысла нет
+        if readers and profile.journal_mode == 'wal' and db_name != ':memory:':
+            self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-read')
+        else:
+            self._readers = self._executor
+        self._batch_interval = batch_interval
+        self._batch_size = batch_size
+        self._expense_queue = None
+        self._batch_full = None
+        self._flusher = None
+        self._closing = False
+        self.category_cache = LRUCache(category_cache_size, category_cache_ttl)
+        # Номера версий берём из общего счётчика, чтобы версия забытого
+        # пользователя никогда не совпала со старой
+        self._data_versions = LRUCache(category_cache_size)
+        self._version_counter = itertools.count(1)
+        # Растёт при каждом сбросе кэша категорий: чтение, начатое до сброса,
+        # не должно положить в кэш уже устаревший список
+        self._category_epoch = 0
+        # Траты текущего месяца {user_id: MonthTotals} и бюджеты {user_id: {category_id: сумма}}
+        self.month_totals = LRUCache(category_cache_size)
+        self.budget_cache = LRUCache(category_cache_size)
+        self._budget_epoch = 0
+
+    def data_version(self, user_id):
+        """Текущая версия данных пользователя"""
+        version = self._data_versions.get(user_id)
+        if version is None:
+            version = self._bump_version(user_id)
+        return version
+
+    def _bump_version(self, user_id):
+        version = next(self._version_counter)
+        self._data_versions.set(user_id, version)
+        return version
+
+    async def _run(self, func, *args, executor=None):
+        loop = asyncio.get_running_loop()
+        result, elapsed = await loop.run_in_executor(
+            executor or self._executor, partial(_timed, func, *args)
+        )
+        QUERY_SECONDS.observe(elapsed, func.__name__)
+        return result
+
+    async def _read(self, func, *args):
+        return await self._run(func, *args, executor=self._readers)
+
+    def _invalidate_categories(self, user_id):
+        self._category_epoch += 1
+        self.category_cache.invalidate(user_id)
+
+    # --- Методы для категорий ---
+    async def init_user_categories(self, user_id):
+        result = await self._run(self._db.init_user_categories, user_id)
+        self._invalidate_categories(user_id)
+        return result
+
+    async def get_user_categories(self, user_id, include_deleted=False):
+        if include_deleted:
+            return await self._read(self._db.get_user_categories, user_id, True)
+
+        categories = self.category_cache.get(user_id)
+        if categories is None:
+            epoch = self._category_epoch
+            categories = tuple(await self._read(self._db.get_user_categories, user_id))
+            if epoch == self._category_epoch:
+                self.category_cache.set(user_id, categories)
+        return categories
+
+    async def add_category(self, user_id, name, emoji='➕'):
+        result = await self._run(self._db.add_category, user_id, name, emoji)
+        self._invalidate_categories(user_id)
+        # Восстановленная категория возвращает в статистику свои расходы
+        self._bump_version(user_id)
+        self.month_totals.invalidate(user_id)
+        return result
+
+    async def delete_category(self, user_id, category_id):
+        result = await self._run(self._db.delete_category, user_id, category_id)
+        self._invalidate_categories(user_id)
+        self._bump_version(user_id)
+        self.month_totals.invalidate(user_id)
+        return result
+
+    # --- Методы для расходов ---
+    async def add_expense(self, user_id, category_id, amount):
+        """Ставит расход в очередь и ждёт, пока его пачка будет записана"""
+        if self._closing:
+            raise RuntimeError("База данных закрывается")
+        # NaN SQLite записал бы как NULL и уронил бы всю пачку
+        if not math.isfinite(amount):
+            raise ValueError(f"Сумма расхода должна быть конечным числом: {amount}")
+        if self._flusher is None:
+            self._expense_queue = asyncio.Queue()
+            self._batch_full = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_expenses())
+
+        future = asyncio.get_running_loop().create_future()
+        self._expense_queue.put_nowait((user_id, category_id, amount, future))
+        if self._expense_queue.qsize() >= self._batch_size:
+            self._batch_full.set()
+        await future
+
+    async def _flush_expenses(self):
+        """Фоновая задача: собирает расходы в пачки и пишет их в БД"""
+        queue = self._expense_queue
+        running = True
+        while running:
+            batch = [await queue.get()]
+            if batch[0] is not None:
+                # Даём другим пользователям время присоединиться к пачке
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self._batch_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._batch_full.clear()
+            while len(batch) < self._batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            # None в очереди — сигнал остановки от close()
+            if None in batch:
+                running = False
+                batch.remove(None)
+            if batch:
+                await self._write_expenses(batch)
+
+    async def _write_expenses(self, batch):
+        rows = [(user_id, category_id, amount) for user_id, category_id, amount, _ in batch]
+        try:
+            await self._run(self._db.add_expenses, rows)
+        except Exception as e:
+            if len(batch) > 1:
+                # Пачка откатилась целиком; пишем расходы по одному,
+                # чтобы ошибку получил только владелец плохой строки
+                for item in batch:
+                    await self._write_expenses([item])
+                return
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            # Итоги месяца, уже загруженные в память, дополняем за O(1);
+            # незагруженные прочитаются из базы вместе с этой пачкой
+            month = current_month()
+            for user_id, category_id, amount, _ in batch:
+                totals = self.month_totals.peek(user_id)
+                if totals is None:
+                    continue
+                if totals.month == month:
+                    totals.add(category_id, amount)
+                else:
+                    self.month_totals.invalidate(user_id)
+            for user_id in {user_id for user_id, *_ in batch}:
+                self._bump_version(user_id)
+            for *_, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+    async def import_expenses(self, user_id, rows):
+        result = await self._run(self._db.import_expenses, user_id, rows)
+        self._bump_version(user_id)
+        self.month_totals.invalidate(user_id)
+        return result
+
+    async def get_category_stats(self, user_id, days=30):
+        return await self._read(self._db.get_category_stats, user_id, days)
+
+    async def get_today_expenses(self, user_id):
+        return await self._read(self._db.get_today_expenses, user_id)
+
+    async def get_recent_expenses(self, user_id, limit=10):
+        return await self._read(self._db.get_recent_expenses, user_id, limit)
+
+    async def get_daily_totals(self, user_id, since=''):
+        return await self._read(self._db.get_daily_totals, user_id, since)
+
+    async def iter_expenses(self, user_id, chunk_size=1000):
+        """Асинхронный генератор расходов пачками; между пачками БД свободна"""
+        after = None
+        while True:
+            rows = await self._read(self._db.get_expenses_page, user_id, after, chunk_size)
+            if not rows:
+                return
+            yield rows
+            after = (rows[-1][1], rows[-1][0])
+
+    async def clear_user_statistics(self, user_id):
+        result = await self._run(self._db.clear_user_statistics, user_id)
+        self._bump_version(user_id)
+        self.month_totals.invalidate(user_id)
+        return result
+
+    async def clear_category_statistics(self, user_id, category_id):
+        result = await self._run(self._db.clear_category_statistics, user_id, category_id)
+        self._bump_version(user_id)
+        self.month_totals.invalidate(user_id)
+        return result
+
+    # --- Бюджеты ---
+    async def set_budget(self, user_id, category_id, amount):
+        await self._run(self._db.set_budget, user_id, category_id, amount)
+        self._budget_epoch += 1
+        self.budget_cache.invalidate(user_id)
+
+    async def get_budgets(self, user_id):
+        budgets = self.budget_cache.get(user_id)
+        if budgets is None:
+            epoch = self._budget_epoch
+            budgets = await self._read(self._db.get_budgets, user_id)
+            if epoch == self._budget_epoch:
+                self.budget_cache.set(user_id, budgets)
+        return budgets
+
+    async def get_month_totals(self, user_id):
+        """Траты пользователя в текущем месяце (UTC) — MonthTotals.
+
+        Из дневных итогов читаются один раз, дальше add_expense дополняет
+        их в памяти; очистка, импорт и изменения категорий сбрасывают их.
+        """
+        month = current_month()
+        totals = self.month_totals.get(user_id)
+        if totals is not None and totals.month == month:
+            return totals
+
+        version = self.data_version(user_id)
+        # Чтение идёт в потоке записи, строго по очереди с пачками расходов:
+        # пачка, записанная раньше, уже в прочитанных итогах и сменила версию,
+        # а записанная позже будет добавлена к ним в _write_expenses
+        rows = await self._run(self._db.get_month_totals, user_id, f'{month}-01')
+        totals = MonthTotals(month, rows)
+        if self.data_version(user_id) == version:
+            self.month_totals.set(user_id, totals)
+        return totals
+
+    # --- Дайджесты ---
+    async def get_digest_page(self, after, limit, previous_start, start, end):
+        return await self._read(self._db.get_digest_page, after, limit, previous_start, start, end)
+
+    async def get_digest_run(self, kind, period):
+        return await self._read(self._db.get_digest_run, kind, period)
+
+    async def save_digest_run(self, kind, period, last_user_id, sent, failed, finished=False):
+        await self._run(self._db.save_digest_run, kind, period, last_user_id, sent, failed, finished)
+
+    # --- Обслуживание ---
+    async def find_dead_categories(self, retention_days):
+        return await self._read(self._db.find_dead_categories, retention_days)
+
+    async def find_orphan_categories(self, after_id, scan_rows):
+        return await self._read(self._db.find_orphan_categories, after_id, scan_rows)
+
+    async def adopt_orphan_categories(self, pairs):
+        return await self._run(self._db.adopt_orphan_categories, pairs)
+
+    async def purge_category(self, user_id, category_id, retention_days, limit=100):
+        result = await self._run(self._db.purge_category, user_id, category_id, retention_days, limit)
+        # Статистика этих расходов не показывает, но выгрузка их видит
+        self._bump_version(user_id)
+        if result[1]:
+            self._budget_epoch += 1
+            self.budget_cache.invalidate(user_id)
+        return result
+
+    async def page_stats(self):
+        return await self._read(self._db.page_stats)
+
+    async def incremental_vacuum(self, pages):
+        return await self._run(self._db.incremental_vacuum, pages)
+
+    async def checkpoint(self):
+        # В потоке чтения: иначе перенос WAL ляжет на запись, как автоматический checkpoint
+        return await self._read(self._db.checkpoint)
+
+    async def analyze(self, analysis_limit=1000):
+        await self._run(self._db.analyze, analysis_limit)
+
+    async def close(self):
+        """Дописывает накопленные расходы и закрывает соединение"""
+        self._closing = True
+        if self._flusher is not None:
+            self._expense_queue.put_nowait(None)
+            await self._flusher
+        if self._readers is not self._executor:
+            self._readers.shutdown(wait=True)
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,295 @@
+"""Дайджесты: дневная и недельная сводка расходов всем активным пользователям.
+
+Сводки считаются страницами: на страницу из page_size пользователей —
+два запроса по индексам (Database.get_digest_page), а не запрос на
+каждого. Отправка идёт через общее ведро токенов: Telegram пускает
+около 30 сообщений в секунду на бота, а на ответ 429 вся рассылка
+замолкает на retry_after секунд. Прогресс — пользователь, до которого
+включительно всё отправлено, — раз в секунду сохраняется в базе, и после
+падения рассылка продолжается с него; повторно могут уйти только
+сообщения, отправленные после последнего сохранения.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+from metrics import Counter
+from throttling import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+DIGEST_MESSAGES = Counter('finance_digest_messages_total', 'Сообщений дайджеста', ('kind', 'result'))
+DIGEST_RETRY_AFTER = Counter('finance_digest_retry_after_total', 'Ответов 429 при рассылке дайджестов')
+
+# Длина периода в днях
+PERIODS = {'day': 1, 'week': 7}
+TITLES = {'day': 'день', 'week': 'неделю'}
+PREVIOUS = {'day': 'к предыдущему дню', 'week': 'к прошлой неделе'}
+TOP_CATEGORIES = 3
+
+
+# ========== ПЕРИОДЫ ==========
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def latest_period(kind, now, hour):
+    """Первый день последнего периода, сводка за который уже должна уйти.
+
+    Сводка уходит в hour часов (UTC) на следующий день после периода:
+    дневная — за вчера, недельная — по понедельникам за прошлую неделю.
+    """
+    end = now.date()
+    if kind == 'week':
+        end -= timedelta(days=end.weekday())
+    if now < datetime.combine(end, datetime.min.time()) + timedelta(hours=hour):
+        end -= timedelta(days=PERIODS[kind])
+    return end - timedelta(days=PERIODS[kind])
+
+
+def next_due(kind, now, hour):
+    """Когда уходит следующая сводка после now"""
+    start = latest_period(kind, now, hour) + timedelta(days=2 * PERIODS[kind])
+    return datetime.combine(start, datetime.min.time()) + timedelta(hours=hour)
+
+
+def period_bounds(kind, start):
+    """(начало предыдущего периода, начало, конец) в виде 'YYYY-MM-DD', конец не включается"""
+    length = timedelta(days=PERIODS[kind])
+    return str(start - length), str(start), str(start + length)
+
+
+# ========== ТЕКСТ ==========
+def format_digest(kind, start, categories):
+    """Сводка за период; categories — [(название с эмодзи, сумма, число, сумма до)]"""
+    total = sum(spent for _, spent, _, _ in categories)
+    count = sum(number for _, _, number, _ in categories)
+    previous = sum(before for _, _, _, before in categories)
+    if kind == 'day':
+        title = start.strftime('%d.%m')
+    else:
+        title = f"{start:%d.%m}–{start + timedelta(days=6):%d.%m}"
+
+    lines = [f"📬 Расходы за {TITLES[kind]} {title}", f"Потрачено: {total:.2f} руб., расходов: {count}"]
+    if previous > 0:
+        lines.append(f"{PREVIOUS[kind].capitalize()}: {(total - previous) / previous:+.0%} (было {previous:.2f})")
+    top = sorted((c for c in categories if c[1] > 0), key=lambda c: c[1], reverse=True)[:TOP_CATEGORIES]
+    lines.append("")
+    lines.extend(f"{name}: {spent:.2f} руб." for name, spent, _, _ in top)
+    return "\n".join(lines)
+
+
+def build_digests(kind, start, rows):
+    """Строки get_digest_page → [(user_id, текст)]; кто ничего не потратил, не получает сводку"""
+    by_user = {}
+    for user_id, name, emoji, spent, count, before in rows:
+        by_user.setdefault(user_id, []).append((f"{emoji} {name}", spent, count, before))
+    return [
+        (user_id, format_digest(kind, start, categories))
+        for user_id, categories in by_user.items()
+        if any(spent > 0 for _, spent, _, _ in categories)
+    ]
+
+
+# ========== ОТПРАВКА ==========
+class SendLimiter:
+    """Общий лимит отправки: rate сообщений в секунду, не больше burst подряд.
+
+    pause() останавливает всех отправителей (ответ 429 относится к боту
+    целиком), после паузы ведро наполняется с нуля, без залпа.
+    """
+
+    def __init__(self, rate=25.0, burst=5):
+        self.rate = rate
+        self.burst = burst
+        self._bucket = TokenBucket(burst)
+        self._resume_at = 0.0
+
+    async def acquire(self):
+        while True:
+            wait = self._resume_at - time.monotonic()
+            if wait <= 0:
+                if self._bucket.take(self.rate, self.burst):
+                    return
+                wait = (1 - self._bucket.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+        self._bucket.tokens = 0.0
+        self._bucket.updated_at = self._resume_at
+
+
+class DigestSender:
+    """Отправка одного сообщения с повторами: 429 — пауза, сеть и 5xx — повтор с задержкой"""
+
+    def __init__(self, bot, limiter, attempts=5, backoff=1.0):
+        self.bot = bot
+        self.limiter = limiter
+        self.attempts = attempts
+        self.backoff = backoff
+
+    async def send(self, chat_id, text):
+        """True, если сообщение доставлено"""
+        for attempt in range(1, self.attempts + 1):
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id, text)
+                return True
+            except TelegramRetryAfter as e:
+                DIGEST_RETRY_AFTER.inc()
+                logger.warning(f"Telegram просит подождать {e.retry_after} с, рассылка на паузе")
+                self.limiter.pause(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                logger.warning(f"Дайджест для {chat_id} не ушёл (попытка {attempt}): {e}")
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            except TelegramAPIError as e:
+                # Бот заблокирован, чат не найден — повтор не поможет
+                logger.info(f"Дайджест для {chat_id} не доставлен: {e}")
+                return False
+        return False
+
+
+class Progress:
+    """Сколько отправлено и до какого пользователя рассылка прошла без пропусков.
+
+    Сообщения уходят параллельно и завершаются не по порядку, поэтому
+    last_user_id сдвигается только за непрерывный готовый префикс.
+    Готовые сообщения за префиксом при падении уйдут повторно, так что
+    окно (начатые, но ещё не вошедшие в префикс) ограничивает run_digest.
+    """
+
+    def __init__(self, last_user_id=0, sent=0, failed=0):
+        self.last_user_id = last_user_id
+        self.sent = sent
+        self.failed = failed
+        self._inflight = deque()  # [user_id, готово] в порядке запуска
+
+    def start(self, user_id):
+        entry = [user_id, False]
+        self._inflight.append(entry)
+        return entry
+
+    def finish(self, entry, delivered):
+        """Возвращает, сколько записей вышло из окна"""
+        entry[1] = True
+        if delivered:
+            self.sent += 1
+        else:
+            self.failed += 1
+        released = 0
+        while self._inflight and self._inflight[0][1]:
+            self.last_user_id = self._inflight.popleft()[0]
+            released += 1
+        return released
+
+    def skip_to(self, user_id):
+        """Всё до user_id обработано (у остальных пользователей страницы нет трат)"""
+        if not self._inflight:
+            self.last_user_id = max(self.last_user_id, user_id)
+
+    def snapshot(self):
+        return self.last_user_id, self.sent, self.failed
+
+
+async def run_digest(db, sender, kind, start, page_size=1000, concurrency=8, checkpoint_interval=1.0):
+    """Рассылает сводку kind за период с дня start; продолжает прерванную.
+
+    Возвращает Progress или None, если рассылка за этот период уже закончена.
+    """
+    period = str(start)
+    saved = await db.get_digest_run(kind, period)
+    if saved is not None and saved[3] is not None:
+        return None
+    progress = Progress(*saved[:3]) if saved is not None else Progress()
+    if saved is not None:
+        logger.info(f"Продолжаем дайджест {kind} {period} после пользователя {progress.last_user_id}")
+
+    previous_start, period_start, end = period_bounds(kind, start)
+    # Слот занят, пока запись не вошла в готовый префикс, а не только пока идёт
+    # отправка: пока одно сообщение ждёт повтора, за ним успевает уйти не больше
+    # concurrency сообщений, которые при падении отправятся ещё раз
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    async def deliver(user_id, text, entry):
+        try:
+            delivered = await sender.send(user_id, text)
+        except BaseException:
+            # Рассылка прерывается: цикл не должен навсегда встать в ожидании слота
+            slots.release()
+            raise
+        for _ in range(progress.finish(entry, delivered)):
+            slots.release()
+        DIGEST_MESSAGES.inc(kind, 'sent' if delivered else 'failed')
+
+    async def checkpoint():
+        saved = None
+        while True:
+            await asyncio.sleep(checkpoint_interval)
+            if progress.snapshot() != saved:
+                saved = progress.snapshot()
+                await db.save_digest_run(kind, period, *saved)
+
+    checkpointer = asyncio.create_task(checkpoint())
+    finished = False
+    try:
+        after = progress.last_user_id
+        while True:
+            last, rows = await db.get_digest_page(after, page_size, previous_start, period_start, end)
+            if last is None:
+                break
+            for user_id, text in build_digests(kind, start, rows):
+                await slots.acquire()
+                task = asyncio.create_task(deliver(user_id, text, progress.start(user_id)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+            progress.skip_to(last)
+            after = last
+        finished = True
+    finally:
+        checkpointer.cancel()
+        for task in tasks:
+            task.cancel()
+        # Неотправленные сообщения в полёте не попали в last_user_id и уйдут при продолжении
+        await db.save_digest_run(kind, period, *progress.snapshot(), finished=finished)
+    logger.info(f"Дайджест {kind} {period}: отправлено {progress.sent}, не доставлено {progress.failed}")
+    return progress
+
+
+class DigestScheduler:
+    """Фоновая задача бота: в срок рассылает сводки kinds, после перезапуска — догоняет.
+
+    Рассылается только последний наступивший период каждого вида:
+    если бот лежал несколько дней, за пропущенные дни сводки не уходят.
+    """
+
+    def __init__(self, db, sender, kinds=('day', 'week'), hour=6, page_size=1000, concurrency=8):
+        self.db = db
+        self.sender = sender
+        self.kinds = [kind for kind in kinds if kind in PERIODS]
+        self.hour = hour
+        self.page_size = page_size
+        self.concurrency = concurrency
+
+    async def run(self):
+        while self.kinds:
+            failed = False
+            for kind in self.kinds:
+                try:
+                    await run_digest(
+                        self.db, self.sender, kind, latest_period(kind, utc_now(), self.hour),
+                        page_size=self.page_size, concurrency=self.concurrency
+                    )
+                except Exception:
+                    logger.exception(f"Рассылка дайджеста {kind} не удалась, повтор через минуту")
+                    failed = True
+            now = utc_now()
+            delay = min(next_due(kind, now, self.hour) for kind in self.kinds) - now
+            await asyncio.sleep(min(delay.total_seconds(), 60) if failed else delay.total_seconds())
@@ -0,0 +1,143 @@
+import asyncio
+import csv
+import io
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape
+
+from aiogram.types import InputFile
+
+HEADER = ('Дата', 'Категория', 'Эмодзи', 'Сумма')
+
+# Пока выгрузка меньше этого размера, она живёт в памяти, дальше — на диске
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+class CsvExport:
+    """CSV-выгрузка во временный файл (UTF-8 с BOM, чтобы Excel понял кириллицу)"""
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        self._text = io.TextIOWrapper(self.file, encoding='utf-8-sig', newline='')
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(HEADER)
+
+    def write_rows(self, rows):
+        self._writer.writerows(rows)
+
+    def finish(self):
+        self._text.flush()
+        self._text.detach()
+        self.file.seek(0)
+        return self.file
+
+
+class XlsxExport:
+    """Минимальный XLSX, лист пишется потоково прямо в zip-архив"""
+
+    _CONTENT_TYPES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    )
+    _RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    )
+    _WORKBOOK = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Расходы" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+    _WORKBOOK_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    )
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        self._zip = zipfile.ZipFile(self.file, 'w', compression=zipfile.ZIP_DEFLATED)
+        self._zip.writestr('[Content_Types].xml', self._CONTENT_TYPES)
+        self._zip.writestr('_rels/.rels', self._RELS)
+        self._zip.writestr('xl/workbook.xml', self._WORKBOOK)
+        self._zip.writestr('xl/_rels/workbook.xml.rels', self._WORKBOOK_RELS)
+        self._sheet = self._zip.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True)
+        self._sheet.write(
+            b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+            b'<sheetData>'
+        )
+        self.write_rows([HEADER])
+
+    @staticmethod
+    def _cell(value):
+        if isinstance(value, (int, float)):
+            return f'<c><v>{value}</v></c>'
+        return f'<c t="inlineStr"><is><t>{escape(str(value or ""))}</t></is></c>'
+
+    def write_rows(self, rows):
+        self._sheet.write(''.join(
+            '<row>' + ''.join(self._cell(value) for value in row) + '</row>'
+            for row in rows
+        ).encode())
+
+    def finish(self):
+        self._sheet.write(b'</sheetData></worksheet>')
+        self._sheet.close()
+        self._zip.close()
+        self.file.seek(0)
+        return self.file
+
+
+class SpooledInputFile(InputFile):
+    """Файл для отправки в Telegram, который читается кусками, а не целиком"""
+
+    def __init__(self, file, filename, chunk_size=64 * 1024):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.file = file
+
+    async def read(self, bot):
+        # Большой файл уже на диске: читаем в потоке, как и пишем, а не в цикле событий
+        await asyncio.to_thread(self.file.seek, 0)
+        while chunk := await asyncio.to_thread(self.file.read, self.chunk_size):
+            yield chunk
+
+
+async def export_expenses(db, user_id, chunk_size=1000):
+    """Выгружает все расходы пользователя в CSV и XLSX за один проход по БД
+
+    Возвращает (csv-файл, xlsx-файл, число строк). Строки читаются
+    пачками, запись в файлы идёт в отдельном потоке.
+    """
+    csv_export = CsvExport()
+    xlsx_export = XlsxExport()
+    count = 0
+    try:
+        async for rows in db.iter_expenses(user_id, chunk_size):
+            rows = [(created_at, name, emoji, amount) for _, created_at, name, emoji, amount in rows]
+            await asyncio.to_thread(csv_export.write_rows, rows)
+            await asyncio.to_thread(xlsx_export.write_rows, rows)
+            count += len(rows)
+        csv_file = await asyncio.to_thread(csv_export.finish)
+        xlsx_file = await asyncio.to_thread(xlsx_export.finish)
+    except BaseException:
+        csv_export.file.close()
+        xlsx_export.file.close()
+        raise
+    return csv_file, xlsx_file, count
@@ -0,0 +1,217 @@
+import asyncio
+import codecs
+import csv
+import math
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+
+# Названия колонок: наш экспорт, простой CSV и выписки банков
+DATE_COLUMNS = ('дата', 'date', 'дата операции')
+CATEGORY_COLUMNS = ('категория', 'category')
+EMOJI_COLUMNS = ('эмодзи', 'emoji')
+AMOUNT_COLUMNS = ('сумма', 'amount', 'сумма операции', 'сумма платежа')
+# В выписках банков расходы идут со знаком минус, поступления — с плюсом
+BANK_AMOUNT_COLUMNS = ('сумма операции', 'сумма платежа')
+
+# ISO-даты разбирает datetime.fromisoformat, остальные — по этим форматам
+DATE_FORMATS = (
+    '%d.%m.%Y %H:%M:%S',
+    '%d.%m.%Y %H:%M',
+    '%d.%m.%Y',
+)
+
+DEFAULT_CATEGORY = 'Прочее'
+MAX_CATEGORY_NAME = 20
+
+
+class ImportResult:
+    """Итог импорта: сколько строк добавлено, сколько отброшено и почему"""
+
+    def __init__(self):
+        self.imported = 0
+        self.skipped = 0      # поступления в банковской выписке
+        self.rejected = 0
+        self.errors = []      # первые ошибки: (номер строки, причина)
+        self.new_categories = []
+        self.seconds = 0.0
+
+    @property
+    def rows_per_sec(self):
+        return self.imported / self.seconds if self.seconds else 0.0
+
+
+class ImportFormatError(ValueError):
+    """Файл не похож на таблицу расходов"""
+
+
+def _find_column(header, names):
+    for name in names:
+        if name in header:
+            return header.index(name)
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(value):
+    value = value.strip()
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    else:
+        # Дата с часовым поясом переводится в UTC, как и остальные created_at
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(timezone.utc)
+        return moment.strftime('%Y-%m-%d %H:%M:%S')
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ValueError(f"непонятная дата «{value}»")
+
+
+def _parse_amount(value):
+    value = value.strip().replace('\xa0', '').replace(' ', '').replace(',', '.')
+    try:
+        amount = float(value)
+    except ValueError:
+        raise ValueError(f"непонятная сумма «{value}»") from None
+    # float() принимает и nan/inf, а в базу такие суммы не запишутся
+    if not math.isfinite(amount):
+        raise ValueError(f"непонятная сумма «{value}»")
+    return amount
+
+
+def _decode_lines(file, encoding):
+    """Строки файла в кодировке encoding, с первой строки не в UTF-8 — в cp1251
+
+    Кодировка по началу файла угадывается не всегда: у выписки с английским
+    заголовком кириллица может появиться только через тысячи строк.
+    """
+    first = True
+    for line in file:
+        if encoding != 'cp1251':
+            try:
+                # utf-8-sig на каждой строке вчетверо медленнее — BOM снимаем сами
+                text = line.decode('utf-8')
+            except UnicodeDecodeError:
+                encoding = 'cp1251'
+            else:
+                yield text.lstrip('\ufeff') if first else text
+                first = False
+                continue
+        yield line.decode('cp1251', errors='replace')
+        first = False
+
+
+def open_text(file, sample_size=64 * 1024):
+    """Определяет кодировку (UTF-8 или cp1251) и разделитель CSV; возвращает строки файла"""
+    sample = file.read(sample_size)
+    file.seek(0)
+    try:
+        # final=False: кусок мог оборваться посреди многобайтного символа
+        text = codecs.getincrementaldecoder('utf-8-sig')().decode(sample, final=False)
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        text = sample.decode('cp1251', errors='replace')
+        encoding = 'cp1251'
+    try:
+        dialect = csv.Sniffer().sniff(text.split('\n', 1)[0], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    return _decode_lines(file, encoding), dialect
+
+
+def parse_chunks(file, chunk_size=10000, result=None):
+    """Потоково разбирает CSV, отдавая пачки (название, эмодзи, сумма, дата)
+
+    Плохие строки не прерывают импорт, а попадают в result.
+    """
+    result = result if result is not None else ImportResult()
+    lines, dialect = open_text(file)
+    reader = csv.reader(lines, dialect)
+
+    try:
+        header = [column.strip().lower() for column in next(reader, [])]
+    except csv.Error as e:
+        raise ImportFormatError(f"заголовок не разбирается: {e}") from None
+    date_col = _find_column(header, DATE_COLUMNS)
+    amount_col = _find_column(header, AMOUNT_COLUMNS)
+    category_col = _find_column(header, CATEGORY_COLUMNS)
+    emoji_col = _find_column(header, EMOJI_COLUMNS)
+    if date_col is None or amount_col is None:
+        raise ImportFormatError("нужны колонки с датой и суммой")
+    bank_statement = header[amount_col] in BANK_AMOUNT_COLUMNS
+    width = max(col for col in (date_col, amount_col, category_col, emoji_col) if col is not None) + 1
+
+    def reject(reason):
+        result.rejected += 1
+        if len(result.errors) < 10:
+            result.errors.append((reader.line_num, reason))
+
+    chunk = []
+    while True:
+        try:
+            for row in reader:
+                if not any(row):
+                    continue
+                try:
+                    if len(row) < width:
+                        raise ValueError("не хватает колонок")
+                    amount = _parse_amount(row[amount_col])
+                    if bank_statement:
+                        if amount >= 0:
+                            result.skipped += 1
+                            continue
+                        amount = -amount
+                    if amount <= 0:
+                        raise ValueError("сумма должна быть больше нуля")
+                    created_at = _parse_date(row[date_col])
+                except ValueError as e:
+                    reject(str(e))
+                    continue
+
+                name = row[category_col].strip() if category_col is not None else ''
+                emoji = row[emoji_col].strip()[:2] if emoji_col is not None else ''
+                chunk.append((name[:MAX_CATEGORY_NAME] or DEFAULT_CATEGORY, emoji or '➕', amount, created_at))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            break
+        except csv.Error as e:
+            # Слишком длинное поле и т. п. — ошибка одной строки, reader продолжает со следующей
+            reject(f"строка не разбирается: {e}")
+    if chunk:
+        yield chunk
+
+
+async def import_expenses(db, user_id, file, chunk_size=10000):
+    """Импортирует расходы из CSV-файла пачками по chunk_size строк
+
+    Отсутствующие категории создаются через add_category. Разбор идёт
+    в отдельном потоке, каждая пачка пишется одной транзакцией.
+    """
+    result = ImportResult()
+    started = time.perf_counter()
+
+    categories = {name: cat_id for cat_id, name, emoji in await db.get_user_categories(user_id)}
+    chunks = parse_chunks(file, chunk_size, result)
+    while True:
+        chunk = await asyncio.to_thread(next, chunks, None)
+        if chunk is None:
+            break
+
+        rows = []
+        for name, emoji, amount, created_at in chunk:
+            cat_id = categories.get(name)
+            if cat_id is None:
+                cat_id = await db.add_category(user_id, name, emoji)
+                categories[name] = cat_id
+                result.new_categories.append(f"{emoji} {name}")
+            rows.append((cat_id, amount, created_at))
+        result.imported += await db.import_expenses(user_id, rows)
+
+    result.seconds = time.perf_counter() - started
+    return result
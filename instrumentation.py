@@ -0,0 +1,60 @@
+import logging
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+HANDLER_SECONDS = Histogram('finance_handler_seconds', 'Время работы хендлера', ('handler',))
+HANDLER_ERRORS = Counter('finance_handler_errors_total', 'Исключения в хендлерах', ('handler',))
+TELEGRAM_SECONDS = Histogram('finance_telegram_request_seconds', 'Время запроса к Bot API', ('method',))
+TELEGRAM_ERRORS = Counter('finance_telegram_errors_total', 'Ошибки запросов к Bot API', ('method',))
+
+
+class HandlerTimer(BaseMiddleware):
+    """Внутренний middleware: время хендлеров и выборочный DEBUG-лог сообщений
+
+    Пишется в лог только каждое sample_rate-е сообщение, и только если
+    включён уровень DEBUG, — чтобы лог не стоил ввода-вывода на каждом апдейте.
+    """
+
+    def __init__(self, sample_rate=100):
+        self.sample_rate = max(1, sample_rate)
+        self._seen = 0
+
+    async def __call__(self, handler, event, data):
+        name = data['handler'].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_SECONDS.observe(elapsed, name)
+            self._seen += 1
+            if self._seen % self.sample_rate == 0 and logger.isEnabledFor(logging.DEBUG):
+                user = data.get('event_from_user')
+                logger.debug(
+                    f"{name}: пользователь {user.id if user else '-'}, "
+                    f"{elapsed * 1000:.1f} мс, текст {getattr(event, 'text', None)!r}"
+                )
+
+
+class TelegramTimer(BaseRequestMiddleware):
+    """Middleware сессии бота: время и ошибки запросов к Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            TELEGRAM_ERRORS.inc(name)
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started, name)
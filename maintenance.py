@@ -0,0 +1,137 @@
+"""Обслуживание базы: вычистка мёртвых данных, возврат места и статистика планировщика.
+
+Раз в сутки в тихий час:
+- расходы категорий, которых уже нет, привязываются к удалённой категории
+  с тем же id — и дальше хранятся, как у любой удалённой категории;
+- расходы, дневные итоги и бюджеты категорий, удалённых больше
+  retention_days дней назад, удаляются пачками по batch_size расходов;
+- свободные страницы возвращаются файлу шагами PRAGMA incremental_vacuum
+  по vacuum_pages страниц;
+- ANALYZE по выборке обновляет статистику планировщика.
+
+Поиск идёт в потоках чтения и никого не держит. Каждая запись — короткая
+транзакция в общем потоке записи с паузой после неё, так что расходы
+пользователей ждут не дольше одного шага. WAL после каждого шага
+переносится в файл из потока чтения, а не автоматическим checkpoint
+внутри commit.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+PURGED_EXPENSES = Counter('finance_maintenance_purged_expenses_total', 'Расходов удалённых категорий, удалённых насовсем')
+RECLAIMED_PAGES = Counter('finance_maintenance_reclaimed_pages_total', 'Страниц, возвращённых файлу базы')
+
+# auto_vacuum = INCREMENTAL в PRAGMA auto_vacuum
+INCREMENTAL = 2
+
+
+class MaintenanceReport:
+    """Итоги одного прохода обслуживания"""
+
+    __slots__ = ('dead_categories', 'orphan_categories', 'expenses', 'pages_before', 'pages_after',
+                 'free_before', 'free_after', 'reclaimed', 'page_size', 'incremental', 'steps', 'seconds')
+
+    def __init__(self):
+        self.dead_categories = 0
+        self.orphan_categories = 0
+        self.expenses = 0
+        self.pages_before = self.pages_after = self.page_size = 0
+        self.free_before = self.free_after = self.reclaimed = 0
+        self.incremental = False
+        self.steps = 0
+        self.seconds = 0.0
+
+    def summary(self):
+        text = (
+            f"удалённых категорий {self.dead_categories}, расходов {self.expenses}, "
+            f"привязано пропавших категорий {self.orphan_categories}; страниц {self.pages_before} → {self.pages_after}, "
+            f"свободных {self.free_before} → {self.free_after}, "
+            f"возвращено {self.reclaimed} ({self.reclaimed * self.page_size / 1024 / 1024:.1f} МБ)"
+        )
+        if not self.incremental and self.free_after:
+            text += " — остальное вернёт только `manage.py vacuum`"
+        return text + f"; шагов записи {self.steps}, {self.seconds:.1f} с"
+
+
+async def run_maintenance(db, retention_days=30, batch_size=100, scan_rows=50_000,
+                          vacuum_pages=64, analysis_limit=1000, pause=0.01):
+    """Один проход обслуживания AsyncDatabase; возвращает MaintenanceReport"""
+    started = time.perf_counter()
+    report = MaintenanceReport()
+    report.pages_before, report.free_before, report.page_size, auto_vacuum = await db.page_stats()
+    report.incremental = auto_vacuum == INCREMENTAL
+
+    async def step(method, *args):
+        result = await method(*args)
+        report.steps += 1
+        # Вычистка пишет в WAL тысячи страниц; без этого их переносил бы
+        # автоматический checkpoint прямо в commit — и пачки расходов ждали бы его
+        await db.checkpoint()
+        # Пауза пропускает вперёд записи пользователей, вставшие в очередь за шагом
+        await asyncio.sleep(pause)
+        return result
+
+    orphans = set()
+    after = 0
+    while True:
+        after, found = await db.find_orphan_categories(after, scan_rows)
+        if after is None:
+            break
+        orphans.update(found)
+    # Сразу не удаляем: срок хранения начинается с того, как пропажа замечена
+    if orphans:
+        report.orphan_categories = await step(db.adopt_orphan_categories, sorted(orphans))
+
+    dead = await db.find_dead_categories(retention_days)
+    report.dead_categories = len(dead)
+    for user_id, category_id in sorted(dead):
+        done = False
+        while not done:
+            deleted, done = await step(db.purge_category, user_id, category_id, retention_days, batch_size)
+            report.expenses += deleted
+            PURGED_EXPENSES.inc(amount=deleted)
+
+    if report.incremental:
+        while True:
+            reclaimed = await step(db.incremental_vacuum, vacuum_pages)
+            report.reclaimed += reclaimed
+            RECLAIMED_PAGES.inc(amount=reclaimed)
+            if reclaimed < vacuum_pages:
+                break
+
+    await step(db.analyze, analysis_limit)
+    report.pages_after, report.free_after, _, _ = await db.page_stats()
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def next_run(now, hour):
+    """Ближайшие hour:00 после now"""
+    run = datetime.combine(now.date(), datetime.min.time()) + timedelta(hours=hour)
+    return run if run > now else run + timedelta(days=1)
+
+
+class MaintenanceScheduler:
+    """Фоновая задача бота: run_maintenance раз в сутки в hour часов UTC (hour < 0 — никогда)"""
+
+    def __init__(self, db, hour=3, **options):
+        self.db = db
+        self.hour = hour
+        self.options = options
+
+    async def run(self):
+        while self.hour >= 0:
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            await asyncio.sleep((next_run(now, self.hour) - now).total_seconds())
+            try:
+                report = await run_maintenance(self.db, **self.options)
+            except Exception:
+                logger.exception("Обслуживание базы не удалось")
+            else:
+                logger.info(f"Обслуживание базы: {report.summary()}")
@@ -0,0 +1,116 @@
+"""Служебные команды для базы бота.
+
+Запуск: python manage.py <команда> [--db finance.db]
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+from database import Database
+
+# Таблицы с user_id, которые разносятся по шардам
+SHARDED_TABLES = ('user_categories', 'expenses', 'expense_daily', 'budgets')
+
+
+def rebuild_rollups(db, args):
+    db.rebuild_rollups()
+    print("Дневные итоги пересчитаны")
+
+
+def check_rollups(db, args):
+    mismatches = db.check_rollups()
+    for user_id, day, category_id, rollup_total, raw_total in mismatches[:20]:
+        print(f"user {user_id}, {day}, категория {category_id}: "
+              f"в итогах {rollup_total}, по расходам {raw_total}")
+    if mismatches:
+        print(f"Расхождений: {len(mismatches)}")
+        return 1
+    print("Дневные итоги совпадают с расходами")
+    return 0
+
+
+def shard(db, args):
+    """Разносит пользователей базы по файлам шардов для runner.py"""
+    from runner import shard_path
+
+    if args.workers < 2:
+        print("Для одного воркера шардирование не нужно")
+        return 1
+    for shard_id in range(args.workers):
+        path = shard_path(args.db, shard_id, args.workers)
+        if os.path.exists(path):
+            print(f"{path} уже существует, шардирование прервано")
+            return 1
+        # Схему и миграции создаёт сам Database, дальше копируем строки шарда
+        Database(path).close()
+        db.conn.execute("ATTACH DATABASE ? AS shard", (path,))
+        try:
+            db.conn.execute("BEGIN")
+            for table in SHARDED_TABLES:
+                db.conn.execute(
+                    f"INSERT INTO shard.{table} SELECT * FROM main.{table} WHERE user_id % ? = ?",
+                    (args.workers, shard_id)
+                )
+            db.conn.commit()
+        finally:
+            db.conn.execute("DETACH DATABASE shard")
+        users = db.conn.execute(
+            "SELECT COUNT(DISTINCT user_id) FROM user_categories WHERE user_id % ? = ?",
+            (args.workers, shard_id)
+        ).fetchone()[0]
+        print(f"{path}: пользователей {users}")
+    return 0
+
+
+def maintenance(db, args):
+    """Один проход фонового обслуживания прямо сейчас"""
+    from database import AsyncDatabase
+    from maintenance import run_maintenance
+
+    async def run():
+        async_db = AsyncDatabase(args.db)
+        try:
+            return await run_maintenance(async_db, retention_days=args.retention_days)
+        finally:
+            await async_db.close()
+
+    print(f"Обслуживание: {asyncio.run(run()).summary()}")
+
+
+def vacuum(db, args):
+    """Полный VACUUM и переход на incremental_vacuum; только при остановленном боте"""
+    pages, free, page_size, _ = db.page_stats()
+    db.vacuum()
+    after, _, _, auto_vacuum = db.page_stats()
+    print(f"Страниц {pages} → {after} (свободных было {free}, "
+          f"освобождено {max(pages - after, 0) * page_size / 1024 / 1024:.1f} МБ), auto_vacuum = {auto_vacuum}")
+
+
+COMMANDS = {
+    'rebuild-rollups': rebuild_rollups,
+    'check-rollups': check_rollups,
+    'shard': shard,
+    'maintenance': maintenance,
+    'vacuum': vacuum,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Служебные команды для базы бота")
+    parser.add_argument('command', choices=COMMANDS)
+    parser.add_argument('--db', default='finance.db', help="файл базы данных")
+    parser.add_argument('--workers', type=int, default=2, help="число шардов для команды shard")
+    parser.add_argument('--retention-days', type=int, default=30,
+                        help="через сколько дней удалённые категории вычищаются (maintenance)")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    try:
+        return COMMANDS[args.command](db, args) or 0
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
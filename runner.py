@@ -0,0 +1,313 @@
+"""Запуск бота в несколько процессов с шардированием по пользователям.
+
+runner.py поднимает N воркеров (bot.py в режиме worker), у каждого свои
+файлы БД и состояний. Сам runner получает обновления от Telegram (polling
+или webhook) и, не разбирая их целиком, пересылает воркеру user_id % N.
+Обновления одного пользователя всегда идут в один воркер и в порядке
+получения, поэтому FSM и данные пользователя живут в одном процессе.
+
+Запуск: python runner.py --workers 4
+Разнести существующую базу по шардам: python manage.py shard --workers 4
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import signal
+import subprocess
+import sys
+
+from aiohttp import ClientError, ClientResponseError, ClientSession, ClientTimeout, web
+
+from config import (
+    BOT_MODE, DB_PATH, STATE_DB, METRICS_PORT, SHARD_WORKERS, SHARD_BASE_PORT, TELEGRAM_API_URL, DIGEST_RATE,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT
+)
+
+logger = logging.getLogger('runner')
+
+
+# ========== ШАРДЫ ==========
+def shard_path(path, shard, workers):
+    """finance.db -> finance.shard0.db; при одном воркере путь не меняется"""
+    if workers == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}{ext}"
+
+
+def shard_for(user_id, workers):
+    return user_id % workers
+
+
+def extract_user_id(update):
+    """Автор обновления: from.id любого вложенного объекта, иначе id чата"""
+    for value in update.values():
+        if isinstance(value, dict):
+            if 'from' in value:
+                return value['from']['id']
+            if 'chat' in value:
+                return value['chat']['id']
+            if 'user' in value:
+                return value['user']['id']
+    return 0
+
+
+# ========== ВОРКЕРЫ ==========
+def start_workers(workers, base_port, extra_env=None, output=None):
+    processes = []
+    for shard in range(workers):
+        env = dict(os.environ, **(extra_env or {}))
+        env.update({
+            'BOT_MODE': 'worker',
+            'WEBHOOK_HOST': '127.0.0.1',
+            'WEBHOOK_PORT': str(base_port + shard),
+            'WEBHOOK_PATH': '/webhook',
+            'DB_PATH': shard_path(env.get('DB_PATH', DB_PATH), shard, workers),
+            'STATE_DB': shard_path(env.get('STATE_DB', STATE_DB), shard, workers),
+        })
+        # Лимит Telegram общий на бота: рассылку дайджестов делят поровну между шардами
+        env['DIGEST_RATE'] = str(float(env.get('DIGEST_RATE', DIGEST_RATE)) / workers)
+        # Метрики воркеров — на соседних портах: METRICS_PORT + 1 + номер шарда
+        metrics_port = int(env.get('METRICS_PORT', METRICS_PORT))
+        env['METRICS_PORT'] = str(metrics_port + 1 + shard if metrics_port else 0)
+        processes.append(subprocess.Popen([sys.executable, 'bot.py'], env=env, stdout=output, stderr=output))
+    return processes
+
+
+async def wait_healthy(client, urls, timeout=60):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    for url in urls:
+        while True:
+            try:
+                async with client.get(url) as response:
+                    if response.status == 200:
+                        break
+            except OSError:
+                pass
+            if loop.time() > deadline:
+                raise RuntimeError(f"Воркер {url} не запустился")
+            await asyncio.sleep(0.2)
+
+
+async def watch_workers(processes, stop):
+    """Останавливает runner, если воркер умер: его обновления некуда пересылать"""
+    while not stop.is_set():
+        for shard, process in enumerate(processes):
+            if process.poll() is not None:
+                logger.error(f"Воркер {shard} завершился с кодом {process.returncode}, останавливаемся")
+                stop.set()
+                return
+        await asyncio.sleep(1)
+
+
+def stop_workers(processes, timeout=30):
+    for process in processes:
+        process.send_signal(signal.SIGTERM)
+    for process in processes:
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+# ========== МАРШРУТИЗАЦИЯ ==========
+class UpdateRouter:
+    """Пересылает сырые обновления воркерам, сохраняя порядок для каждого пользователя
+
+    У каждого воркера несколько полос (lanes) со своей очередью и задачей
+    пересылки. Пользователь всегда попадает в одну полосу, а полоса шлёт
+    следующее обновление только после ответа на предыдущее — так порядок
+    сообщений пользователя сохраняется, а разные пользователи не ждут друг друга.
+
+    Если воркер недоступен или отвечает 5xx, полоса повторяет то же
+    обновление, пока не дождётся ответа: Telegram его уже не пришлёт.
+    После close() повторов не больше attempts — воркер может быть уже
+    остановлен. Ответ 4xx означает, что воркер не принимает само
+    обновление, и оно отбрасывается.
+    """
+
+    def __init__(self, client, worker_urls, lanes=8, attempts=5, max_backoff=5.0):
+        self.client = client
+        self.worker_urls = worker_urls
+        self.lanes = lanes
+        self.attempts = attempts
+        self.max_backoff = max_backoff
+        self.queues = [asyncio.Queue() for _ in range(len(worker_urls) * lanes)]
+        self.forwarded = 0
+        self.dropped = 0
+        self._closing = False
+        self._tasks = [
+            asyncio.create_task(self._forward(queue, worker_urls[index // lanes]))
+            for index, queue in enumerate(self.queues)
+        ]
+
+    def route(self, update):
+        user_id = extract_user_id(update)
+        workers = len(self.worker_urls)
+        lane = (user_id // workers) % self.lanes
+        self.queues[shard_for(user_id, workers) * self.lanes + lane].put_nowait(update)
+
+    async def _forward(self, queue, url):
+        while True:
+            update = await queue.get()
+            if update is None:
+                return
+            await self._deliver(update, url)
+
+    async def _deliver(self, update, url):
+        delay = 0.1
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with self.client.post(url, json=update) as response:
+                    response.raise_for_status()
+                self.forwarded += 1
+                return
+            except (ClientError, asyncio.TimeoutError) as e:
+                rejected = isinstance(e, ClientResponseError) and e.status < 500
+                if rejected or (self._closing and attempt >= self.attempts):
+                    self.dropped += 1
+                    logger.error(f"Обновление {update.get('update_id')} не переслано в {url}: {e}")
+                    return
+                logger.warning(f"Пересылка обновления {update.get('update_id')} в {url} не удалась "
+                               f"(попытка {attempt}), повтор через {delay:.1f} с: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+
+    async def close(self):
+        """Дожидается пересылки всего, что уже в очередях"""
+        self._closing = True
+        for queue in self.queues:
+            queue.put_nowait(None)
+        await asyncio.gather(*self._tasks)
+
+
+# ========== ПРИЁМ ОБНОВЛЕНИЙ ==========
+async def poll_updates(client, api_url, token, router, stop):
+    """Долгий опрос getUpdates; обновления не разбираются в объекты aiogram
+
+    Сбои сети и ответы {"ok": false} (409 — бот опрашивает кто-то ещё,
+    429, 5xx) не останавливают опрос: повтор идёт с растущей паузой
+    или через retry_after, если Telegram его назвал.
+    """
+    base = f"{api_url.rstrip('/')}/bot{token}"
+    async with client.post(f"{base}/deleteWebhook") as response:
+        response.raise_for_status()
+
+    offset = 0
+    delay = 1
+    while not stop.is_set():
+        try:
+            async with client.post(f"{base}/getUpdates", json={'offset': offset, 'timeout': 30},
+                                   timeout=ClientTimeout(total=40)) as response:
+                # HTML-страница 502 от прокси — тоже ClientError (ContentTypeError)
+                payload = await response.json()
+        except (ClientError, OSError, asyncio.TimeoutError, ValueError) as e:
+            logger.warning(f"getUpdates не удался, повтор через {delay} с: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+            continue
+        if not payload.get('ok'):
+            retry_after = (payload.get('parameters') or {}).get('retry_after')
+            wait = retry_after or delay
+            logger.warning(f"getUpdates: {payload.get('error_code')} {payload.get('description')}, "
+                           f"повтор через {wait} с")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, 30)
+            continue
+        delay = 1
+        for update in payload['result']:
+            router.route(update)
+            offset = update['update_id'] + 1
+
+
+async def serve_webhook(client, api_url, token, router, stop):
+    """Telegram присылает обновления на WEBHOOK_URL, runner раскладывает их по шардам"""
+    if not WEBHOOK_URL:
+        raise RuntimeError("Для режима webhook нужен WEBHOOK_URL в .env")
+
+    async def handle_update(request):
+        if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return web.Response(body="Unauthorized", status=401)
+        router.route(await request.json())
+        return web.json_response({})
+
+    async def handle_health(request):
+        return web.json_response({
+            'status': 'ok',
+            'queued': [queue.qsize() for queue in router.queues],
+            'forwarded': router.forwarded,
+        })
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get('/health', handle_health)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+
+    payload = {'url': f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}"}
+    if WEBHOOK_SECRET:
+        payload['secret_token'] = WEBHOOK_SECRET
+    async with client.post(f"{api_url.rstrip('/')}/bot{token}/setWebhook", json=payload) as response:
+        response.raise_for_status()
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run(workers, base_port, mode):
+    token = os.getenv('BOT_TOKEN')
+    if not token:
+        raise RuntimeError("Токен не найден! Проверь файл .env")
+    api_url = TELEGRAM_API_URL or 'https://api.telegram.org'
+
+    processes = start_workers(workers, base_port)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    try:
+        async with ClientSession() as client:
+            await wait_healthy(client, [f"http://127.0.0.1:{base_port + i}/health" for i in range(workers)])
+            router = UpdateRouter(client, [f"http://127.0.0.1:{base_port + i}/webhook" for i in range(workers)])
+            logger.info(f"Запущено воркеров: {workers}, режим: {mode}")
+
+            receiver = serve_webhook if mode == 'webhook' else poll_updates
+            task = asyncio.create_task(receiver(client, api_url, token, router, stop))
+            # Упавший приём обновлений останавливает runner, а не оставляет его ждать сигнала
+            task.add_done_callback(lambda _: stop.set())
+            watcher = asyncio.create_task(watch_workers(processes, stop))
+            try:
+                await stop.wait()
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+            finally:
+                watcher.cancel()
+                await router.close()
+    finally:
+        stop_workers(processes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуск бота в несколько процессов")
+    parser.add_argument('--workers', type=int, default=SHARD_WORKERS)
+    parser.add_argument('--base-port', type=int, default=SHARD_BASE_PORT)
+    parser.add_argument('--mode', choices=('polling', 'webhook'),
+                        default='webhook' if BOT_MODE == 'webhook' else 'polling')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(run(args.workers, args.base_port, args.mode))
+
+
+if __name__ == '__main__':
+    main()
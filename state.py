@@ -0,0 +1,204 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+from database import DEFAULT_PROFILE
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ('state', 'data', 'touched')
+
+    def __init__(self, state=None, data=None, touched=None):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.touched = touched if touched is not None else time.time()
+
+    def is_empty(self):
+        return self.state is None and not self.data
+
+
+class StateStore(BaseStorage):
+    """Хранилище состояний пользователей: FSM aiogram и временные данные бота.
+
+    Горячие записи лежат в памяти (не больше max_hot, вытесняются по LRU),
+    изменения раз в flush_interval секунд пачкой пишутся в SQLite, поэтому
+    перезапуск бота не теряет пользователей посреди ввода суммы. Записи,
+    к которым не обращались дольше ttl секунд, удаляются и из памяти, и с диска.
+    """
+
+    def __init__(self, db_name='state.db', ttl=7 * 24 * 3600, max_hot=10000, flush_interval=1.0):
+        self.ttl = ttl
+        self.max_hot = max_hot
+        self.flush_interval = flush_interval
+        self.key_builder = DefaultKeyBuilder(
+            with_bot_id=True, with_business_connection_id=True, with_destiny=True
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state')
+        self._conn = self._executor.submit(self._connect, db_name).result()
+        self._hot = OrderedDict()  # {ключ: _Entry}, порядок — давность обращения
+        self._dirty = {}           # {ключ: _Entry}, ещё не записанные на диск
+        self._flusher = None
+        self._closed = False
+
+    # ========== SQLITE (выполняется в отдельном потоке) ==========
+    @staticmethod
+    def _connect(db_name):
+        # WAL и synchronous=NORMAL: сброс раз в секунду не ждёт fsync на каждый commit
+        conn = DEFAULT_PROFILE.connect(db_name)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS user_state (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_user_state_updated ON user_state (updated_at)')
+        conn.commit()
+        return conn
+
+    def _load(self, key):
+        return self._conn.execute(
+            'SELECT state, data, updated_at FROM user_state WHERE key = ?', (key,)
+        ).fetchone()
+
+    def _save(self, upserts, deletes, expired_before):
+        with self._conn:
+            self._conn.executemany('''
+                INSERT INTO user_state (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE
+                SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+            ''', upserts)
+            self._conn.executemany('DELETE FROM user_state WHERE key = ?', deletes)
+            self._conn.execute('DELETE FROM user_state WHERE updated_at < ?', (expired_before,))
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    # ========== ГОРЯЧИЙ СЛОЙ ==========
+    async def _get_entry(self, key):
+        entry = self._hot.get(key)
+        if entry is None:
+            entry = self._dirty.get(key)
+        if entry is None:
+            row = await self._run(self._load, key)
+            # Пока читали с диска, запись могли создать
+            entry = self._hot.get(key) or self._dirty.get(key)
+            if entry is None:
+                if row is not None and row[2] >= time.time() - self.ttl:
+                    entry = _Entry(row[0], json.loads(row[1]), row[2])
+                else:
+                    entry = _Entry()
+
+        entry.touched = time.time()
+        self._hot[key] = entry
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.max_hot:
+            self._hot.popitem(last=False)  # несохранённые изменения остаются в _dirty
+        return entry
+
+    def _mark_dirty(self, key, entry):
+        self._dirty[key] = entry
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                # Изменения остались в _dirty, следующий сброс запишет их снова
+                logger.exception(f"Не удалось сохранить состояния пользователей ({len(self._dirty)} записей)")
+
+    async def flush(self):
+        """Записывает изменения на диск и забывает давно неактивных пользователей"""
+        expired_before = time.time() - self.ttl
+        while self._hot:
+            key, entry = next(iter(self._hot.items()))
+            if entry.touched >= expired_before:
+                break
+            del self._hot[key]
+
+        entries = list(self._dirty.items())
+        self._dirty = {}
+        # Сериализуем здесь: в потоке записи данные могли бы меняться на ходу
+        upserts = []
+        deletes = []
+        pending = []
+        for key, entry in entries:
+            if entry.is_empty():
+                deletes.append((key,))
+            else:
+                try:
+                    upserts.append((key, entry.state, json.dumps(entry.data, ensure_ascii=False), entry.touched))
+                except (TypeError, ValueError):
+                    # Повтор не поможет, а остальных пользователей такая запись задерживать не должна
+                    logger.exception(f"Состояние {key} не сериализуется в JSON и не будет сохранено")
+                    continue
+            pending.append((key, entry))
+        try:
+            # shield: отмена фоновой задачи не должна терять уже снятые изменения
+            await asyncio.shield(self._run(self._save, upserts, deletes, expired_before))
+        except Exception:
+            # Не потеряем изменения: вернём их, если новых поверх ещё нет
+            for key, entry in pending:
+                self._dirty.setdefault(key, entry)
+            raise
+
+    # ========== FSM AIOGRAM ==========
+    async def set_state(self, key, state=None):
+        storage_key = self.key_builder.build(key)
+        entry = await self._get_entry(storage_key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(storage_key, entry)
+
+    async def get_state(self, key):
+        return (await self._get_entry(self.key_builder.build(key))).state
+
+    async def set_data(self, key, data):
+        storage_key = self.key_builder.build(key)
+        entry = await self._get_entry(storage_key)
+        entry.data = data.copy()
+        self._mark_dirty(storage_key, entry)
+
+    async def get_data(self, key):
+        return (await self._get_entry(self.key_builder.build(key))).data.copy()
+
+    # ========== ВРЕМЕННЫЕ ДАННЫЕ ПОЛЬЗОВАТЕЛЯ ==========
+    async def get_user_data(self, user_id):
+        """Данные пользователя вне FSM (режим редактирования, выбранная категория)"""
+        return (await self._get_entry(f'user:{user_id}')).data.copy()
+
+    async def update_user_data(self, user_id, **values):
+        """Обновляет данные пользователя; значение None удаляет ключ"""
+        key = f'user:{user_id}'
+        entry = await self._get_entry(key)
+        for name, value in values.items():
+            if value is None:
+                entry.data.pop(name, None)
+            else:
+                entry.data[name] = value
+        self._mark_dirty(key, entry)
+
+    async def close(self):
+        # Закрывают дважды: диспетчер при остановке и App.close()
+        if self._closed:
+            return
+        self._closed = True
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,111 @@
+"""Итоги месяца в памяти (на них считаются бюджеты) после случайных
+последовательностей операций должны совпадать с суммами SQL по самим расходам.
+
+Несколько пользователей параллельно добавляют расходы (они пишутся
+пачками), читают итоги месяца до, во время и после записи пачки,
+импортируют расходы за этот и прошлый месяц, очищают статистику,
+удаляют и добавляют категории.
+После каждого раунда итоги из кэша AsyncDatabase сверяются с
+SUM(amount) по таблице expenses.
+"""
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from database import AsyncDatabase, Database, current_month
+
+
+def sql_totals(db, user_id):
+    """Эталон: траты текущего месяца по неудалённым категориям прямо из expenses"""
+    db.cursor.execute('''
+        SELECT e.category_id, SUM(e.amount)
+        FROM expenses e
+        JOIN user_categories uc ON uc.id = e.category_id
+        WHERE e.user_id = ? AND uc.is_deleted = 0 AND e.created_at >= ?
+        GROUP BY e.category_id
+    ''', (user_id, f'{current_month()}-01'))
+    return dict(db.cursor.fetchall())
+
+
+def differs(totals, expected):
+    if abs(totals.total - sum(expected.values())) > 1e-6:
+        return True
+    keys = totals.by_category.keys() | expected.keys()
+    return any(abs(totals.by_category.get(k, 0.0) - expected.get(k, 0.0)) > 1e-6 for k in keys)
+
+
+def random_moment(rng):
+    """Момент в этом или прошлом месяце, не позже текущего"""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    start = month_start - timedelta(days=31) if rng.random() < 0.3 else month_start
+    moment = start + (now - start) * rng.random()
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+async def delayed(coro, seconds):
+    await asyncio.sleep(seconds)
+    return await coro
+
+
+async def user_round(db, rng, user_id):
+    categories = [row[0] for row in await db.get_user_categories(user_id)]
+    operation = rng.random()
+    if operation < 0.55:
+        # Несколько расходов подряд и чтения итогов до, во время и после записи пачки;
+        # половину раз итоги сначала вытесняются из кэша, как при нехватке места
+        if rng.random() < 0.5:
+            db.month_totals.invalidate(user_id)
+        writes = [db.add_expense(user_id, rng.choice(categories), round(rng.uniform(1, 500), 2))
+                  for _ in range(rng.randint(1, 5))]
+        reads = [delayed(db.get_month_totals(user_id), rng.uniform(0, 0.006)) for _ in range(3)]
+        await asyncio.gather(*writes, *reads)
+    elif operation < 0.7:
+        rows = [(rng.choice(categories), round(rng.uniform(1, 500), 2), random_moment(rng))
+                for _ in range(rng.randint(1, 20))]
+        await asyncio.gather(db.import_expenses(user_id, rows), db.get_month_totals(user_id))
+    elif operation < 0.8:
+        await db.clear_category_statistics(user_id, rng.choice(categories))
+    elif operation < 0.85:
+        await db.clear_user_statistics(user_id)
+    elif operation < 0.93 and len(categories) > 1:
+        await db.delete_category(user_id, rng.choice(categories))
+    else:
+        # Новая категория или возврат удалённой (с прежним id и расходами)
+        await db.add_category(user_id, rng.choice(['Кафе', 'Дом', 'Еда', 'Спорт']), '➕')
+    await db.get_month_totals(user_id)
+
+
+async def run_rounds(path, users, rounds, seed):
+    """Возвращает расхождения [(раунд, пользователь, в памяти, в базе)] и число чтений из кэша"""
+    rng = random.Random(seed)
+    db = AsyncDatabase(path, batch_interval=0.002, readers=2)
+    reference = Database(path)
+    user_ids = list(range(1, users + 1))
+    for user_id in user_ids:
+        await db.init_user_categories(user_id)
+
+    mismatches = []
+    try:
+        for number in range(rounds):
+            await asyncio.gather(*(user_round(db, random.Random(rng.random()), u) for u in user_ids))
+            for user_id in user_ids:
+                # Сверяем именно то, что лежит в памяти, без перечитывания
+                totals = db.month_totals.peek(user_id)
+                expected = sql_totals(reference, user_id)
+                if totals is not None and differs(totals, expected):
+                    mismatches.append((number, user_id, (totals.total, totals.by_category), expected))
+    finally:
+        await db.close()
+        reference.close()
+    return mismatches, db.month_totals.hits
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_month_totals_match_sql(tmp_path, seed):
+    mismatches, hits = asyncio.run(run_rounds(str(tmp_path / 'check.db'), users=8, rounds=60, seed=seed))
+    assert mismatches == []
+    # Проверка имеет смысл, только если итоги действительно отдавались из кэша
+    assert hits > 0
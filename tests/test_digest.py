@@ -0,0 +1,43 @@
+"""Рассылка дайджестов: падение посреди рассылки, продолжение и лимиты.
+
+Сценарий из benchmarks.digest_check прогоняется один раз на модуль:
+рассылка в отдельном процессе убивается SIGKILL, запускается заново
+и запускается третий раз. Лимит частоты низкий, чтобы процесс точно
+был убит посреди рассылки.
+"""
+import pytest
+
+from benchmarks.digest_check import parse_args, run_scenario
+
+
+@pytest.fixture(scope='module')
+def args():
+    return parse_args(['--users', '1000', '--expenses', '60000', '--rate', '100', '--kill-after', '0.8'])
+
+
+@pytest.fixture(scope='module')
+def report(args, tmp_path_factory):
+    return run_scenario(args, str(tmp_path_factory.mktemp('digest')))
+
+
+def test_crash_leaves_saved_progress(report):
+    # Рассылка убита до конца: прогресс сохранён, но не помечен завершённым
+    assert report['crashed_at'] is not None
+    assert report['crashed_at'][3] is None
+
+
+def test_resume_delivers_to_everyone_once(report):
+    assert report['missing'] == set()
+    assert report['unexpected'] == set()
+    assert report['wrong'] == 0
+
+
+def test_no_double_send(report):
+    # Повторяются только сообщения, ушедшие после последнего сохранения прогресса
+    assert report['duplicates'] <= report['allowed_duplicates']
+    # Завершённую рассылку повторный запуск не начинает
+    assert report['again'] is None
+
+
+def test_rate_limit_respected(report):
+    assert report['results']['flood'] == 0
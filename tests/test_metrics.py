@@ -0,0 +1,9 @@
+"""Текстовый формат метрик"""
+from metrics import Counter, Registry
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    counter = Counter('test_total', 'Тест', ('path',), registry=registry)
+    counter.inc('C:\\temp\n"x"')
+    assert 'test_total{path="C:\\\\temp\\n\\"x\\""} 1' in registry.render()
@@ -0,0 +1,20 @@
+"""Горячие запросы Database идут по индексам: в планах нет полного обхода (SCAN)"""
+import pytest
+
+from benchmarks.query_plans import HOT_METHODS, build_plans_db, capture_queries, full_scans
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = build_plans_db(str(tmp_path / 'plans.db'))
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize('method, args', HOT_METHODS, ids=[method for method, _ in HOT_METHODS])
+def test_hot_queries_use_indexes(db, method, args):
+    queries = capture_queries(db, method, args)
+    assert queries, f"{method} не выполнил ни одного запроса"
+    for query in queries:
+        scans, details = full_scans(db, query)
+        assert not scans, f"{method}: {'; '.join(details)}\n{query}"
@@ -0,0 +1,32 @@
+"""Polling и webhook доставляют обновления одинаково: на каждое — ровно один ответ"""
+import asyncio
+
+import pytest
+
+from benchmarks.transport import deliver
+
+USERS = 20
+MESSAGES = 3
+
+
+def run_mode(mode, tmp_path):
+    paths = {'db_path': str(tmp_path / f'{mode}.db'), 'state_path': str(tmp_path / f'{mode}_state.db')}
+    # Без таймаута потерянное обновление подвесило бы тест в ожидании ответа
+    tracker, _ = asyncio.run(asyncio.wait_for(deliver(mode, USERS, MESSAGES, **paths), timeout=60))
+    return tracker
+
+
+@pytest.fixture(scope='module')
+def replies(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp('transport')
+    return {mode: run_mode(mode, tmp_path).replies for mode in ('polling', 'webhook')}
+
+
+@pytest.mark.parametrize('mode', ['polling', 'webhook'])
+def test_every_update_gets_one_reply(replies, mode):
+    assert sorted(replies[mode]) == list(range(1, USERS + 1))
+    assert all(len(texts) == MESSAGES for texts in replies[mode].values())
+
+
+def test_modes_reply_the_same(replies):
+    assert replies['polling'] == replies['webhook']
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+
+from aiogram import BaseMiddleware
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Ведро токенов: rate штук в секунду, не больше burst подряд"""
+
+    __slots__ = ('tokens', 'updated_at')
+
+    def __init__(self, burst):
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def take(self, rate, burst):
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class UserLock:
+    """Замок пользователя и число его обновлений, которые ждут или обрабатываются"""
+
+    __slots__ = ('lock', 'pending')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+
+
+class UserSerializer(BaseMiddleware):
+    """Внешний middleware для dp.update: порядок, лимиты и справедливость.
+
+    - обновления одного пользователя обрабатываются строго по очереди
+      (выбор категории не гоняется с вводом суммы за user_data);
+    - одновременно обрабатывается не больше max_concurrent обновлений;
+    - каждому пользователю — rate обновлений в секунду с запасом burst,
+      лишние отбрасываются, а пользователь один раз получает предупреждение.
+
+    Сначала берётся замок пользователя, потом общий слот: пока у
+    флудящего пользователя копится очередь, он занимает не больше одного
+    слота и не мешает остальным.
+    """
+
+    def __init__(self, max_concurrent=100, rate=3.0, burst=10, max_users=100000):
+        self.rate = rate
+        self.burst = burst
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._locks = {}  # {user_id: UserLock}, только пока есть обновления
+        self._buckets = LRUCache(maxsize=max_users)
+        self._warned = LRUCache(maxsize=max_users, ttl=burst / rate if rate else None)
+
+        # Метрики
+        self.waiting = 0            # обновлений ждут замка или слота прямо сейчас
+        self.max_waiting = 0
+        self.processed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+
+        if not self._allow(user.id):
+            self.rejected += 1
+            await self._warn(user.id, data)
+            return None
+
+        entry = self._locks.get(user.id)
+        if entry is None:
+            entry = self._locks[user.id] = UserLock()
+        entry.pending += 1
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        started = time.perf_counter()
+        queued = True
+        try:
+            async with entry.lock:
+                async with self._slots:
+                    self._record_wait(time.perf_counter() - started)
+                    queued = False
+                    return await handler(event, data)
+        finally:
+            if queued:
+                self.waiting -= 1
+            entry.pending -= 1
+            if not entry.pending:
+                del self._locks[user.id]
+
+    def _allow(self, user_id):
+        if not self.rate:
+            return True
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.burst)
+            self._buckets.set(user_id, bucket)
+        return bucket.take(self.rate, self.burst)
+
+    def _record_wait(self, seconds):
+        self.waiting -= 1
+        self.processed += 1
+        self.wait_seconds_total += seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    async def _warn(self, user_id, data):
+        # Предупреждаем один раз, пока ведро не наполнится снова
+        if self._warned.get(user_id) is not None:
+            return
+        self._warned.set(user_id, True)
+        logger.warning(f"Пользователь {user_id} превысил лимит сообщений")
+        chat = data.get('event_chat')
+        if chat is not None:
+            try:
+                await data['bot'].send_message(chat.id, "⏳ Слишком много сообщений, подожди пару секунд")
+            except Exception as e:
+                logger.error(f"Не удалось предупредить пользователя {user_id}: {e}")
+
+    def queue_depth(self, user_id):
+        """Сколько обновлений пользователя ждут или обрабатываются"""
+        entry = self._locks.get(user_id)
+        return entry.pending if entry is not None else 0
+
+    def stats(self):
+        return {
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'active_users': len(self._locks),
+            'max_user_depth': max((entry.pending for entry in self._locks.values()), default=0),
+            'processed': self.processed,
+            'rejected': self.rejected,
+            'wait_avg_ms': self.wait_seconds_total / self.processed * 1000 if self.processed else 0.0,
+            'wait_max_ms': self.wait_seconds_max * 1000,
+        }
@@ -0,0 +1,64 @@
+import asyncio
+import contextlib
+import signal
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    """Обработчик вебхука, который при остановке дожидается начатых обновлений"""
+
+    @property
+    def pending(self):
+        return len(self._background_feed_update_tasks)
+
+    async def drain(self, app):
+        if self._background_feed_update_tasks:
+            await asyncio.gather(*self._background_feed_update_tasks, return_exceptions=True)
+
+
+async def handle_health(request):
+    """Проверка живости для балансировщика и мониторинга"""
+    handler = request.app['webhook_handler']
+    health = {'status': 'ok', 'pending_updates': handler.pending}
+    if request.app['metrics'] is not None:
+        health['updates'] = request.app['metrics']()
+    return web.json_response(health)
+
+
+def create_webhook_app(dp, bot, path='/webhook', secret_token=None, metrics=None):
+    """aiohttp-приложение: POST path принимает обновления, GET /health — проверка
+
+    metrics — необязательная функция, чей словарь добавляется в ответ /health.
+    """
+    app = web.Application()
+    handler = DrainingRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token)
+    app['webhook_handler'] = handler
+    app['metrics'] = metrics
+
+    # Порядок остановки: доработать начатые обновления, затем остановить
+    # диспетчер (он сохранит состояния) и закрыть сессию бота
+    app.on_shutdown.append(handler.drain)
+    handler.register(app, path=path)
+    app.router.add_get('/health', handle_health)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def serve(app, host, port):
+    """Запускает приложение и работает до SIGINT/SIGTERM, затем мягко останавливается"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()